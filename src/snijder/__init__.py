@@ -2,7 +2,7 @@
 
 """Manage job-queues for multiple users with very inhomogeneous jobs."""
 
-from .logger import logi, logd, logw, logc, loge
+from .logger import logi, logd, logw, logc, loge, lazy, debug_enabled
 
 __author__ = "Niko Ehrenfeuchter"
 __version__ = "7.0.3"
@@ -9,10 +9,35 @@ AbstractApp()
 """
 
 import os
+import time
 import gc3libs
+from gc3libs.quantity import MiB, minutes
 
 from .. import logi, logd, logw, logc
 
+# name of the file (in the app's output directory) recording the true exit code:
+EXITCODE_FILE = "exitcode.txt"
+
+def record_exitcode(arguments):
+    """Wrap a command so its exit code is written to a file on termination.
+
+    gc3pie represents every non-zero exit code as 255, so a POSIX shell wrapper
+    keeps track of the real one in `EXITCODE_FILE`. The shell reports a process
+    terminated by a signal as 128 plus the signal number, which can't be told apart
+    from a regular exit code (see `snijder.retry` for how they are treated).
+
+    Parameters
+    ----------
+    arguments : list(str)
+        The command to be wrapped.
+
+    Returns
+    -------
+    list(str)
+    """
+    wrapper = ["/bin/sh", "-c", '"$@"; rc=$?; echo $rc > %s; exit $rc' % EXITCODE_FILE]
+    return wrapper + ["snijder-exitcode"] + list(arguments)
+
 
 class AbstractApp(gc3libs.Application):
 
@@ -35,6 +60,22 @@ class AbstractApp(gc3libs.Application):
         if self.__class__.__name__ == "AbstractApp":
             raise TypeError("Refusing to instantiate class 'AbstractApp'!")
         self.job = job  # remember the job object
+        self.cgroup = None
+        self.killed = False
+        # the time the app has been suspended (see `snijder.preempt`):
+        self.suspended_at = None
+        self.suspended_time = 0.0
+        # apps are created by the spooler when their job gets dispatched:
+        self.dispatched = time.time()
+        appconfig["arguments"] = record_exitcode(appconfig["arguments"])
+        appconfig["outputs"] = appconfig["outputs"] + [EXITCODE_FILE]
+        # pass on the resources requested in the job description (if any):
+        if job.get("cores") is not None:
+            appconfig.setdefault("requested_cores", job["cores"])
+        if job.get("memory") is not None:
+            appconfig.setdefault("requested_memory", job["memory"] * MiB)
+        if job.get("walltime") is not None:
+            appconfig.setdefault("requested_walltime", job["walltime"] * minutes)
         logd("gc3_output_dir: %s", appconfig["output_dir"])
         logd("self.job: %s", job)
         logi(
@@ -58,11 +99,17 @@ class AbstractApp(gc3libs.Application):
 
     def running(self):
         """Called when the job state transitions to RUNNING."""
+        # when being resumed, the job has been running already:
+        if self.job.last_phase() != "running":
+            self.job.mark("running")
         self.status_changed()
 
     def stopped(self):
         """Called when the job state transitions to STOPPED."""
         self.status_changed()
+        if self.suspended_at is not None:
+            logi("Job [uid:%.7s] has been suspended.", self.job["uid"])
+            return
         logc(
             "Job [uid:%.7s] has been suspended for an unknown reason!!!",
             self.job["uid"],
@@ -70,28 +117,70 @@ class AbstractApp(gc3libs.Application):
 
     def submitted(self):
         """Called when the job state transitions to SUBMITTED."""
+        self.job.mark("submitted")
         self.status_changed()
 
+    def confine(self, cgroups):
+        """Launch the app in a cgroup of its own, limited to the requested resources.
+
+        Parameters
+        ----------
+        cgroups : snijder.cgroups.CgroupManager
+            The manager to create the cgroup with. In case no cgroup can be created,
+            the app will be launched unconfined.
+        """
+        memory = None
+        if self.job.get("memory") is not None:
+            memory = self.job["memory"] * 1024 * 1024
+        self.cgroup = cgroups.create(self.job["uid"], self.requested_cores, memory)
+        if self.cgroup is not None:
+            self.arguments = self.cgroup.wrap(self.arguments)
+
+    def kill(self, **extra_args):
+        """Kill the app, remembering it was explicitly requested to stop."""
+        self.killed = True
+        super(AbstractApp, self).kill(**extra_args)
+
+    def read_exitcode(self):
+        """Read the true exit code of the job process from its output directory.
+
+        Falls back to the exit code reported by gc3pie if the file recording it
+        can't be read (e.g. as the job has been killed).
+
+        Returns
+        -------
+        (int, int)
+            A tuple with the exit code and the number of the signal that terminated
+            the process (0 if none), the exit code being `None` if unknown. A signal
+            is only reported if the engine saw the wrapper itself being terminated
+            by one, in which case the file hasn't been written.
+        """
+        try:
+            with open(os.path.join(self.output_dir, EXITCODE_FILE), "r") as fileobj:
+                exitcode = int(fileobj.read().strip())
+        except (IOError, ValueError) as err:
+            logd("Unable to read exit code file, using gc3pie's one: %s", err)
+            return (self.execution.exitcode, getattr(self.execution, "signal", 0))
+        return (exitcode, 0)
+
     def terminated(self):
         """This is called when the app has terminated execution."""
+        self.job.mark("terminated")
         self.status_changed()
         self.execution_stats()
-        if self.execution.exitcode is None:
-            # TODO: we could let the app know it was killed
-            #       currently, were guessing from the exitcode 'None' that the
-            #       app was explicitly killed by gc3pie - it would be cleaner
-            #       to explicitly cover this situation e.g. in the spooler's
-            #       cleanup() method by telling the app it is requested to stop
+        if self.cgroup is not None:
+            self.cgroup.remove()
+        self.job["exitcode"], self.job["signal"] = self.read_exitcode()
+        if self.killed:
+            logw("Job [uid:%.7s] was killed on request.", self.job["uid"])
+        elif self.job["exitcode"] is None:
             logw("Job [uid:%.7s] was killed or crahsed!", self.job["uid"])
-        elif self.execution.exitcode != 0:
-            # IMPORTANT: gc3pie does NOT seem to pass on the exit code of
-            # the job in this value, instead every non-zero exit code is
-            # represented as 255 - which means we can NOT DERIVE from this how
-            # the job process has finished!
+        elif self.job["exitcode"] != 0:
             logc(
-                "Job [uid:%.7s] terminated with unexpected EXIT CODE: %s!",
+                "Job [uid:%.7s] terminated with unexpected EXIT CODE: %s (signal %s)!",
                 self.job["uid"],
-                self.execution.exitcode,
+                self.job["exitcode"],
+                self.job["signal"],
             )
         else:
             logi(
@@ -32,8 +32,10 @@ class HuCoreApp(AbstractApp):
         if self.__class__.__name__ == "HuCoreApp":
             raise TypeError("Not instantiating the virtual class 'HuCoreApp'!")
         # we need to add the template (with the local path) to the list of
-        # files that need to be transferred to the system running hucore:
-        job["infiles"].append(job["template"])
+        # files that need to be transferred to the system running hucore (unless
+        # the job is retried, in which case this has been done already):
+        if job["template"] not in job["infiles"]:
+            job["infiles"].append(job["template"])
         # for the execution on the remote host, we need to strip all paths from
         # this string as the template file will end up in the temporary
         # processing directory together with all the images:
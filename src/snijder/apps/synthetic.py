@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+GC3lib application class for synthetic workloads, e.g. for benchmarking.
+
+Classes
+-------
+
+SyntheticApp()
+    The gc3libs application running the synthetic load worker script.
+"""
+
+import os
+
+from . import AbstractApp
+from .. import logi
+
+# the worker script, staged into the job directory together with the inputs:
+WORKER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "synthetic_worker.py"
+)
+
+
+class SyntheticApp(AbstractApp):
+
+    """App object for 'synthetic' jobs.
+
+    Runs a worker script generating a configurable load (CPU time and threads,
+    memory footprint, I/O on the staged inputs and the size of the output), so the
+    dispatching, staging and accounting can be exercised without hucore. The output
+    is collected in a directory `results_<UID>` like for hucore jobs.
+    """
+
+    def __init__(self, job, output_dir):
+        """Set up the synthetic job.
+
+        Parameters
+        ----------
+        job : snijder.jobs.JobDescription
+        output_dir : str
+        """
+        gc3_output_dir = os.path.join(output_dir, "results_%s" % job["uid"])
+        infiles = [os.path.basename(infile) for infile in job["infiles"]]
+        appconfig = dict(
+            arguments=[
+                # the interpreter running the spooler might not exist on the
+                # execution host, so use the one found there:
+                "python",
+                os.path.basename(WORKER),
+                "--cpu",
+                str(job["cpu"]),
+                "--threads",
+                str(job["threads"]),
+                "--footprint",
+                str(job["footprint"]),
+                "--read",
+                str(job["read"]),
+                "--write",
+                str(job["write"]),
+                "--output",
+                str(job["output"]),
+            ]
+            + infiles,
+            inputs=job["infiles"] + [WORKER],
+            outputs=["output"],
+            output_dir=gc3_output_dir,
+        )
+        # unless requested otherwise, reserve one core per thread:
+        if job.get("cores") is None:
+            appconfig["requested_cores"] = job["threads"]
+        # combine stdout & stderr:
+        appconfig.update(stderr="stdout.txt", stdout="stdout.txt")
+        super(SyntheticApp, self).__init__(job, appconfig)
+        logi(
+            "Synthetic load: [[cpu: %ss x %s]] [[footprint: %s MiB]] "
+            "[[read: %s MiB]] [[write: %s MiB]] [[output: %s MiB]]",
+            job["cpu"],
+            job["threads"],
+            job["footprint"],
+            job["read"],
+            job["write"],
+            job["output"],
+        )
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Worker script of the synthetic app, generating a configurable load.
+
+This script is staged into the job directory together with the input files and is
+intentionally self-contained (no dependencies on the snijder package).
+
+The phases are run one after the other:
+
+1. allocate (and touch) the memory footprint, kept until the end
+2. read the given volume from the staged input files (cycling through them)
+3. write the given volume to a scratch file (synced, then removed)
+4. burn CPU time in the given number of processes
+5. write the output file of the given size
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+MIB = 1024 * 1024
+PAGE = 4096
+
+
+def touch_memory(mebibytes):
+    """Allocate a buffer and write to every page so it's actually resident."""
+    buf = bytearray(int(mebibytes * MIB))
+    for pos in range(0, len(buf), PAGE):
+        buf[pos] = 1
+    return buf
+
+
+def read_inputs(mebibytes, infiles):
+    """Read the given volume from the input files, starting over if necessary."""
+    remaining = int(mebibytes * MIB)
+    infiles = [infile for infile in infiles if os.path.getsize(infile) > 0]
+    if not infiles:
+        return 0
+    total = 0
+    while remaining > 0:
+        for infile in infiles:
+            with open(infile, "rb") as fileobj:
+                while remaining > 0:
+                    chunk = fileobj.read(min(MIB, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    total += len(chunk)
+            if remaining <= 0:
+                break
+    return total
+
+
+def write_file(fname, mebibytes, sync=True):
+    """Write a file of the given size in chunks of 1 MiB."""
+    remaining = int(mebibytes * MIB)
+    chunk = b"\xa5" * MIB
+    with open(fname, "wb") as fileobj:
+        while remaining > 0:
+            fileobj.write(chunk[: min(MIB, remaining)])
+            remaining -= MIB
+        if sync:
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+
+
+def burn(seconds):
+    """Keep a CPU busy for the given time."""
+    deadline = time.time() + seconds
+    value = 0
+    while time.time() < deadline:
+        for i in range(10000):
+            value += i * i
+    return value
+
+
+def burn_cpu(seconds, threads):
+    """Keep the given number of CPUs busy (using processes to avoid the GIL)."""
+    if seconds <= 0:
+        return
+    if threads <= 1:
+        burn(seconds)
+        return
+    workers = [
+        multiprocessing.Process(target=burn, args=(seconds,)) for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main():
+    """Parse the arguments and run the load phases."""
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument("--cpu", type=float, default=0, help="CPU seconds")
+    argparser.add_argument("--threads", type=int, default=1, help="CPU workers")
+    argparser.add_argument("--footprint", type=float, default=0, help="memory (MiB)")
+    argparser.add_argument("--read", type=float, default=0, help="read volume (MiB)")
+    argparser.add_argument("--write", type=float, default=0, help="write volume (MiB)")
+    argparser.add_argument("--output", type=float, default=0, help="output (MiB)")
+    argparser.add_argument("--outdir", default="output", help="output directory")
+    argparser.add_argument("infiles", nargs="*", help="staged input files")
+    args = argparser.parse_args()
+
+    started = time.time()
+    footprint = touch_memory(args.footprint)
+    volume = read_inputs(args.read, args.infiles)
+    if args.write > 0:
+        write_file("synthetic-scratch.bin", args.write)
+        os.remove("synthetic-scratch.bin")
+    burn_cpu(args.cpu, args.threads)
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    write_file(os.path.join(args.outdir, "result.bin"), args.output, sync=False)
+    print(
+        "synthetic load done: footprint %s MiB, read %s bytes, wall %.2fs"
+        % (len(footprint) // MIB, volume, time.time() - started)
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""Helper module for confining jobs in their own cgroup (v2).
+
+Classes
+-------
+
+CgroupManager()
+    Detection and preparation of a delegated cgroup v2 subtree.
+JobCgroup()
+    The cgroup of a single job, with its CPU, memory and I/O limits.
+"""
+
+import os
+
+from . import logi, logd, logw
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# the period (in microseconds) used for the 'cpu.max' bandwidth limit:
+CPU_PERIOD = 100000
+
+# the controllers we're trying to use for confining jobs:
+CONTROLLERS = ["cpu", "memory", "io"]
+
+
+def read_cgroup_file(path):
+    """Read a cgroup interface file and return its stripped content.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    str
+    """
+    with open(path, "r") as fileobject:
+        return fileobject.read().strip()
+
+
+def write_cgroup_file(path, value):
+    """Write a value to a cgroup interface file.
+
+    Parameters
+    ----------
+    path : str
+    value : str
+    """
+    logd("Writing cgroup file [%s]: %s", path, value)
+    with open(path, "w") as fileobject:
+        fileobject.write(value)
+
+
+class CgroupManager(object):
+
+    """Manager for the cgroup v2 subtree delegated to the queue manager.
+
+    The spooler is moved into a leaf cgroup of its own, so the controllers can be
+    enabled for the subtree (cgroup v2 doesn't allow processes in inner nodes having
+    controllers enabled for their children). Each job then gets a sibling cgroup with
+    limits derived from the job's requested resources.
+
+    If anything goes wrong while preparing the subtree (no cgroup v2, no delegation,
+    missing controllers, ...), a warning is logged and `available` will be `False`,
+    meaning jobs will simply be launched without confinement.
+
+    Instance Attributes
+    -------------------
+    base : str
+        The path to the delegated cgroup, `None` if unavailable.
+    controllers : list(str)
+        The controllers enabled for the job cgroups.
+    """
+
+    def __init__(self, base=None):
+        """Detect and prepare the delegated cgroup subtree.
+
+        Parameters
+        ----------
+        base : str, optional
+            The path to the delegated cgroup, by default `None` which will use the
+            cgroup the current process is running in.
+        """
+        self.base = None
+        self.controllers = list()
+        try:
+            self.setup(base)
+        except (IOError, OSError) as err:
+            logw("cgroup enforcement disabled, using unconfined jobs: %s", err)
+            self.base = None
+            self.controllers = list()
+
+    @property
+    def available(self):
+        """Check if job cgroups can be created."""
+        return self.base is not None
+
+    @staticmethod
+    def own_cgroup():
+        """Get the path of the (unified hierarchy) cgroup of this process.
+
+        Returns
+        -------
+        str
+        """
+        for line in read_cgroup_file("/proc/self/cgroup").splitlines():
+            if line.startswith("0::"):
+                return os.path.join(CGROUP_ROOT, line[3:].lstrip("/"))
+        raise OSError("No cgroup v2 (unified hierarchy) membership found!")
+
+    def setup(self, base):
+        """Check the delegated cgroup and enable the controllers for its subtree.
+
+        Parameters
+        ----------
+        base : str or None
+            The cgroup to use, `None` to use the one of the current process.
+
+        Raises
+        ------
+        OSError
+            In case the cgroup can't be used for confining jobs.
+        """
+        if base is None:
+            base = self.own_cgroup()
+        available = os.path.join(base, "cgroup.controllers")
+        if not os.path.exists(available):
+            raise OSError("[%s] is not a cgroup v2 directory" % base)
+        if not os.access(os.path.join(base, "cgroup.subtree_control"), os.W_OK):
+            raise OSError("cgroup [%s] has not been delegated to us" % base)
+        controllers = [
+            ctrl for ctrl in CONTROLLERS if ctrl in read_cgroup_file(available).split()
+        ]
+        if not controllers:
+            raise OSError("none of %s available in [%s]" % (CONTROLLERS, base))
+
+        # processes in the base cgroup prevent enabling controllers for the
+        # subtree, so the spooler process moves itself into a leaf:
+        if read_cgroup_file(os.path.join(base, "cgroup.procs")):
+            leaf = os.path.join(base, "snijder-spooler")
+            if not os.path.exists(leaf):
+                os.mkdir(leaf)
+            write_cgroup_file(os.path.join(leaf, "cgroup.procs"), str(os.getpid()))
+
+        write_cgroup_file(
+            os.path.join(base, "cgroup.subtree_control"),
+            " ".join(["+%s" % ctrl for ctrl in controllers]),
+        )
+        self.base = base
+        self.controllers = controllers
+        logi("Using cgroup [%s] for confining jobs %s.", base, controllers)
+
+    def create(self, uid, cores=1, memory=None):
+        """Create a cgroup for a job.
+
+        Parameters
+        ----------
+        uid : str
+            The UID of the job.
+        cores : int, optional
+            The number of cores requested by the job, by default 1.
+        memory : int, optional
+            The memory (in bytes) requested by the job, by default `None` meaning
+            the memory will not be limited.
+
+        Returns
+        -------
+        JobCgroup or None
+            The job's cgroup or `None` in case cgroups are unavailable or creating
+            it failed.
+        """
+        if not self.available:
+            return None
+        cgroup = JobCgroup(os.path.join(self.base, "job-%s" % uid), self.controllers)
+        try:
+            cgroup.create(cores, memory)
+        except (IOError, OSError) as err:
+            logw("Unable to set up cgroup for job [uid:%.7s]: %s", uid, err)
+            cgroup.remove()
+            return None
+        return cgroup
+
+
+class JobCgroup(object):
+
+    """A cgroup confining a single job.
+
+    Instance Attributes
+    -------------------
+    path : str
+        The path of the cgroup directory.
+    controllers : list(str)
+        The controllers enabled for this cgroup.
+    """
+
+    def __init__(self, path, controllers):
+        self.path = path
+        self.controllers = controllers
+
+    def create(self, cores, memory):
+        """Create the cgroup directory and set up the limits.
+
+        Parameters
+        ----------
+        cores : int
+            The number of cores, used for 'cpu.max' and 'io.weight'.
+        memory : int or None
+            The memory limit in bytes for 'memory.max', `None` for no limit.
+        """
+        if not os.path.exists(self.path):
+            os.mkdir(self.path)
+        limits = dict()
+        if "cpu" in self.controllers:
+            limits["cpu.max"] = "%d %d" % (cores * CPU_PERIOD, CPU_PERIOD)
+        if "memory" in self.controllers:
+            limits["memory.max"] = "max" if memory is None else str(int(memory))
+        if "io" in self.controllers:
+            # weights have to be in [1, 10000], the default being 100:
+            limits["io.weight"] = "default %d" % min(max(100 * cores, 1), 10000)
+        for name, value in limits.iteritems():
+            write_cgroup_file(os.path.join(self.path, name), value)
+        logi("Created cgroup [%s]: %s", self.path, limits)
+
+    def wrap(self, arguments):
+        """Wrap a command so it moves itself into this cgroup before running.
+
+        If moving the process fails (e.g. as the cgroup has been removed in the
+        meantime), the command will be run anyway.
+
+        Parameters
+        ----------
+        arguments : list(str)
+            The command to be confined.
+
+        Returns
+        -------
+        list(str)
+        """
+        procs = os.path.join(self.path, "cgroup.procs")
+        wrapper = ["/bin/sh", "-c", 'echo $$ 2>/dev/null > "$0"; exec "$@"', procs]
+        return wrapper + list(arguments)
+
+    def remove(self):
+        """Remove the cgroup, logging a warning if this fails."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            os.rmdir(self.path)
+            logd("Removed cgroup [%s].", self.path)
+        except OSError as err:
+            logw("Unable to remove cgroup [%s]: %s", self.path, err)
@@ -3,12 +3,22 @@
 """Command line related functions (main loop, argument parsing, ...)"""
 
 import os
+import json
 import argparse
 
 import snijder
 import snijder.queue
+from snijder import control, loadgen, metrics, trace
+from snijder.cgroups import CgroupManager
+from snijder.feed import ChangeFeed
 from snijder.jobs import process_jobfile
+from snijder.memo import ResultCache
 from snijder.logger import set_verbosity, set_gc3loglevel
+from snijder.logger import enable_structured_logging, disable_structured_logging
+from snijder.placement import POLICIES, load_affinity
+from snijder.preempt import PreemptionPolicy
+from snijder.simulator import SCHEDULERS, Simulation, format_report
+from snijder.simulator import load_workload, random_workload
 from snijder.spooler import JobSpooler
 from snijder.inotify import JobFileHandler
 
@@ -35,6 +45,126 @@ def parse_arguments():
         required=False,
         help="GC3Pie resource name, see documentation for details",
     )
+    argparser.add_argument(
+        "--executor",
+        choices=["gc3", "local"],
+        default="gc3",
+        help="launch jobs through the gc3 engine (default) or as local subprocesses",
+    )
+    argparser.add_argument(
+        "--placement",
+        choices=POLICIES,
+        default="least-loaded",
+        help="policy for placing jobs if multiple gc3 resources are enabled",
+    )
+    argparser.add_argument(
+        "--slots",
+        type=int,
+        default=1,
+        help="number of jobs running concurrently per resource (default: 1)",
+    )
+    argparser.add_argument(
+        "--affinity",
+        required=False,
+        default=None,
+        help="INI file mapping storage mounts to resources with local access to them",
+    )
+    argparser.add_argument(
+        "--max-running",
+        type=int,
+        default=None,
+        help="maximum number of jobs running per user (default: unlimited)",
+    )
+    argparser.add_argument(
+        "--max-queued",
+        type=int,
+        default=None,
+        help="maximum number of jobs queued per user, more are rejected",
+    )
+    argparser.add_argument(
+        "--max-core-hours",
+        type=float,
+        default=None,
+        help="maximum core-hours requested by the queued and running jobs per user",
+    )
+    argparser.add_argument(
+        "--aging",
+        type=float,
+        default=1.0,
+        help="increase of a job's priority per hour of waiting (default: 1.0)",
+    )
+    argparser.add_argument(
+        "--preempt-after",
+        type=float,
+        default=None,
+        help="suspend running jobs for urgent ones waiting longer (in seconds), "
+        "requires '--executor local' (default: disabled)",
+    )
+    argparser.add_argument(
+        "--preempt-priority",
+        type=int,
+        default=1,
+        help="minimum priority of jobs considered urgent for preemption (default: 1)",
+    )
+    argparser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="attach new jobs identical to a queued or running one to the latter",
+    )
+    argparser.add_argument(
+        "--memo-dir",
+        required=False,
+        default=None,
+        help="cache the results of jobs here to serve identical ones from it",
+    )
+    argparser.add_argument(
+        "--memo-budget",
+        type=int,
+        default=None,
+        help="maximum size of the result cache in MB (default: unlimited)",
+    )
+    argparser.add_argument(
+        "--memo-content",
+        action="store_true",
+        help="identify input files by their content hash instead of size and mtime",
+    )
+    argparser.add_argument(
+        "--cgroups",
+        action="store_true",
+        help="confine each job in its own cgroup, requires '--executor local' and a "
+        "delegated cgroup v2 (default: disabled)",
+    )
+    argparser.add_argument(
+        "--cgroup-base",
+        required=False,
+        default=None,
+        help="delegated cgroup to use with --cgroups (default: the current one)",
+    )
+    argparser.add_argument(
+        "--metrics-port",
+        type=int,
+        required=False,
+        default=None,
+        help="serve metrics on http://localhost:PORT/metrics (default: disabled)",
+    )
+    argparser.add_argument(
+        "--control-socket",
+        required=False,
+        default=None,
+        help="answer control requests on this Unix socket (default: disabled)",
+    )
+    argparser.add_argument(
+        "--feed",
+        required=False,
+        default=None,
+        help="publish the changes of the jobs to this (rotated) file (JSON-lines)",
+    )
+    argparser.add_argument(
+        "--trace",
+        required=False,
+        default=None,
+        help="record the arrival trace of all jobfiles to this file (JSON-lines)",
+    )
     argparser.add_argument(
         "-v",
         "--verbosity",
@@ -43,6 +173,12 @@ def parse_arguments():
         help="increase log level (may be repeated)",
         default=0,
     )
+    argparser.add_argument(
+        "--jsonlog",
+        required=False,
+        default=None,
+        help="write the log as JSON-lines to this (rotated) file instead of stderr",
+    )
     gc3log = argparser.add_mutually_exclusive_group()
     gc3log.add_argument(
         "--gc3debug",
@@ -71,6 +207,13 @@ def manage_queue():
     elif args.gc3info:
         set_gc3loglevel("info")
 
+    log_writer = None
+    if args.jsonlog:
+        log_writer = enable_structured_logging(args.jsonlog)
+
+    if args.trace:
+        trace.enable_recording(args.trace)
+
     # TODO:
     # [x] init spooldirs as staticmethod of spooler
     # [x] remember files in 'cur' directory
@@ -80,22 +223,84 @@ def manage_queue():
     #     our queues, warn otherwise
     # [ ] then process files in the 'new' dir as new ones
     jobqueues = dict()
-    jobqueues["hucore"] = snijder.queue.JobQueue()
+    limits = snijder.queue.CategoryLimits(
+        running=args.max_running, queued=args.max_queued, core_hours=args.max_core_hours
+    )
+    jobqueues["hucore"] = snijder.queue.JobQueue(
+        "hucore", limits, args.aging, args.coalesce
+    )
 
     try:
-        job_spooler = JobSpooler(args.spooldir, jobqueues["hucore"], args.config)
-    except RuntimeError as err:
+        affinity = load_affinity(args.affinity) if args.affinity else None
+        job_spooler = JobSpooler(
+            args.spooldir,
+            jobqueues["hucore"],
+            args.config,
+            args.executor,
+            args.placement,
+            args.slots,
+            affinity,
+        )
+    except (RuntimeError, IOError) as err:
         print "\nERROR instantiating the job spooler: %s\n" % err
+        trace.disable_recording()
+        if log_writer is not None:
+            disable_structured_logging(log_writer)
         return False
 
     # select a specific resource if requested on the cmdline:
     if args.resource:
         job_spooler.engine.select_resource(args.resource)
 
+    # confine jobs in cgroups if requested (falls back to unconfined jobs):
+    if args.cgroups:
+        if hasattr(job_spooler.engine, "suspend"):
+            job_spooler.cgroups = CgroupManager(args.cgroup_base)
+        else:
+            print "\nWARNING: cgroups require the local executor, disabled.\n"
+
+    # suspend running jobs in favor of urgent ones if requested:
+    if args.preempt_after is not None:
+        if hasattr(job_spooler.engine, "suspend"):
+            job_spooler.preemption = PreemptionPolicy(
+                args.preempt_after, args.preempt_priority
+            )
+        else:
+            print "\nWARNING: preemption requires the local executor, disabled.\n"
+
+    # serve the results of identical jobs from a cache if requested:
+    if args.memo_dir:
+        budget = None
+        if args.memo_budget is not None:
+            budget = args.memo_budget * 1024 * 1024
+        job_spooler.memo = ResultCache(args.memo_dir, budget, args.memo_content)
+
     for qname, queue in jobqueues.iteritems():
         status = os.path.join(job_spooler.dirs["status"], qname + ".json")
         queue.statusfile = status
 
+    feed = None
+    if args.feed:
+        feed = ChangeFeed(args.feed)
+        for queue in jobqueues.itervalues():
+            queue.feed = feed
+
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics.watch_queues(jobqueues)
+        metrics_server = metrics.MetricsServer(args.metrics_port)
+
+    control_server = None
+    if args.control_socket:
+        control_server = control.ControlServer(
+            args.control_socket, job_spooler, jobqueues
+        )
+
+    # resume the jobs left over from a previous run (e.g. after draining):
+    for jobfile in job_spooler.pending_jobfiles():
+        fname = os.path.join(job_spooler.dirs["cur"], jobfile)
+        process_jobfile(fname, jobqueues)
+
     # process jobfiles already existing during our startup:
     for jobfile in job_spooler.dirs["newfiles"]:
         fname = os.path.join(job_spooler.dirs["new"], jobfile)
@@ -113,5 +318,298 @@ def manage_queue():
         print "Cleaning up. Remaining jobs:"
         print jobqueues["hucore"].queue
         file_handler.shutdown()
+        if control_server is not None:
+            control_server.shutdown()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if feed is not None:
+            feed.close()
+        trace.disable_recording()
+        if log_writer is not None:
+            disable_structured_logging(log_writer)
 
     return retval
+
+
+def parse_simulation_arguments():
+    """Parse command line arguments for the scheduling simulation."""
+    argparser = argparse.ArgumentParser(
+        description="Simulate the scheduling of a workload on a virtual clock."
+    )
+    workload = argparser.add_mutually_exclusive_group(required=True)
+    workload.add_argument(
+        "-w", "--workload", help="workload file with one JSON dict per job and line"
+    )
+    workload.add_argument(
+        "-t", "--trace", help="arrival trace recorded by the queue manager (--trace)"
+    )
+    workload.add_argument(
+        "--random",
+        type=int,
+        metavar="JOBS",
+        help="simulate a random workload with this many jobs spread over a day",
+    )
+    argparser.add_argument(
+        "--users",
+        type=int,
+        default=10,
+        help="number of users for a random workload (default: 10)",
+    )
+    argparser.add_argument(
+        "--scheduler",
+        action="append",
+        choices=sorted(SCHEDULERS),
+        help="scheduler to simulate, may be repeated (default: all of them)",
+    )
+    argparser.add_argument(
+        "--slots",
+        type=int,
+        default=1,
+        help="number of concurrently running jobs (default: 1)",
+    )
+    argparser.add_argument(
+        "--mean-duration",
+        type=float,
+        default=600,
+        help="mean runtime (s) for jobs without a duration (default: 600)",
+    )
+    argparser.add_argument(
+        "--distribution",
+        choices=["exponential", "lognormal", "constant"],
+        default="exponential",
+        help="distribution of the runtimes for jobs without a duration",
+    )
+    argparser.add_argument(
+        "--seed", type=int, default=None, help="seed for the random numbers"
+    )
+    argparser.add_argument(
+        "-v",
+        "--verbosity",
+        dest="verbosity",
+        action="count",
+        help="increase log level (may be repeated)",
+        default=0,
+    )
+    return argparser.parse_args()
+
+
+def simulate():
+    """Run the scheduling simulation and print the reports."""
+    args = parse_simulation_arguments()
+    set_verbosity(args.verbosity)
+
+    if args.workload:
+        workload = load_workload(args.workload)
+    elif args.trace:
+        workload = trace.to_workload(trace.load_trace(args.trace))
+    else:
+        workload = random_workload(args.random, args.users, seed=args.seed)
+
+    for scheduler in args.scheduler or sorted(SCHEDULERS):
+        simulation = Simulation(
+            # every simulation gets its own copy, as missing durations are filled in:
+            [dict(entry) for entry in workload],
+            scheduler=scheduler,
+            slots=args.slots,
+            mean_duration=args.mean_duration,
+            distribution=args.distribution,
+            seed=args.seed,
+        )
+        print format_report(simulation.run())
+    return True
+
+
+def parse_replay_arguments():
+    """Parse command line arguments for replaying an arrival trace."""
+    argparser = argparse.ArgumentParser(
+        description="Replay an arrival trace into the spooling directory of a "
+        "running (scratch) queue manager, using dummy or synthetic jobs."
+    )
+    argparser.add_argument(
+        "-t", "--trace", required=True, help="the arrival trace to replay"
+    )
+    argparser.add_argument(
+        "-s",
+        "--spooldir",
+        required=True,
+        help='spooling directory of the queue manager (e.g. "run/spool/")',
+    )
+    argparser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="acceleration factor for the submissions (default: 1.0)",
+    )
+    argparser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="seconds to wait for outstanding jobs at the end (default: 600)",
+    )
+    argparser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="replay synthetic jobs burning CPU for the recorded runtimes",
+    )
+    argparser.add_argument(
+        "-v",
+        "--verbosity",
+        dest="verbosity",
+        action="count",
+        help="increase log level (may be repeated)",
+        default=0,
+    )
+    return argparser.parse_args()
+
+
+def replay_trace():
+    """Replay an arrival trace and print the throughput and latency report."""
+    args = parse_replay_arguments()
+    set_verbosity(args.verbosity)
+    entries = trace.load_trace(args.trace)
+    report = trace.replay(
+        entries, args.spooldir, args.speed, args.timeout, synthetic=args.synthetic
+    )
+    print trace.format_replay_report(report)
+    return report["completed"] + report["deleted"] == report["submitted"]
+
+
+def parse_loadgen_arguments():
+    """Parse command line arguments for the load generator."""
+    argparser = argparse.ArgumentParser(
+        description="Submit synthetic jobfiles to a running queue manager and "
+        "measure how long it takes until they show up in the queue status."
+    )
+    argparser.add_argument(
+        "-s",
+        "--spooldir",
+        required=True,
+        help='spooling directory of the queue manager (e.g. "run/spool/")',
+    )
+    argparser.add_argument(
+        "-n", "--jobs", type=int, default=100, help="number of jobs (default: 100)"
+    )
+    argparser.add_argument(
+        "--rate", type=float, default=1.0, help="jobs per second (default: 1.0)"
+    )
+    argparser.add_argument(
+        "--burst",
+        type=int,
+        default=1,
+        help="number of jobs submitted at once (default: 1)",
+    )
+    argparser.add_argument(
+        "--poisson",
+        action="store_true",
+        help="exponentially distributed intervals between bursts",
+    )
+    argparser.add_argument(
+        "--users", type=int, default=10, help="number of users (default: 10)"
+    )
+    argparser.add_argument(
+        "--zipf",
+        type=float,
+        default=1.0,
+        help="skew of the user distribution, 0 for uniform (default: 1.0)",
+    )
+    argparser.add_argument(
+        "--mix",
+        default="decon=6,preview=3,sleep=1",
+        help='tasktype mix (default: "decon=6,preview=3,sleep=1")',
+    )
+    argparser.add_argument(
+        "--deletions",
+        type=float,
+        default=0.0,
+        help="fraction of submissions followed by a deletion request (default: 0)",
+    )
+    argparser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="seconds to wait for jobs to show up at the end (default: 60)",
+    )
+    argparser.add_argument(
+        "--seed", type=int, default=None, help="seed for the random numbers"
+    )
+    argparser.add_argument(
+        "-v",
+        "--verbosity",
+        dest="verbosity",
+        action="count",
+        help="increase log level (may be repeated)",
+        default=0,
+    )
+    return argparser.parse_args()
+
+
+def generate_load():
+    """Run the load generator and print the ingestion report."""
+    args = parse_loadgen_arguments()
+    set_verbosity(args.verbosity)
+    generator = loadgen.LoadGenerator(
+        args.spooldir,
+        rate=args.rate,
+        burst=args.burst,
+        poisson=args.poisson,
+        users=args.users,
+        zipf=args.zipf,
+        mix=args.mix,
+        deletions=args.deletions,
+        seed=args.seed,
+    )
+    report = generator.run(args.jobs, args.timeout)
+    print loadgen.format_report(report)
+    return report["missed"] == 0
+
+
+def parse_control_arguments():
+    """Parse command line arguments for the control client."""
+    argparser = argparse.ArgumentParser(
+        description="Query and control a running queue manager through its "
+        "control socket (see the '--control-socket' option of snijder-queue)."
+    )
+    argparser.add_argument(
+        "-s", "--socket", required=True, help="the control socket of the queue manager"
+    )
+    commands = argparser.add_subparsers(dest="cmd")
+    status = commands.add_parser("status", help="print the status and the jobs")
+    status.add_argument("--user", default=None, help="only show this user's jobs")
+    status.add_argument("--offset", type=int, default=0, help="jobs to skip")
+    status.add_argument("--limit", type=int, default=None, help="jobs to show")
+    submit = commands.add_parser("submit", help="submit a jobfile")
+    submit.add_argument("jobfile", type=argparse.FileType("r"))
+    delete = commands.add_parser("delete", help="delete jobs")
+    delete.add_argument("ids", nargs="*", metavar="UID")
+    delete.add_argument("--user", default=None, help="delete all jobs of this user")
+    for cmd in control.STATUS_COMMANDS:
+        parser = commands.add_parser(cmd, help="request spooler status '%s'" % cmd)
+        if cmd == "drain":
+            parser.add_argument(
+                "--deadline",
+                type=float,
+                default=None,
+                help="seconds to wait for the running jobs (default: no limit)",
+            )
+    return argparser.parse_args()
+
+
+def control_queue():
+    """Send a request to the control socket and print the JSON response."""
+    args = parse_control_arguments()
+    message = {"cmd": args.cmd}
+    if args.cmd == "status":
+        message.update(user=args.user, offset=args.offset, limit=args.limit)
+    elif args.cmd == "submit":
+        message["jobfile"] = args.jobfile.read()
+    elif args.cmd == "delete":
+        message.update(ids=args.ids, user=args.user)
+    elif args.cmd == "drain":
+        message["deadline"] = args.deadline
+    try:
+        response = control.request(args.socket, message)
+    except (IOError, ValueError) as err:
+        print "\nERROR talking to the queue manager: %s\n" % err
+        return False
+    print json.dumps(response, indent=4)
+    return response["ok"]
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""Control and query API of the queue manager on a Unix domain socket.
+
+Instead of creating request files (see `JobSpooler.check_status_request()`) and
+parsing the queue status JSON file, local clients (e.g. the web portal) can talk
+to the queue manager through a Unix domain socket. Requests and responses are
+JSON dicts, one per line, several requests can be sent over one connection:
+
+    {"cmd": "status", "user": "user01", "offset": 0, "limit": 20}
+    {"ok": true, "status": "run", "total": 42, "jobs": [{"id": "8cd0d80f...", ...}]}
+
+The commands are:
+
+- 'status': the spooler status and the jobs (formatted like in the status file,
+  running ones first, then the queued ones in their order), optionally filtered
+  by 'user' and paginated using 'offset' and 'limit'. The 'total' is the number
+  of jobs matching the filter.
+- 'submit': submit the jobfile given as a string in 'jobfile', returns its 'uid',
+  its 'status' and whether it has been 'queued' (a job rejected as its user is
+  over the quota has the status 'over_quota' and the 'reason' is given).
+- 'delete': request the deletion of the jobs with the UIDs in 'ids' and / or all
+  jobs of a 'user', returns the 'unknown' UIDs (the requests for those are kept
+  for a while, see `snijder.queue.route_deletion()`).
+- 'pause', 'run', 'refresh', 'shutdown' and 'drain' (with an optional 'deadline'
+  in seconds): change the spooler status.
+
+Failed requests are answered with `{"ok": false, "error": "..."}`.
+
+Requests are answered in a thread per connection, holding the lock of the spooler
+(see `JobSpooler.lock`) so they don't interfere with the spooling loop.
+
+Classes
+-------
+
+ControlServer()
+    Server answering control requests in a background thread.
+"""
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import SocketServer
+
+from . import logi, logd, logw, loge
+from .jobs import process_jobfile
+from .queue import route_deletion
+
+# the spooler status changes that can be requested:
+STATUS_COMMANDS = ["pause", "run", "refresh", "shutdown", "drain"]
+
+
+class ControlHandler(SocketServer.StreamRequestHandler):
+
+    """Request handler answering the JSON requests of a connection."""
+
+    def handle(self):
+        """Answer requests until the client closes the connection."""
+        for line in iter(self.rfile.readline, ""):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request is not a JSON object")
+                response = self.server.control.answer(request)
+            except (ValueError, KeyError, TypeError) as err:
+                logd("Invalid control request [%s]: %s", line.strip(), err)
+                response = {"ok": False, "error": str(err)}
+            except Exception as err:  # pylint: disable-msg=broad-except
+                # don't let the client wait for an answer that will never come:
+                loge("Failed answering control request [%s]: %s", line.strip(), err)
+                response = {"ok": False, "error": str(err)}
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+
+class ThreadingUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    """Unix stream socket server handling each connection in its own thread."""
+
+    daemon_threads = True
+
+
+class ControlServer(object):
+
+    """Server answering control requests on a Unix socket in a background thread.
+
+    Instance Attributes
+    -------------------
+    path : str
+        The path of the socket.
+    spooler : snijder.spooler.JobSpooler
+    queues : dict(snijder.queue.JobQueue)
+    server : ThreadingUnixServer
+    thread : threading.Thread
+    """
+
+    def __init__(self, path, spooler, queues):
+        """Start serving control requests.
+
+        Parameters
+        ----------
+        path : str
+            The path of the socket, an existing (stale) socket is replaced.
+        spooler : snijder.spooler.JobSpooler
+            The spooler whose status is to be controlled, its 'requests' directory
+            is used to write submitted jobfiles to before processing them.
+        queues : dict(snijder.queue.JobQueue)
+            The queues to query and to submit jobs to.
+        """
+        if os.path.exists(path):
+            logw("Removing stale control socket [%s].", path)
+            os.remove(path)
+        self.path = path
+        self.spooler = spooler
+        self.queues = queues
+        self.server = ThreadingUnixServer(path, ControlHandler)
+        self.server.control = self
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        logi("Serving control requests on [%s].", path)
+
+    def shutdown(self):
+        """Stop serving control requests and remove the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def answer(self, request):
+        """Process a single request.
+
+        Parameters
+        ----------
+        request : dict
+
+        Returns
+        -------
+        dict
+            The response.
+        """
+        cmd = request.get("cmd")
+        logd("Received control request: %s", cmd)
+        # the queues and the spooler are not to be touched while it's spooling:
+        with self.spooler.lock:
+            if cmd == "status":
+                return self.status(
+                    request.get("user"), request.get("offset", 0), request.get("limit")
+                )
+            if cmd == "submit":
+                return self.submit(request["jobfile"])
+            if cmd == "delete":
+                return self.delete(request.get("ids", []), request.get("user"))
+            if cmd == "drain":
+                self.spooler.drain(request.get("deadline"))
+            elif cmd in STATUS_COMMANDS:
+                getattr(self.spooler, cmd)()
+            else:
+                return {"ok": False, "error": "unknown command: %s" % cmd}
+            return {"ok": True, "status": self.spooler.status}
+
+    def status(self, user=None, offset=0, limit=None):
+        """Get the spooler status and the (filtered, paginated) jobs.
+
+        Parameters
+        ----------
+        user : str, optional
+            Only report the jobs of this user.
+        offset : int, optional
+            The number of (matching) jobs to skip, by default 0.
+        limit : int, optional
+            The maximum number of jobs to report, by default `None` (all).
+
+        Returns
+        -------
+        dict
+        """
+        jobs = list()
+        for qname in sorted(self.queues):
+            jobs.extend(self.queues[qname].job_details(user))
+        end = None if limit is None else offset + limit
+        return {
+            "ok": True,
+            "status": self.spooler.status,
+            "total": len(jobs),
+            "jobs": jobs[offset:end],
+        }
+
+    def submit(self, jobfile):
+        """Submit a jobfile, processing it like one placed in the 'new' directory.
+
+        Parameters
+        ----------
+        jobfile : str
+            The content of the jobfile.
+
+        Returns
+        -------
+        dict
+            The response with the 'uid' of the job (which differs for jobfiles using
+            'timestamp = on_parsing'), its 'status', whether it has been 'queued'
+            and the 'reason' in case it has been rejected.
+        """
+        if isinstance(jobfile, unicode):
+            jobfile = jobfile.encode("utf-8")
+        handle, fname = tempfile.mkstemp(
+            prefix=".submit_", suffix=".cfg", dir=self.spooler.dirs["requests"]
+        )
+        with os.fdopen(handle, "w") as outfile:
+            outfile.write(jobfile)
+        job = process_jobfile(fname, self.queues)
+        if os.path.exists(fname):
+            # e.g. the jobfile couldn't be read or was rejected by the queue:
+            os.remove(fname)
+        if job is None:
+            return {"ok": False, "error": "unable to parse the jobfile"}
+        queued = any(job["uid"] in queue.jobs for queue in self.queues.values())
+        response = {
+            "ok": True,
+            "uid": job["uid"],
+            "status": job["status"],
+            "queued": queued,
+        }
+        if job.get("rejection") is not None:
+            response["reason"] = job["rejection"]
+        return response
+
+    def delete(self, ids, user=None):
+        """Request the deletion of jobs, like a 'deletejobs' jobfile does.
+
+        Parameters
+        ----------
+        ids : list(str)
+            The UIDs of the jobs.
+        user : str, optional
+            Also delete all jobs of this user (looked up using the secondary
+            indexes of the queues, see `snijder.queue.JobQueue.find()`).
+
+        Returns
+        -------
+        dict
+            The response with all requested 'ids' (including the ones of the user's
+            jobs) and the 'unknown' ones.
+        """
+        queues = self.queues.values()
+        unknown = [uid for uid in ids if route_deletion(uid, queues) is None]
+        if user is not None:
+            ids = list(ids)
+            for queue in queues:
+                uids = queue.find(user=user)
+                queue.deletion_list.update(uids)
+                ids.extend(sorted(uids))
+        logi("Received %s deletion request(s) through the control socket.", len(ids))
+        return {"ok": True, "ids": ids, "unknown": unknown}
+
+
+def request(path, message, timeout=10):
+    """Send a single request to a control socket and return the response.
+
+    Parameters
+    ----------
+    path : str
+        The path of the socket.
+    message : dict
+        The request, e.g. `{"cmd": "status"}`.
+    timeout : float, optional
+        The time in seconds to wait for the response, by default 10.
+
+    Returns
+    -------
+    dict
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path)
+        client.sendall(json.dumps(message) + "\n")
+        response = client.makefile("r").readline()
+    finally:
+        client.close()
+    return json.loads(response)
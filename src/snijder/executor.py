@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""Native executor running jobs as local subprocesses, bypassing gc3pie.
+
+For single-host setups the gc3pie 'shellcmd' backend is a lot of machinery: it
+writes wrapper scripts, spawns '/usr/bin/time', keeps PID files in its resource
+directory and needs to copy the inputs and outputs around. The `LocalEngine` in
+here is a drop-in replacement for the (small) subset of the gc3 engine interface
+used by the spooler: apps are launched directly using `subprocess`, running in
+their output directory with the inputs linked into it, completion is detected by
+reaping the children with `os.wait4()`, which also provides the exit status and
+the resource usage natively.
+
+The gc3 engine remains the option for remote resources.
+
+Classes
+-------
+
+LocalEngine()
+    Engine launching and monitoring apps as local child processes.
+"""
+
+import os
+import signal
+import subprocess
+import time
+
+import gc3libs
+from gc3libs.quantity import KiB, seconds
+
+from . import logi, logd, logw, loge
+
+# pylint: disable-msg=no-member
+STATES = [
+    gc3libs.Run.State.NEW,
+    gc3libs.Run.State.SUBMITTED,
+    gc3libs.Run.State.RUNNING,
+    gc3libs.Run.State.STOPPED,
+    gc3libs.Run.State.TERMINATING,
+    gc3libs.Run.State.TERMINATED,
+    gc3libs.Run.State.UNKNOWN,
+]
+# pylint: enable-msg=no-member
+
+
+def staged_inputs(app):
+    """Get the input files of an app and the names they are expected to have.
+
+    Parameters
+    ----------
+    app : gc3libs.Application
+
+    Returns
+    -------
+    list(tuple(str, str))
+        Tuples with the (local) path of each input file and its name in the
+        working directory of the app.
+    """
+    if not hasattr(app.inputs, "items"):
+        return [(path, os.path.basename(path)) for path in app.inputs]
+    # gc3libs uses URL objects as keys, for local files the path is all we need:
+    return [(getattr(src, "path", src), name) for src, name in app.inputs.items()]
+
+
+class LocalEngine(object):
+
+    """Engine running apps as child processes of the queue manager.
+
+    Instance Attributes
+    -------------------
+    procs : dict
+        The apps that have been launched (as keys) and their `subprocess.Popen`
+        objects (as values).
+    grace : float
+        The time given to a process to terminate after a SIGTERM before it gets
+        killed with SIGKILL.
+    """
+
+    def __init__(self, grace=5.0):
+        self.grace = grace
+        self.procs = dict()
+        self._new = list()
+        self._links = dict()
+        self._terminated = 0
+        logi("Created local engine (native subprocess executor).")
+
+    def add(self, app):
+        """Add an app to the engine, it will be launched on the next `progress()`.
+
+        Parameters
+        ----------
+        app : snijder.apps.AbstractApp
+        """
+        if app in self._new or app in self.procs:
+            return
+        self._new.append(app)
+        # let gc3libs route calls to `app.kill()` to this engine:
+        if hasattr(app, "attach"):
+            app.attach(self)
+
+    @staticmethod
+    def get_resources():
+        """The local engine doesn't use any gc3 resources (nor their directories)."""
+        return list()
+
+    @staticmethod
+    def select_resource(name):
+        """Selecting resources is not supported by the local engine."""
+        logw("The local engine has no resources, ignoring [%s].", name)
+
+    def launch(self, app):
+        """Launch the process of an app in its output directory.
+
+        Parameters
+        ----------
+        app : snijder.apps.AbstractApp
+        """
+        workdir = app.output_dir
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        links = list()
+        for source, name in staged_inputs(app):
+            link = os.path.join(workdir, name)
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(os.path.abspath(source), link)
+            links.append(link)
+        self._links[app] = links
+
+        stdout = open(os.path.join(workdir, app.stdout or os.devnull), "w")
+        stderr = subprocess.STDOUT
+        if app.stderr and app.stderr != app.stdout:
+            stderr = open(os.path.join(workdir, app.stderr), "w")
+        env = dict(os.environ)
+        env.update(getattr(app, "environment", None) or dict())
+        try:
+            # start a new session so signals reach all processes of the job:
+            proc = subprocess.Popen(
+                app.arguments,
+                cwd=workdir,
+                env=env,
+                stdout=stdout,
+                stderr=stderr,
+                close_fds=True,
+                preexec_fn=os.setsid,
+            )
+        finally:
+            stdout.close()
+            if stderr is not subprocess.STDOUT:
+                stderr.close()
+        logd("Launched [pid:%s]: %s", proc.pid, app.arguments)
+        self.procs[app] = proc
+        app.execution.started = time.time()
+        # pylint: disable-msg=no-member
+        app.execution.state = gc3libs.Run.State.SUBMITTED
+        app.execution.state = gc3libs.Run.State.RUNNING
+
+    def reap(self, app, status, rusage):
+        """Record the exit status and resource usage of a terminated app.
+
+        Parameters
+        ----------
+        app : snijder.apps.AbstractApp
+        status : int
+            The exit status as returned by `os.wait4()`.
+        rusage : resource.struct_rusage
+            The resource usage, `None` if unknown.
+        """
+        pid = self.procs.pop(app).pid
+        for link in self._links.pop(app, []):
+            if os.path.islink(link):
+                os.remove(link)
+        execution = app.execution
+        if os.WIFSIGNALED(status):
+            execution.exitcode = None
+            execution.signal = os.WTERMSIG(status)
+        else:
+            execution.exitcode = os.WEXITSTATUS(status)
+            execution.signal = 0
+        # the time the app has been suspended doesn't count:
+        duration = time.time() - execution.started - app.suspended_time
+        execution.duration = duration * seconds
+        if rusage is not None:
+            execution.used_cpu_time = (rusage.ru_utime + rusage.ru_stime) * seconds
+            # NOTE: on Linux 'ru_maxrss' is given in kilobytes:
+            execution.max_used_memory = rusage.ru_maxrss * KiB
+        logd(
+            "Reaped [pid:%s]: exit code %s, signal %s",
+            pid,
+            execution.exitcode,
+            execution.signal,
+        )
+        self._terminated += 1
+        # pylint: disable-msg=no-member
+        execution.state = gc3libs.Run.State.TERMINATED
+
+    def poll(self, app):
+        """Reap the process of an app if it has terminated (non-blocking).
+
+        Returns
+        -------
+        bool
+            True in case the process has been reaped.
+        """
+        pid = self.procs[app].pid
+        try:
+            reaped, status, rusage = os.wait4(pid, os.WNOHANG)
+        except OSError as err:
+            loge("Unable to wait for [pid:%s], assuming it's gone: %s", pid, err)
+            reaped, status, rusage = pid, signal.SIGKILL, None
+        if reaped == 0:
+            return False
+        self.reap(app, status, rusage)
+        return True
+
+    def progress(self):
+        """Launch the newly added apps and reap the terminated ones."""
+        while self._new:
+            app = self._new.pop(0)
+            try:
+                self.launch(app)
+            except (OSError, IOError) as err:
+                loge("Launching the app failed: %s", err)
+                app.execution.exitcode = None
+                app.execution.signal = 0
+                # pylint: disable-msg=no-member
+                app.execution.state = gc3libs.Run.State.TERMINATED
+                self._terminated += 1
+        for app in list(self.procs):
+            self.poll(app)
+
+    def kill(self, app, **_):
+        """Terminate an app, escalating to SIGKILL after the grace period.
+
+        This is blocking until the process has been reaped (at most the grace
+        period plus a second), so the app is TERMINATED when returning.
+        """
+        if app in self._new:
+            self._new.remove(app)
+            # pylint: disable-msg=no-member
+            app.execution.state = gc3libs.Run.State.TERMINATED
+            self._terminated += 1
+            return
+        if app not in self.procs:
+            return
+        pid = self.procs[app].pid
+        deadline = time.time() + self.grace
+        for signum in [signal.SIGTERM, signal.SIGKILL]:
+            logi("Sending signal %s to [pid:%s].", signum, pid)
+            try:
+                os.killpg(pid, signum)
+                if app.suspended_at is not None:
+                    # a stopped process only handles the signal once continued:
+                    os.killpg(pid, signal.SIGCONT)
+            except OSError as err:
+                logd("Unable to signal process group of [pid:%s]: %s", pid, err)
+            while time.time() < deadline:
+                if self.poll(app):
+                    return
+                time.sleep(0.05)
+            deadline = time.time() + 1
+        loge("Process [pid:%s] did not terminate!", pid)
+
+    def suspend(self, app):
+        """Suspend a running app by stopping its process group (SIGSTOP).
+
+        Parameters
+        ----------
+        app : snijder.apps.AbstractApp
+        """
+        pid = self.procs[app].pid
+        logi("Suspending [pid:%s].", pid)
+        os.killpg(pid, signal.SIGSTOP)
+        app.suspended_at = time.time()
+        # pylint: disable-msg=no-member
+        app.execution.state = gc3libs.Run.State.STOPPED
+
+    def resume(self, app):
+        """Resume a suspended app by continuing its process group (SIGCONT).
+
+        Parameters
+        ----------
+        app : snijder.apps.AbstractApp
+        """
+        pid = self.procs[app].pid
+        logi("Resuming [pid:%s].", pid)
+        os.killpg(pid, signal.SIGCONT)
+        app.suspended_time += time.time() - app.suspended_at
+        app.suspended_at = None
+        # pylint: disable-msg=no-member
+        app.execution.state = gc3libs.Run.State.RUNNING
+
+    def counts(self):
+        """Get the number of apps per state, like `gc3libs.core.Engine.counts()`.
+
+        Returns
+        -------
+        dict
+        """
+        stats = dict([(state, 0) for state in STATES])
+        for app in self._new + list(self.procs):
+            stats[app.execution.state] += 1
+        # pylint: disable-msg=no-member
+        stats[gc3libs.Run.State.TERMINATED] += self._terminated
+        stats["total"] = sum(stats.values())
+        return stats
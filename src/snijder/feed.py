@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Append-only feed of the changes of a job queue.
+
+If a feed is set for a `snijder.queue.JobQueue` (see its `feed` attribute), every
+change of a job is appended to a file as a JSON dict, one per line, numbered by a
+sequence number that keeps increasing across restarts of the queue manager:
+
+    {"seq": 1042, "time": 1583312400.51, "event": "enqueued", "uid": "8cd0d80f...",
+     "user": "user01", "status": "N/A"}
+
+The 'event' is one of 'enqueued', 'dispatched', 'status' (the 'status' key holding
+the new status), 'removed' or 'rejected' (for jobs over their category's quota,
+the 'reason' key holding the exceeded limit). Instead of comparing full snapshots
+of the queue status, a consumer remembers the sequence number of the last entry it
+processed and reads only the entries following it (see `read_feed()`).
+
+The file is rotated like the structured log (i.e. to 'feed.1', 'feed.2', ...)
+once it exceeds a size limit. If the first entry returned to a consumer doesn't
+directly follow its last sequence number, entries it hasn't seen have been
+rotated away already and it has to start over from the full status file.
+
+Classes
+-------
+
+ChangeFeed()
+    Thread-safe writer for feed entries.
+"""
+
+import json
+import os
+import threading
+import time
+
+from . import logi, logw
+
+
+def last_seq(fname):
+    """Get the sequence number of the last entry of a feed file.
+
+    Returns
+    -------
+    int
+        The sequence number, 0 if the file doesn't exist or has no entries.
+    """
+    if not os.path.exists(fname):
+        return 0
+    with open(fname, "r") as infile:
+        # the entries are short, so the tail of the file is sufficient:
+        infile.seek(max(0, os.path.getsize(fname) - 64 * 1024))
+        lines = infile.read().splitlines()
+    for line in reversed(lines):
+        try:
+            return json.loads(line)["seq"]
+        except (ValueError, KeyError, TypeError):
+            # e.g. a line that has been cut off by a crash or the seek above:
+            continue
+    return 0
+
+
+class ChangeFeed(object):
+
+    """Writer appending sequence-numbered change entries to a (rotated) file.
+
+    Instance Attributes
+    -------------------
+    fname : str
+        The feed file.
+    max_bytes : int
+        The size the file is rotated at.
+    backups : int
+        The number of rotated files to keep.
+    seq : int
+        The sequence number of the last entry written.
+    """
+
+    def __init__(self, fname, max_bytes=10 * 1024 * 1024, backups=5):
+        self.fname = fname
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.seq = last_seq(fname) or last_seq(fname + ".1")
+        self._lock = threading.Lock()
+        self._file = open(fname, "a")
+        logi("Writing the queue change feed to [%s] (seq: %s).", fname, self.seq)
+
+    def publish(self, event, job, **fields):
+        """Append an entry for a job to the feed.
+
+        Parameters
+        ----------
+        event : str
+            The kind of change, e.g. 'enqueued' (see the module docs).
+        job : snijder.jobs.JobDescription
+        fields : dict
+            Additional keys for the entry.
+
+        Returns
+        -------
+        int
+            The sequence number of the entry.
+        """
+        with self._lock:
+            self.seq += 1
+            entry = {
+                "seq": self.seq,
+                "time": time.time(),
+                "event": event,
+                "uid": job["uid"],
+                "user": job["user"],
+                "status": job["status"],
+            }
+            entry.update(fields)
+            self._file.write(json.dumps(entry, sort_keys=True) + "\n")
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+            return self.seq
+
+    def _rotate(self):
+        """Rotate the feed file, the caller has to hold the lock."""
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = "%s.%s" % (self.fname, index)
+            if os.path.exists(source):
+                os.rename(source, "%s.%s" % (self.fname, index + 1))
+        if self.backups > 0:
+            os.rename(self.fname, self.fname + ".1")
+        else:
+            os.remove(self.fname)
+        self._file = open(self.fname, "a")
+
+    def close(self):
+        """Close the feed file."""
+        with self._lock:
+            self._file.close()
+
+
+def read_feed(fname, since=0):
+    """Read the entries of a feed following a sequence number.
+
+    Parameters
+    ----------
+    fname : str
+        The feed file, the rotated ones are read as well.
+    since : int, optional
+        The sequence number of the last entry processed by the consumer, by default
+        0 (i.e. read all entries).
+
+    Returns
+    -------
+    list(dict)
+        The entries ordered by their sequence number.
+    """
+    fnames = [fname]
+    index = 1
+    while os.path.exists("%s.%s" % (fname, index)):
+        fnames.insert(0, "%s.%s" % (fname, index))
+        index += 1
+    entries = dict()
+    for name in fnames:
+        # skip rotated files having only entries the consumer has seen already:
+        if name != fname and last_seq(name) <= since:
+            continue
+        try:
+            with open(name, "r") as infile:
+                for line in infile:
+                    if not line.endswith("\n"):
+                        # the entry is being written right now:
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logw("Skipping invalid feed entry in [%s].", name)
+                        continue
+                    if entry["seq"] > since:
+                        entries[entry["seq"]] = entry
+        except IOError as err:
+            # e.g. the file has been rotated in the meantime:
+            logw("Unable to read the feed file [%s]: %s", name, err)
+    # entries read twice due to a rotation in the meantime are only kept once:
+    return [entries[seq] for seq in sorted(entries)]
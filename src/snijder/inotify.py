@@ -21,10 +21,12 @@ class JobFileHandler(object):  # pylint: disable-msg=too-few-public-methods
             Spooling dirs, as returned by JobSpooler.setup_rundirs().
         """
         self.watch_mgr = pyinotify.WatchManager()
-        # mask which events to watch: pyinotify.IN_CREATE
-        self.wdd = self.watch_mgr.add_watch(
-            dirs["new"], pyinotify.IN_CREATE, rec=False  # pylint: disable-msg=no-member
-        )
+        # mask which events to watch: files created in or moved into the directory
+        # (the latter allows clients to submit completely written jobfiles):
+        # pylint: disable-msg=no-member
+        mask = pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO
+        # pylint: enable-msg=no-member
+        self.wdd = self.watch_mgr.add_watch(dirs["new"], mask, rec=False)
         self.notifier = pyinotify.ThreadedNotifier(
             self.watch_mgr, EventHandler(queues=queues, dirs=dirs)
         )
@@ -45,6 +47,7 @@ class EventHandler(pyinotify.ProcessEvent):
     Public Methods
     --------------
     process_IN_CREATE()
+    process_IN_MOVED_TO()
     """
 
     def my_init(self, queues, dirs):  # pylint: disable-msg=arguments-differ
@@ -76,3 +79,13 @@ class EventHandler(pyinotify.ProcessEvent):
         # logi("New file event '%s'", os.path.basename(event.pathname))
         logd("inotify 'IN_CREATE' event full file path '%s'", event.pathname)
         process_jobfile(event.pathname, self.queues)
+
+    def process_IN_MOVED_TO(self, event):  # pylint: disable-msg=invalid-name
+        """Method handling 'moved to' events, e.g. jobfiles renamed into place.
+
+        Parameters
+        ----------
+        event : pyinotify.Event
+        """
+        logd("inotify 'IN_MOVED_TO' event full file path '%s'", event.pathname)
+        process_jobfile(event.pathname, self.queues)
@@ -18,8 +18,10 @@ import time
 import json
 from hashlib import sha1
 
-from . import logi, logd, logw, logc, loge
+from . import logi, logd, logw, logc, loge, lazy, debug_enabled
 from . import JOBFILE_VER
+from . import metrics, trace
+from .queue import QuotaExceeded, route_deletion
 
 
 ### TODO (refactoring): group exception-silencing functions into own module
@@ -42,6 +44,7 @@ def select_queue_for_job(job, mapping=None):
         mapping = {
             "hucore": {"decon": "hucore", "preview": "hucore"},
             "dummy": {"sleep": "hucore"},
+            "synthetic": {"synthetic": "hucore"},
         }
     if job["type"] not in mapping:
         logc("No queue found for jobtype '%s'!", job["type"])
@@ -71,40 +74,64 @@ def process_jobfile(fname, queues, mapping=None):
         corresponding 'type' keyword as identifier.
     mapping : dict, optional
         A mapping being passed on to select_queue_for_job(), by default `None`.
+
+    Returns
+    -------
+    JobDescription
+        The job parsed from the jobfile, `None` if it couldn't be parsed. A job
+        rejected as its category is over its quota has the status 'over_quota'
+        and the reason stored as 'rejection'.
     """
+    metrics.JOBFILES_RECEIVED.inc()
     try:
         job = JobDescription(fname, "file")
     except IOError as err:
         logw("Error reading job description file (%s), skipping.", err)
+        trace.record_jobfile(fname, "unreadable")
         # there is nothing to add to the queue and the IOError indicates
         # problems accessing the file, so we simply return silently:
-        return
+        return None
 
     except (SyntaxError, ValueError) as err:
         # jobfile was already moved out of the way by the constructor of the
         # JobDescription object, so we simply stop here and return:
-        return
+        metrics.JOBFILE_PARSE_FAILURES.inc()
+        trace.record_jobfile(fname, "invalid")
+        return None
 
     if job["type"] == "deletejobs":
         logw("Received job deletion request(s)!")
-        # TODO: append only to specific queue!
-        for queue in queues.itervalues():
-            for delete_id in job["ids"]:
-                queue.deletion_list.append(delete_id)
+        trace.record_jobfile(fname, "deletion", job)
+        for delete_id in job["ids"]:
+            route_deletion(delete_id, queues.values())
         # we're finished, so move the jobfile and return:
         job.move_jobfile("done")
-        return
+        return job
     selected_queue = select_queue_for_job(job, mapping)
     if selected_queue not in queues:
         logc("Selected queue does not exist: %s", selected_queue)
+        trace.record_jobfile(fname, "no_queue", job)
         job.move_jobfile("done")
-        return
+        return job
 
     job.move_jobfile("cur")
     try:
         queues[selected_queue].append(job)
+    except QuotaExceeded as err:
+        logw("Rejecting the job from [%s]: %s", fname, err)
+        metrics.JOBS_OVER_QUOTA.inc(category=job.get_category())
+        trace.record_jobfile(fname, "over_quota", job)
+        job["status"] = "over_quota"
+        job["rejection"] = str(err)
+        queues[selected_queue].publish("rejected", job, reason=job["rejection"])
+        job.move_jobfile("done", ".over_quota")
+        return job
     except ValueError as err:
         loge("Adding the new job from [%s] failed:\n    %s", fname, err)
+        trace.record_jobfile(fname, "rejected", job)
+        return job
+    trace.record_jobfile(fname, "queued", job)
+    return job
 
 
 ### TODO (refactoring): group exception-silencing functions into own module
@@ -249,6 +276,61 @@ class AbstractJobConfigParser(dict):
         # by now the section should be fully parsed and therefore empty:
         self.check_for_remaining_options("snijderjob")
 
+    def parse_optional_entries(self, section, mapping):
+        """Helper function to read optional options from a section.
+
+        Options present in the section are removed from it (like in
+        `parse_section_entries()`), missing ones are set to their default value.
+
+        Parameters
+        ----------
+        section : str
+            The name of the section to parse.
+        mapping : list of tuples
+            A list of tuples containing the mapping from the option names in the
+            config file to the key names in the JobDescription object plus the default
+            value to use if the option is missing, e.g.
+
+            mapping = [
+                ['cores', 'cores', None],
+                ['memory', 'memory', None]
+            ]
+        """
+        for cfg_option, job_key, default in mapping:
+            if self.jobparser.has_option(section, cfg_option):
+                self[job_key] = self.get_option(section, cfg_option)
+            else:
+                self[job_key] = default
+
+    def parse_int(self, key, minimum=None):
+        """Helper function converting an (optional) entry to an integer.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry to convert, entries being `None` are left untouched.
+        minimum : int, optional
+            The smallest valid value, by default `None` (no restriction).
+        """
+        if self[key] is None:
+            return
+        try:
+            self[key] = int(self[key])
+        except ValueError:
+            raise ValueError("Invalid value for '%s': %s" % (key, self[key]))
+        if minimum is not None and self[key] < minimum:
+            raise ValueError("Invalid value for '%s': %s" % (key, self[key]))
+
+    def parse_positive_int(self, key):
+        """Helper function converting an (optional) entry to a positive integer.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry to convert, entries being `None` are left untouched.
+        """
+        self.parse_int(key, minimum=1)
+
     def parse_jobconfig(self, cfg_raw):
         """Initialize ConfigParser and run parsing method."""
         # we only initialize the ConfigParser object now, not in __init__():
@@ -304,6 +386,18 @@ class SnijderJobConfigParser(AbstractJobConfigParser):
             ["timestamp", "timestamp"],
             ["jobtype", "type"],
         ]
+        # the requested resources are optional (memory is given in MB, the
+        # walltime in minutes), as is the priority (higher values are served
+        # first within the jobs of a user, negative ones are allowed):
+        self.parse_optional_entries(
+            "snijderjob",
+            [
+                ["cores", "cores", None],
+                ["memory", "memory", None],
+                ["walltime", "walltime", None],
+                ["priority", "priority", 0],
+            ],
+        )
         # now parse the section:
         self.parse_section_entries("snijderjob", mapping)
         # sanity-check / validate the parsed options:
@@ -326,11 +420,17 @@ class SnijderJobConfigParser(AbstractJobConfigParser):
                 self["timestamp"] = float(self["timestamp"])
             except ValueError:
                 raise ValueError("Invalid timestamp: %s." % self["timestamp"])
+        self.parse_positive_int("cores")
+        self.parse_positive_int("memory")
+        self.parse_positive_int("walltime")
+        self.parse_int("priority")
         # now call the jobtype-specific parser method(s):
         if self["type"] == "hucore":
             self.parse_job_hucore()
         elif self["type"] == "dummy":
             self.parse_job_dummy()
+        elif self["type"] == "synthetic":
+            self.parse_job_synthetic()
         elif self["type"] == "deletejobs":
             self.parse_job_deletejobs()
         else:
@@ -371,6 +471,47 @@ class SnijderJobConfigParser(AbstractJobConfigParser):
         if self["tasktype"] != "sleep":
             raise ValueError("Tasktype invalid: %s" % self["tasktype"])
 
+    def parse_job_synthetic(self):
+        """Do the specific parsing of "synthetic" type jobfiles.
+
+        All options of the "synthetic" section are optional, durations are given in
+        seconds, the memory footprint and the I/O volumes in MiB. Input files listed
+        in an (optional) "inputfiles" section are staged and used for reading.
+        """
+        if "synthetic" not in self.sections:
+            raise ValueError("Section 'synthetic' missing in job config!")
+        mapping = [
+            ["tasktype", "tasktype", "synthetic"],
+            ["cpu", "cpu", "1"],
+            ["threads", "threads", "1"],
+            ["footprint", "footprint", "0"],
+            ["read", "read", "0"],
+            ["write", "write", "0"],
+            ["output", "output", "0"],
+        ]
+        self.parse_optional_entries("synthetic", mapping)
+        self.check_for_remaining_options("synthetic")
+        if self["tasktype"] != "synthetic":
+            raise ValueError("Tasktype invalid: %s" % self["tasktype"])
+        self.parse_positive_int("threads")
+        for key in ["cpu", "footprint", "read", "write", "output"]:
+            try:
+                self[key] = float(self[key])
+            except ValueError:
+                raise ValueError("Invalid value for '%s': %s" % (key, self[key]))
+            if self[key] < 0:
+                raise ValueError("Negative value for '%s': %s" % (key, self[key]))
+        if "inputfiles" in self.sections:
+            # the inputs are staged into the job directory using their basename:
+            basenames = set()
+            for option in self.jobparser.options("inputfiles"):
+                infile = self.get_option("inputfiles", option)
+                basename = os.path.basename(infile)
+                if basename in basenames:
+                    raise ValueError("Duplicate input file name: %s" % basename)
+                basenames.add(basename)
+                self["infiles"].append(infile)
+
     def parse_job_deletejobs(self):
         """Do the specific parsing of "deletejobs" type jobfiles."""
         if "deletejobs" not in self.sections:
@@ -396,15 +537,31 @@ class JobDescription(dict):
         dict. Can be left at its default 'None', but this only makes sense for testing,
         probably not in a real scenario.
 
+    phases : list(str)
+        The phases of the job lifecycle, in the order they are passed.
+
     Instance Variables
     ------------------
     fname : str
         The file name from where the job configuration has been parsed, or 'None' in
         case the job was supplied in a string directly.
+    timings : dict
+        The timestamps of the lifecycle phases the job has passed, see `mark()`.
     """
 
     spooldirs = None
 
+    phases = [
+        "created",  # the jobfile has been written (its mtime)
+        "parsed",  # the job description has been parsed
+        "enqueued",  # the job has been added to a queue
+        "selected",  # the job has been picked by the scheduler for processing
+        "submitted",  # the job has been submitted by the gc3 engine
+        "running",  # the job process is running
+        "terminated",  # the job process has terminated
+        "harvested",  # the results of the job have been collected by the spooler
+    ]
+
     def __init__(self, job, srctype):
         """Initialize depending on the type of description source.
 
@@ -422,6 +579,7 @@ class JobDescription(dict):
         >>> job = snijder.JobDescription('/path/to/jobdescription.cfg', 'file')
         """
         super(JobDescription, self).__init__()
+        self.timings = dict()
 
         if JobDescription.spooldirs is None:
             logc(
@@ -430,6 +588,10 @@ class JobDescription(dict):
             )
         if srctype == "file":
             self.fname = job
+            try:
+                self.mark("created", os.stat(job).st_mtime)
+            except OSError:
+                pass
         else:
             self.fname = None
         try:
@@ -444,23 +606,78 @@ class JobDescription(dict):
             raise err
         self.update(parsed_job)
         del parsed_job
+        self.mark("parsed")
 
         logd("Finished initialization of JobDescription().")
-        logd(pprint.pformat(self))
+        logd("%s", lazy(pprint.pformat, self))
 
     def __setitem__(self, key, value):
         if self.has_key(key) and self[key] == value:
             return
-        logd("Setting JobDescription '%s' to '%s'", key, value)
+        if debug_enabled():
+            logd("Setting JobDescription '%s' to '%s'", key, value)
         super(JobDescription, self).__setitem__(key, value)
         # on status changes, update / store the job
         if key == "status":
             self.store_job()
 
+    def mark(self, phase, timestamp=None):
+        """Record the time a job enters a phase of its lifecycle.
+
+        As the phases are passed in order, marking a phase discards the timestamps
+        of all later ones (e.g. when a job is put back to the queue for a retry).
+
+        NOTE: Python 2 doesn't provide a monotonic clock, so wall-clock time is used
+        for all timestamps (which is also what the jobfile mtime is based on).
+
+        Parameters
+        ----------
+        phase : str
+            One of the phases listed in `JobDescription.phases`.
+        timestamp : float, optional
+            The time the phase was entered, by default `None` meaning "now".
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        later = JobDescription.phases[JobDescription.phases.index(phase) :]
+        previous = self.last_phase()
+        for name in later:
+            self.timings.pop(name, None)
+        self.timings[phase] = timestamp
+        if previous is not None and previous not in later:
+            metrics.JOB_PHASE.observe(timestamp - self.timings[previous], phase=phase)
+
+    def last_phase(self):
+        """Get the name of the latest phase recorded for the job (or `None`)."""
+        for phase in reversed(JobDescription.phases):
+            if phase in self.timings:
+                return phase
+        return None
+
+    def phase_durations(self):
+        """Get the time spent on the way to each recorded phase.
+
+        Returns
+        -------
+        dict
+            The durations in seconds, using the name of the phase that has been
+            reached as the key. E.g. 'selected' holds the time the job has been
+            waiting in the queue, 'terminated' the time the job was running.
+        """
+        durations = dict()
+        previous = None
+        for phase in JobDescription.phases:
+            if phase not in self.timings:
+                continue
+            if previous is not None:
+                durations[phase] = self.timings[phase] - self.timings[previous]
+            previous = phase
+        return durations
+
     def store_job(self):
         """Store the job configuration into a JSON file."""
         # TODO: implement real storing instead of dumping the json!
-        logd("JobDescription.store_job: %s", json.dumps(self))
+        logd("JobDescription.store_job: %s", lazy(json.dumps, self))
 
     def move_jobfile(self, target, suffix=".jobfile"):
         """Move a jobfile to the desired spooling subdir.
@@ -490,6 +707,9 @@ class JobDescription(dict):
         target = os.path.join(JobDescription.spooldirs[target], self["uid"] + suffix)
         # pylint: enable-msg=unsubscriptable-object
 
+        if os.path.abspath(target) == os.path.abspath(self.fname):
+            logd("Job file '%s' is in place already.", target)
+            return
         if os.path.exists(target):
             target += ".%s" % time.time()
             logd("Adding suffix to prevent overwriting file: %s", target)
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""Synthetic load generator for benchmarking the jobfile ingestion.
+
+Valid jobfiles are written into the 'new' spooling directory of a running queue
+manager at a configurable rate, optionally in bursts. The submitting users follow
+a Zipf distribution (a few users submitting most of the jobs, like in production),
+the tasktypes are drawn from a configurable mix and a fraction of the submissions
+can be followed by a deletion request for one of the jobs submitted before.
+
+For every job the time until it shows up in the queue's status JSON file is
+measured, which covers the inotify event, parsing and enqueueing.
+
+Classes
+-------
+
+LoadGenerator()
+    Submission of jobfiles and measurement of the ingestion latencies.
+"""
+
+import json
+import os
+import random
+import time
+from hashlib import sha1
+
+from . import logi, logd, logw, JOBFILE_VER
+from .trace import percentile
+
+HUCORE_JOBFILE = """# generated job %(seq)s
+[snijderjob]
+version = %(version)s
+username = %(user)s
+useremail = %(user)s@loadgen
+jobtype = hucore
+timestamp = %(timestamp).6f
+
+[hucore]
+tasktype = %(tasktype)s
+executable = /usr/local/bin/hucore
+template = %(template)s
+
+[inputfiles]
+file1 = %(infile)s
+"""
+
+DUMMY_JOBFILE = """# generated job %(seq)s
+[snijderjob]
+version = %(version)s
+username = %(user)s
+useremail = %(user)s@loadgen
+jobtype = dummy
+timestamp = %(timestamp).6f
+
+[hucore]
+tasktype = sleep
+executable = /bin/sleep
+"""
+
+DELETE_JOBFILE = """# generated deletion request %(seq)s
+[snijderjob]
+version = %(version)s
+username = %(user)s
+useremail = %(user)s@loadgen
+jobtype = deletejobs
+timestamp = %(timestamp).6f
+
+[deletejobs]
+ids = %(ids)s
+"""
+
+# the hucore templates used for the generated jobs (the ones of the test suite):
+TEMPLATES = {
+    "decon": "tests/snijder-queue/scripts/hucore-templates/"
+    "decon_faba128_it-3_q-0.5.hgsb",
+    "preview": "tests/snijder-queue/scripts/hucore-templates/preview_faba128.hgsb",
+}
+
+INFILE = "resources/sample_data/hucore/faba128.h5"
+
+
+def zipf_weights(count, exponent=1.0):
+    """Calculate the (normalized) weights of a Zipf distribution.
+
+    Parameters
+    ----------
+    count : int
+        The number of ranks (e.g. users).
+    exponent : float, optional
+        The skew, 0 meaning uniform, by default 1.0.
+
+    Returns
+    -------
+    list(float)
+        The probabilities, the first rank being the most likely one.
+    """
+    weights = [1.0 / rank ** exponent for rank in range(1, count + 1)]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+def parse_mix(mix):
+    """Parse a tasktype mix specification like 'decon=6,preview=3,sleep=1'.
+
+    Parameters
+    ----------
+    mix : str
+
+    Returns
+    -------
+    dict
+        The tasktypes as keys and their (normalized) probabilities as values.
+    """
+    weights = dict()
+    for item in mix.split(","):
+        tasktype, _, weight = item.partition("=")
+        tasktype = tasktype.strip()
+        if tasktype not in ["decon", "preview", "sleep"]:
+            raise ValueError("Unsupported tasktype in mix: %s" % tasktype)
+        weights[tasktype] = float(weight) if weight else 1.0
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("Invalid tasktype mix: %s" % mix)
+    return dict([(key, value / total) for key, value in weights.items()])
+
+
+def weighted_choice(rng, choices, weights):
+    """Pick one of the choices according to their weights."""
+    threshold = rng.random() * sum(weights)
+    for choice, weight in zip(choices, weights):
+        threshold -= weight
+        if threshold < 0:
+            return choice
+    return choices[-1]
+
+
+class LoadGenerator(object):
+
+    """Generator submitting jobfiles to a spooling directory.
+
+    Instance Attributes
+    -------------------
+    dirs : dict
+        The 'new' spooling directory and the 'status' file of the queue.
+    rate : float
+        The average number of jobs submitted per second.
+    burst : int
+        The number of jobs submitted at once.
+    poisson : bool
+        Whether the bursts arrive as a Poisson process or at a constant interval.
+    users : list(str)
+        The user names, ordered by their Zipf rank.
+    user_weights : list(float)
+    mix : dict
+        The probabilities of the tasktypes.
+    deletions : float
+        The probability of a submission being followed by a deletion request.
+    """
+
+    # pylint: disable-msg=too-many-arguments,too-many-instance-attributes
+    def __init__(
+        self,
+        spooldir,
+        rate=1.0,
+        burst=1,
+        poisson=False,
+        users=10,
+        zipf=1.0,
+        mix="decon=6,preview=3,sleep=1",
+        deletions=0.0,
+        queue="hucore",
+        seed=None,
+    ):
+        """Set up the load generator.
+
+        Parameters
+        ----------
+        spooldir : str
+            The spooling directory of the queue manager (its '--spooldir').
+        rate : float, optional
+            Jobs per second, by default 1.0.
+        burst : int, optional
+            The number of jobs submitted at once, by default 1.
+        poisson : bool, optional
+            Use exponentially distributed intervals between the bursts instead of
+            constant ones, by default False.
+        users : int, optional
+            The number of submitting users, by default 10.
+        zipf : float, optional
+            The exponent of the Zipf distribution of the users, by default 1.0.
+        mix : str, optional
+            The tasktype mix, see `parse_mix()`.
+        deletions : float, optional
+            The fraction of submissions followed by a deletion request.
+        queue : str, optional
+            The name of the queue whose status file is checked, by default
+            'hucore'.
+        seed : int, optional
+        """
+        self.dirs = {
+            "new": os.path.join(spooldir, "spool", "new"),
+            "status": os.path.join(spooldir, "queue", "status", queue + ".json"),
+        }
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+        self.poisson = poisson
+        self.users = ["loaduser%03i" % i for i in range(users)]
+        self.user_weights = zipf_weights(users, zipf)
+        self.mix = parse_mix(mix)
+        self.deletions = deletions
+        self.rng = random.Random(seed)
+        self._seq = 0
+
+    def jobfile(self, user, tasktype):
+        """Assemble a jobfile.
+
+        Parameters
+        ----------
+        user : str
+        tasktype : str
+            One of 'decon', 'preview' or 'sleep' (a dummy job).
+
+        Returns
+        -------
+        str
+        """
+        self._seq += 1
+        values = {
+            "seq": self._seq,
+            "version": JOBFILE_VER,
+            "user": user,
+            "timestamp": time.time(),
+            "tasktype": tasktype,
+            "template": TEMPLATES.get(tasktype),
+            "infile": INFILE,
+        }
+        if tasktype == "sleep":
+            return DUMMY_JOBFILE % values
+        return HUCORE_JOBFILE % values
+
+    def deletion(self, user, uids):
+        """Assemble a deletion request jobfile for the given UIDs."""
+        self._seq += 1
+        values = {
+            "seq": self._seq,
+            "version": JOBFILE_VER,
+            "user": user,
+            "timestamp": time.time(),
+            "ids": ", ".join(uids),
+        }
+        return DELETE_JOBFILE % values
+
+    def submit(self, content):
+        """Write a jobfile into the 'new' spooling directory.
+
+        The jobfile is written next to the directory first and then renamed into
+        it, so the queue manager never sees a partially written one.
+
+        Returns
+        -------
+        str
+            The UID the queue manager will assign to the job.
+        """
+        uid = sha1(content).hexdigest()
+        name = "loadgen_%s.cfg" % uid[:12]
+        tmpname = os.path.join(os.path.dirname(self.dirs["new"]), "." + name)
+        with open(tmpname, "w") as jobfile:
+            jobfile.write(content)
+        os.rename(tmpname, os.path.join(self.dirs["new"], name))
+        return uid
+
+    def interval(self):
+        """Get the time until the next burst is due."""
+        mean = self.burst / self.rate
+        if self.poisson:
+            return self.rng.expovariate(1.0 / mean)
+        return mean
+
+    def queued_uids(self):
+        """Get the UIDs of all jobs listed in the queue's status file."""
+        try:
+            with open(self.dirs["status"], "r") as statusfile:
+                status = json.load(statusfile)
+        except (IOError, ValueError) as err:
+            # the file may not exist yet or is currently being written:
+            logd("Unable to read the status file: %s", err)
+            return set()
+        return set([job["id"] for job in status.get("jobs", [])])
+
+    def run(self, count, timeout=60, poll=0.05):
+        """Submit jobs and measure the time until they show up in the status.
+
+        Parameters
+        ----------
+        count : int
+            The number of jobs to submit (excluding deletion requests).
+        timeout : float, optional
+            The time to wait for jobs to show up after the last submission.
+        poll : float, optional
+            The interval for checking the status file.
+
+        Returns
+        -------
+        dict
+            The report with the number of submitted, deleted, seen and missed jobs,
+            the achieved submission rate and the ingestion latency statistics.
+        """
+        submitted = dict()
+        order = list()
+        seen = dict()
+        deleted = set()
+
+        def check_status():
+            """Record the jobs that appeared in the status file."""
+            now = time.time()
+            for uid in self.queued_uids():
+                if uid in submitted and uid not in seen:
+                    seen[uid] = now
+
+        logi(
+            "Submitting %s jobs at %s jobs/s (bursts of %s) to [%s].",
+            count,
+            self.rate,
+            self.burst,
+            self.dirs["new"],
+        )
+        tasktypes = sorted(self.mix)
+        tasktype_weights = [self.mix[tasktype] for tasktype in tasktypes]
+        started = due = time.time()
+        while len(submitted) < count:
+            while time.time() < due:
+                check_status()
+                time.sleep(min(poll, max(due - time.time(), 0)))
+            for _ in range(min(self.burst, count - len(submitted))):
+                user = weighted_choice(self.rng, self.users, self.user_weights)
+                tasktype = weighted_choice(self.rng, tasktypes, tasktype_weights)
+                uid = self.submit(self.jobfile(user, tasktype))
+                submitted[uid] = time.time()
+                order.append(uid)
+                if self.rng.random() < self.deletions:
+                    victim = self.rng.choice(order)
+                    self.submit(self.deletion(user, [victim]))
+                    deleted.add(victim)
+            due += self.interval()
+        submit_time = time.time() - started
+
+        deadline = time.time() + timeout
+        while set(submitted) - set(seen) - deleted and time.time() < deadline:
+            check_status()
+            time.sleep(poll)
+        check_status()
+        missed = set(submitted) - set(seen) - deleted
+        if missed:
+            logw("%s jobs never showed up in the status file.", len(missed))
+
+        latencies = [seen[uid] - submitted[uid] for uid in seen]
+        return {
+            "submitted": len(submitted),
+            "deleted": len(deleted),
+            "seen": len(seen),
+            "missed": len(missed),
+            "rate": len(submitted) / submit_time if submit_time else 0.0,
+            "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_max": max(latencies) if latencies else None,
+        }
+
+
+def format_report(report):
+    """Format a load generator report as a human readable text.
+
+    Parameters
+    ----------
+    report : dict
+        A report as returned by `LoadGenerator.run()`.
+
+    Returns
+    -------
+    str
+    """
+    lines = [
+        "%(submitted)s jobs submitted (%(deleted)s deletion requests), %(seen)s seen "
+        "in the status, %(missed)s missed" % report,
+        "  submission rate: %10.2f jobs/s" % report["rate"],
+    ]
+    for key in ["latency_mean", "latency_p50", "latency_p95", "latency_max"]:
+        if report[key] is not None:
+            label = key.replace("_", " ") + ":"
+            lines.append("  %-16s %10.3f s" % (label, report[key]))
+    return "\n".join(lines)
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 """Logging helper module."""
 
+import json
 import logging
+import logging.handlers
+import threading
+import Queue
+
 import gc3libs
 
-__all__ = ["logw", "logi", "logd", "loge", "logc"]
+__all__ = ["logw", "logi", "logd", "loge", "logc", "lazy", "debug_enabled"]
 
 LOGLEVEL = logging.WARN
 
@@ -38,6 +43,37 @@ LEVEL_MAPPING = {
 }
 
 
+class lazy(object):  # pylint: disable-msg=invalid-name,too-few-public-methods
+
+    """Deferred formatting of expensive log message arguments.
+
+    Convention for log calls in hot paths: never format anything eagerly, pass the
+    objects as arguments instead and wrap any expensive representation in `lazy`,
+    so the work is only done if the message is actually emitted, e.g.
+
+    >>> logd("Parsed job:\n%s", lazy(pprint.pformat, job))
+
+    If even assembling the arguments is expensive, guard the call with
+    `debug_enabled()` instead.
+    """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+        self._text = None
+
+    def __str__(self):
+        # every handler formats the record, but the work is only done once:
+        if self._text is None:
+            self._text = str(self.func(*self.args))
+        return self._text
+
+
+def debug_enabled():
+    """Check if messages of the 'debug' level are emitted at all."""
+    return LOGGER.isEnabledFor(logging.DEBUG)
+
+
 def set_loglevel(level):
     """Convenience function to adjust the loglevel.
 
@@ -61,6 +97,170 @@ def set_verbosity(verbosity):
     LOGGER.setLevel(loglevel)
 
 
+def job_fields(job, queue=None):
+    """Assemble the structured log fields describing a job.
+
+    Intended to be passed as the `extra` argument of the logging calls, e.g.
+
+    >>> logi("Enqueueing job [uid:%.7s].", job["uid"], extra=job_fields(job))
+
+    Parameters
+    ----------
+    job : snijder.jobs.JobDescription
+    queue : str, optional
+        The name of the queue the job belongs to, by default `None`.
+
+    Returns
+    -------
+    dict
+    """
+    return {
+        "uid": job.get("uid"),
+        "user": job.get("user"),
+        "state": str(job.get("status")),
+        "queue": queue,
+    }
+
+
+class JsonFormatter(logging.Formatter):
+
+    """Formatter creating one JSON object per log record (JSON-lines)."""
+
+    # structured fields copied from the record if present (see `job_fields()`):
+    fields = ["uid", "user", "queue", "state"]
+
+    def format(self, record):
+        """Format the record as a single-line JSON string."""
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.fields:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class QueueHandler(logging.Handler):
+
+    """Handler putting log records into a queue for a background writer.
+
+    Emitting a record only formats its message and puts it into the queue, the
+    (potentially blocking) I/O is done by a BackgroundLogWriter thread.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def emit(self, record):
+        """Put the record into the queue, merging the message and its arguments.
+
+        The arguments are merged right away as they might be changed by the caller
+        before the background writer processes the record.
+        """
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except Exception:  # pylint: disable-msg=broad-except
+            self.handleError(record)
+
+
+class BackgroundLogWriter(object):
+
+    """Thread passing queued log records on to a (blocking) handler.
+
+    Instance Attributes
+    -------------------
+    queue : Queue.Queue
+        The queue the records are taken from.
+    handler : logging.Handler
+        The handler the records are passed on to.
+    thread : threading.Thread
+    """
+
+    _sentinel = None
+
+    def __init__(self, queue, handler):
+        self.queue = queue
+        self.handler = handler
+        self.thread = threading.Thread(target=self._process)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _process(self):
+        """Pass on records from the queue until the sentinel is received."""
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                break
+            if record.exc_text:
+                record.msg = "%s\n%s" % (record.msg, record.exc_text)
+                record.exc_text = None
+            self.handler.handle(record)
+
+    def stop(self):
+        """Process all remaining records, then stop the thread."""
+        self.queue.put(self._sentinel)
+        self.thread.join()
+        self.handler.close()
+
+
+def enable_structured_logging(logfile, max_bytes=50 * 1024 * 1024, backups=5):
+    """Switch to JSON-lines logging into a rotating file via a background thread.
+
+    The synchronous stream handler is removed from the root logger and replaced by
+    a QueueHandler, so log calls don't block on I/O.
+
+    Parameters
+    ----------
+    logfile : str
+        The file to write the JSON-lines log to.
+    max_bytes : int, optional
+        The size at which the log file is rotated, by default 50 MB.
+    backups : int, optional
+        The number of rotated log files to keep, by default 5.
+
+    Returns
+    -------
+    BackgroundLogWriter
+        The writer thread, to be stopped on shutdown for flushing the log.
+    """
+    target = logging.handlers.RotatingFileHandler(
+        logfile, maxBytes=max_bytes, backupCount=backups
+    )
+    target.setFormatter(JsonFormatter())
+    records = Queue.Queue()
+    writer = BackgroundLogWriter(records, target)
+    ROOT_LOGGER.removeHandler(LOG_HANDLER)
+    ROOT_LOGGER.addHandler(QueueHandler(records))
+    return writer
+
+
+def disable_structured_logging(writer):
+    """Stop the background writer and switch back to the synchronous handler.
+
+    Parameters
+    ----------
+    writer : BackgroundLogWriter
+        The writer as returned by `enable_structured_logging()`.
+    """
+    for handler in list(ROOT_LOGGER.handlers):
+        if isinstance(handler, QueueHandler) and handler.queue is writer.queue:
+            ROOT_LOGGER.removeHandler(handler)
+    ROOT_LOGGER.addHandler(LOG_HANDLER)
+    writer.stop()
+
+
 def set_gc3loglevel(level):
     """Set the logging level for gc3libs.
 
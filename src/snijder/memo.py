@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""Memoization of job results.
+
+Users frequently resubmit the very same job (e.g. after reloading a page in the
+browser), which differs from the previous one only by its timestamp and therefore
+has a different UID. Instead of running HuCore again, the results of an earlier
+run can be served if the job is computationally identical, judging by a canonical
+hash (see `job_identity()`) of:
+
+- the job type, tasktype and executable,
+- the content of the template,
+- the input files, identified by their name plus either their path, size and
+  modification time (the default) or the hash of their content.
+
+The results of successfully terminated jobs are stored in a cache directory (one
+sub-directory per identity), using hard links where possible so no additional
+space is needed while the original results exist. A hit is served by linking the
+cached files into the results directory the job would have written to. The cache
+is kept below a size budget by evicting the least recently used entries.
+
+NOTE: as the files are hard links, modifying (instead of replacing) a served file
+also modifies the cached one.
+
+Classes
+-------
+
+ResultCache()
+    Cache of job results, keyed by the job identity.
+"""
+
+import os
+import shutil
+from collections import OrderedDict
+from hashlib import sha1
+
+from . import logi, logd, logw
+
+
+def file_digest(fname, blocksize=1024 * 1024):
+    """Calculate the SHA1 hash of a file's content."""
+    digest = sha1()
+    with open(fname, "rb") as infile:
+        for block in iter(lambda: infile.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def job_identity(job, content=False):
+    """Calculate the canonical hash identifying the computation of a job.
+
+    Parameters
+    ----------
+    job : snijder.jobs.JobDescription
+    content : bool, optional
+        Identify the input files by the hash of their content instead of their
+        path, size and modification time, by default False.
+
+    Returns
+    -------
+    str
+        The hex digest, `None` if the job can't be memoized (i.e. it's not a
+        'hucore' job or one of its files is not accessible).
+    """
+    if job.get("type") != "hucore":
+        return None
+    identity = sha1()
+    identity.update("%s\0%s\0%s\0" % (job["type"], job["tasktype"], job["exec"]))
+    # the template is added to the input files when the app is created:
+    infiles = [infile for infile in job["infiles"] if infile != job["template"]]
+    try:
+        identity.update("template\0%s\0" % file_digest(job["template"]))
+        for infile in sorted(infiles, key=os.path.basename):
+            if content:
+                fileid = file_digest(infile)
+            else:
+                stat = os.stat(infile)
+                fileid = "%s\0%s\0%.6f" % (
+                    os.path.abspath(infile),
+                    stat.st_size,
+                    stat.st_mtime,
+                )
+            identity.update("%s\0%s\0" % (os.path.basename(infile), fileid))
+    except (IOError, OSError) as err:
+        logd("Not memoizing job [uid:%.7s]: %s", job["uid"], err)
+        return None
+    return identity.hexdigest()
+
+
+def link_tree(source, target):
+    """Replicate a directory tree using hard links (copying if linking fails).
+
+    Returns
+    -------
+    int
+        The total size of the files in bytes.
+    """
+    total = 0
+    for dirpath, _, fnames in os.walk(source):
+        destdir = os.path.join(target, os.path.relpath(dirpath, source))
+        if not os.path.isdir(destdir):
+            os.makedirs(destdir)
+        for fname in fnames:
+            src = os.path.join(dirpath, fname)
+            dest = os.path.join(destdir, fname)
+            try:
+                os.link(src, dest)
+            except OSError:
+                # e.g. the cache is on a different file system:
+                shutil.copy2(src, dest)
+            total += os.path.getsize(dest)
+    return total
+
+
+def tree_size(path):
+    """Get the total size of the files in a directory tree in bytes."""
+    total = 0
+    for dirpath, _, fnames in os.walk(path):
+        for fname in fnames:
+            total += os.path.getsize(os.path.join(dirpath, fname))
+    return total
+
+
+class ResultCache(object):
+
+    """Cache of job results, keyed by the job identity (see `job_identity()`).
+
+    Instance Attributes
+    -------------------
+    cachedir : str
+        The directory holding the cached results, one sub-directory per entry.
+    budget : int
+        The maximum total size of the cached results in bytes, `None` for no limit.
+    content : bool
+        Whether input files are identified by the hash of their content.
+    """
+
+    def __init__(self, cachedir, budget=None, content=False):
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        self.cachedir = cachedir
+        self.budget = budget
+        self.content = content
+        # the sizes of the entries, the least recently used one first:
+        self._sizes = OrderedDict()
+        self._total = 0
+        entries = list()
+        for key in os.listdir(cachedir):
+            path = os.path.join(cachedir, key)
+            if key.startswith("."):
+                # left over from an interrupted store() call:
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.isdir(path):
+                entries.append((os.path.getmtime(path), key))
+        for _, key in sorted(entries):
+            self._sizes[key] = tree_size(self.path_of(key))
+            self._total += self._sizes[key]
+        logi(
+            "Result cache [%s]: %s entries, %s bytes (budget: %s).",
+            cachedir,
+            len(self._sizes),
+            self.size,
+            budget,
+        )
+
+    def __len__(self):
+        return len(self._sizes)
+
+    @property
+    def size(self):
+        """The total size of the cached results in bytes."""
+        return self._total
+
+    def identity(self, job):
+        """Get the identity of a job, see `job_identity()`."""
+        return job_identity(job, self.content)
+
+    def lookup(self, key):
+        """Get the directory with the cached results for an identity.
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        str
+            The directory, `None` if the results are not cached.
+        """
+        if key is None or key not in self._sizes:
+            return None
+        path = self.path_of(key)
+        self._sizes[key] = self._sizes.pop(key)
+        # the modification time of the entry tracks its last use across restarts:
+        os.utime(path, None)
+        return path
+
+    def serve(self, key, target):
+        """Link the cached results for an identity into a results directory.
+
+        Returns
+        -------
+        bool
+            True on success, False if the results are not (or no longer) cached.
+        """
+        path = self.lookup(key)
+        if path is None:
+            return False
+        try:
+            link_tree(path, target)
+        except (IOError, OSError) as err:
+            logw("Unable to serve cached results [%s]: %s", key, err)
+            return False
+        logi("Served cached results [%s] to [%s].", key[:12], target)
+        return True
+
+    def store(self, key, resultdir):
+        """Add the results of a job to the cache, then evict entries over budget.
+
+        Parameters
+        ----------
+        key : str
+            The identity of the job.
+        resultdir : str
+            The directory holding the results of the job.
+        """
+        if key is None or key in self._sizes or not os.path.isdir(resultdir):
+            return
+        tmpdir = os.path.join(self.cachedir, "." + key)
+        try:
+            size = link_tree(resultdir, tmpdir)
+            os.rename(tmpdir, self.path_of(key))
+        except (IOError, OSError) as err:
+            logw("Unable to cache the results in [%s]: %s", resultdir, err)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+        self._sizes[key] = size
+        self._total += size
+        logd("Cached results [%s] (%s bytes) from [%s].", key[:12], size, resultdir)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits its budget."""
+        if self.budget is None:
+            return
+        while self._sizes and self._total > self.budget:
+            key, size = self._sizes.popitem(last=False)
+            logi("Evicting cached results [%s] (%s bytes).", key, size)
+            shutil.rmtree(self.path_of(key), ignore_errors=True)
+            self._total -= size
+
+    def path_of(self, key):
+        """Get the directory of a cache entry."""
+        return os.path.join(self.cachedir, key)
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""Metrics collection and exposition in the Prometheus text format.
+
+The metrics defined at the bottom of this module are updated by the queue, the
+jobfile parser and the spooler. They can be exposed through a local HTTP endpoint
+(see `MetricsServer`) for being scraped by Prometheus or any compatible tool.
+
+Classes
+-------
+
+Counter(), Gauge(), Histogram()
+    The metric types.
+Registry()
+    A collection of metrics that can be rendered in the text exposition format.
+MetricsServer()
+    A minimal HTTP server in a background thread serving the '/metrics' path.
+"""
+
+import threading
+import BaseHTTPServer
+
+from . import logi, logd
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# bucket boundaries (seconds) for short operations, e.g. a spooler loop iteration:
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# bucket boundaries (seconds) for job related durations (minutes to hours):
+JOB_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400)
+
+
+def format_value(value):
+    """Format a sample value (or bucket boundary) for the exposition format."""
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return repr(int(value))
+    return repr(value)
+
+
+def format_labels(labelnames, labelvalues):
+    """Format a label set for the exposition format, e.g. '{queue="hucore"}'."""
+    if not labelnames:
+        return ""
+    pairs = list()
+    for name, value in zip(labelnames, labelvalues):
+        value = str(value).replace("\\", r"\\").replace("\n", r"\n")
+        pairs.append('%s="%s"' % (name, value.replace('"', r"\"")))
+    return "{%s}" % ",".join(pairs)
+
+
+class Metric(object):
+
+    """Base class for all metric types.
+
+    Instance Attributes
+    -------------------
+    name : str
+        The metric name, e.g. 'snijder_jobfiles_received_total'.
+    doc : str
+        The help text of the metric.
+    labelnames : tuple(str)
+        The names of the labels of this metric.
+    """
+
+    metric_type = "untyped"
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """Get the tuple of label values (in order) from a labels dict."""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                "Metric '%s' requires labels %s, got %s"
+                % (self.name, self.labelnames, sorted(labels))
+            )
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """Get the samples of this metric.
+
+        Returns
+        -------
+        list(tuple)
+            A list of tuples (suffix, labelnames, labelvalues, value).
+        """
+        with self._lock:
+            values = self._values.items()
+        return [("", self.labelnames, key, value) for key, value in sorted(values)]
+
+    def render(self):
+        """Render the metric in the text exposition format.
+
+        Returns
+        -------
+        list(str)
+            The lines of the rendered metric.
+        """
+        lines = [
+            "# HELP %s %s" % (self.name, self.doc),
+            "# TYPE %s %s" % (self.name, self.metric_type),
+        ]
+        for suffix, labelnames, labelvalues, value in self.samples():
+            lines.append(
+                "%s%s%s %s"
+                % (
+                    self.name,
+                    suffix,
+                    format_labels(labelnames, labelvalues),
+                    format_value(value),
+                )
+            )
+        return lines
+
+
+class Counter(Metric):
+
+    """A monotonically increasing counter."""
+
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Increment the counter (for the given labels) by `amount`."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    """A value that can go up and down.
+
+    Instead of setting the values explicitly, a collector function can be assigned
+    that will be called whenever the metric is rendered, returning a dict with the
+    tuples of label values as keys.
+    """
+
+    metric_type = "gauge"
+
+    def __init__(self, name, doc, labelnames=()):
+        super(Gauge, self).__init__(name, doc, labelnames)
+        self.collector = None
+
+    def set(self, value, **labels):
+        """Set the gauge (for the given labels) to `value`."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        """Get the samples, calling the collector function if one is assigned."""
+        if self.collector is not None:
+            values = self.collector()
+            with self._lock:
+                self._values = values
+        return super(Gauge, self).samples()
+
+
+class Histogram(Metric):
+
+    """A histogram counting observations in cumulative buckets."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=FAST_BUCKETS):
+        super(Histogram, self).__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        """Record an observation (for the given labels)."""
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts, _, _ = entry = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        """Get the (cumulative) bucket, sum and count samples."""
+        with self._lock:
+            values = [
+                (key, list(entry[0]), entry[1], entry[2])
+                for key, entry in self._values.items()
+            ]
+        labelnames = self.labelnames + ("le",)
+        samples = list()
+        for key, counts, total, count in sorted(values):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(
+                    ("_bucket", labelnames, key + (format_value(bound),), cumulative)
+                )
+            samples.append(("_sum", self.labelnames, key, total))
+            samples.append(("_count", self.labelnames, key, count))
+        return samples
+
+
+class Registry(object):
+
+    """A collection of metrics."""
+
+    def __init__(self):
+        self.metrics = list()
+
+    def register(self, metric):
+        """Add a metric to the registry and return it."""
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Render all metrics in the text exposition format.
+
+        Returns
+        -------
+        str
+        """
+        lines = list()
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """Request handler serving the metrics of the server's registry."""
+
+    def do_GET(self):  # pylint: disable-msg=invalid-name
+        """Serve the rendered metrics on '/metrics', a 404 on any other path."""
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable-msg=redefined-builtin
+        """Send the access log messages to the debug log."""
+        logd("metrics endpoint: " + format, *args)
+
+
+class MetricsServer(object):
+
+    """HTTP server exposing a metrics registry in a background thread.
+
+    Instance Attributes
+    -------------------
+    httpd : BaseHTTPServer.HTTPServer
+    thread : threading.Thread
+    """
+
+    def __init__(self, port, address="127.0.0.1", registry=None):
+        """Start serving the metrics.
+
+        Parameters
+        ----------
+        port : int
+            The TCP port to listen on, 0 to pick a free one.
+        address : str, optional
+            The address to bind to, by default only the local host.
+        registry : Registry, optional
+            The registry to expose, by default `None` meaning the module's
+            `REGISTRY` will be used.
+        """
+        self.httpd = BaseHTTPServer.HTTPServer((address, port), MetricsHandler)
+        self.httpd.registry = registry if registry is not None else REGISTRY
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        logi("Serving metrics on http://%s:%s/metrics", *self.address)
+
+    @property
+    def address(self):
+        """Get the (address, port) tuple the server is listening on."""
+        return self.httpd.server_address
+
+    def shutdown(self):
+        """Stop serving the metrics."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def watch_queues(queues):
+    """Set up the collectors for the queue depth and job state metrics.
+
+    Parameters
+    ----------
+    queues : dict(snijder.queue.JobQueue)
+        The queues to report, using their names as the 'queue' label.
+    """
+
+    def collect_depth():
+        """Count the queued jobs per queue and category."""
+        values = dict()
+        for qname, queue in queues.items():
+            for category, jobids in queue.queue.items():
+                values[(qname, category)] = len(jobids)
+        return values
+
+    def collect_states():
+        """Count the jobs per queue and state."""
+        values = dict()
+        for qname, queue in queues.items():
+            for job in queue.jobs.values():
+                key = (qname, str(job["status"]))
+                values[key] = values.get(key, 0) + 1
+        return values
+
+    QUEUE_DEPTH.collector = collect_depth
+    JOBS.collector = collect_states
+
+
+REGISTRY = Registry()
+
+JOBFILES_RECEIVED = REGISTRY.register(
+    Counter("snijder_jobfiles_received_total", "Jobfiles picked up for parsing.")
+)
+JOBFILE_PARSE_FAILURES = REGISTRY.register(
+    Counter("snijder_jobfile_parse_failures_total", "Jobfiles that failed parsing.")
+)
+JOBS_OVER_QUOTA = REGISTRY.register(
+    Counter(
+        "snijder_jobs_over_quota_total",
+        "Jobs rejected as their category exceeded its limits.",
+        ["category"],
+    )
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge("snijder_queue_depth", "Jobs waiting for dispatch.", ["queue", "category"])
+)
+JOBS = REGISTRY.register(
+    Gauge("snijder_jobs", "Jobs known to the queues by state.", ["queue", "state"])
+)
+DISPATCH_LATENCY = REGISTRY.register(
+    Histogram(
+        "snijder_dispatch_latency_seconds",
+        "Time from a job being (re-)queued until dispatch.",
+        buckets=JOB_BUCKETS,
+    )
+)
+JOB_RUNTIME = REGISTRY.register(
+    Histogram(
+        "snijder_job_runtime_seconds",
+        "Time from dispatch until termination by tasktype.",
+        ["tasktype"],
+        buckets=JOB_BUCKETS,
+    )
+)
+JOB_PHASE = REGISTRY.register(
+    Histogram(
+        "snijder_job_phase_seconds",
+        "Time spent by jobs on the way to a lifecycle phase.",
+        ["phase"],
+        buckets=FAST_BUCKETS + JOB_BUCKETS[2:],
+    )
+)
+MEMO_LOOKUPS = REGISTRY.register(
+    Counter(
+        "snijder_memo_lookups_total",
+        "Result cache lookups of dispatched jobs by result (hit or miss).",
+        ["result"],
+    )
+)
+SPOOL_ITERATION = REGISTRY.register(
+    Histogram("snijder_spool_iteration_seconds", "Duration of a spooler iteration.")
+)
+ENGINE_PROGRESS = REGISTRY.register(
+    Histogram("snijder_engine_progress_seconds", "Duration of engine.progress().")
+)
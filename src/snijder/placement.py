@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""Placement of jobs on multiple (gc3) resources.
+
+Every enabled resource of the gc3pie configuration gets an engine of its own, the
+`ResourcePool` bundling them provides the engine interface used by the spooler and
+decides on which resource a newly dispatched app is placed. Each resource offers a
+number of slots (concurrently running jobs), the placement policy picks one of the
+resources having a free slot:
+
+- 'least-loaded': the resource with the lowest fraction of occupied slots
+- 'round-robin': the next resource (in the order of the configuration)
+- 'weighted': the resource with the most cores ('max_cores') per running job
+
+A resource whose engine fails or whose jobs repeatedly terminate without an exit
+code (i.e. they couldn't be submitted or were lost) is considered unhealthy and
+excluded from the placement for an (exponentially growing) backoff period.
+
+Optionally the placement takes into account where the input files of a job reside:
+an affinity map (see `load_affinity()`) lists the resources having local access to
+a storage volume (mount point). Among the available resources, the ones needing to
+transfer the least amount of data (judging by the file sizes) are preferred, the
+policy only deciding between those. If all local resources are saturated, the job
+is placed on one that needs a transfer.
+
+Classes
+-------
+
+Resource()
+    A gc3 resource with its engine, slots and health.
+ResourcePool()
+    Engine-like bundle of resources, placing apps according to a policy.
+"""
+
+import os
+import time
+from ConfigParser import SafeConfigParser
+
+import gc3libs
+
+from . import logi, logd, logw, loge
+from .executor import STATES
+from .trace import input_sizes
+
+POLICIES = ["least-loaded", "round-robin", "weighted"]
+
+
+def load_affinity(fname):
+    """Read the mapping of storage volumes to the resources having local access.
+
+    The file is in INI format, having a section `[affinity]` with the mount points
+    as keys and a comma-separated list of resource names as values, e.g.
+
+        [affinity]
+        /mnt/storage1 = ws01, ws02
+        /mnt/storage2 = ws03
+
+    Parameters
+    ----------
+    fname : str
+
+    Returns
+    -------
+    dict
+        The mount points (as keys) and the sets of resource names (as values).
+    """
+    parser = SafeConfigParser()
+    # keep the case of the keys, they are paths:
+    parser.optionxform = str
+    if not parser.read(fname):
+        raise IOError("Unable to read affinity map [%s]!" % fname)
+    affinity = dict()
+    for mount, names in parser.items("affinity"):
+        names = [name.strip() for name in names.split(",") if name.strip()]
+        affinity[os.path.normpath(mount)] = set(names)
+    logi("Data locality affinity map: %s", affinity)
+    return affinity
+
+
+def mount_of(path, mounts):
+    """Find the (longest) mount point containing a path.
+
+    Parameters
+    ----------
+    path : str
+    mounts : list(str)
+        Normalized mount points.
+
+    Returns
+    -------
+    str
+        The mount point, `None` if the path is not on any of them.
+    """
+    path = os.path.abspath(path)
+    best = None
+    for mount in mounts:
+        if path == mount or path.startswith(mount.rstrip("/") + "/"):
+            if best is None or len(mount) > len(best):
+                best = mount
+    return best
+
+
+class Resource(object):
+
+    """A resource jobs can be placed on.
+
+    Instance Attributes
+    -------------------
+    name : str
+    engine : gc3libs.core.Engine
+        The engine restricted to this resource.
+    slots : int
+        The number of jobs that may run concurrently on the resource.
+    max_cores : int
+        The number of cores of the resource (as configured for gc3pie).
+    apps : list(snijder.apps.AbstractApp)
+        The apps currently placed on the resource.
+    failures : int
+        The number of consecutive failures.
+    down_until : float
+        The time until the resource is excluded from the placement.
+    """
+
+    def __init__(self, name, engine, slots=1, max_cores=1):
+        self.name = name
+        self.engine = engine
+        self.slots = max(int(slots), 1)
+        self.max_cores = max(int(max_cores), 1)
+        self.apps = list()
+        self.failures = 0
+        self.down_until = 0
+
+    def __repr__(self):
+        return "Resource(%s, %s/%s)" % (self.name, len(self.apps), self.slots)
+
+    @property
+    def load(self):
+        """The fraction of occupied slots."""
+        return len(self.apps) / float(self.slots)
+
+    def healthy(self, now=None):
+        """Check if the resource is not excluded due to failures."""
+        return (now or time.time()) >= self.down_until
+
+    def fits(self, app):
+        """Check if an app could be placed on the resource right now."""
+        cores = getattr(app, "requested_cores", None) or 1
+        return len(self.apps) < self.slots and cores <= self.max_cores
+
+    def failed(self, backoff, reason):
+        """Record a failure, excluding the resource for the backoff period.
+
+        Parameters
+        ----------
+        backoff : float
+            The period for the first failure, it doubles with every consecutive one.
+        reason : str
+        """
+        self.failures += 1
+        period = backoff * 2 ** (self.failures - 1)
+        self.down_until = time.time() + period
+        logw(
+            "Resource [%s] failed (%s), excluding it for %ss: %s",
+            self.name,
+            self.failures,
+            period,
+            reason,
+        )
+
+    def succeeded(self):
+        """Reset the failure count after a job terminated normally."""
+        if self.failures:
+            logi("Resource [%s] has recovered.", self.name)
+        self.failures = 0
+        self.down_until = 0
+
+
+class ResourcePool(object):
+
+    """Engine-like bundle of resources, placing apps according to a policy.
+
+    Instance Attributes
+    -------------------
+    resources : list(Resource)
+    policy : str
+        One of the `POLICIES`.
+    backoff : float
+        The initial time an unhealthy resource is excluded from the placement.
+    placement : dict
+        The resource (as value) each app (as key) has been placed on.
+    affinity : dict
+        The mount points (as keys) and the names of the resources having local
+        access to them (as values), empty to ignore the data locality.
+    """
+
+    def __init__(self, resources, policy="least-loaded", backoff=60, affinity=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown placement policy: %s" % policy)
+        if not resources:
+            raise ValueError("A resource pool requires at least one resource!")
+        self.resources = list(resources)
+        self.policy = policy
+        self.backoff = backoff
+        self.placement = dict()
+        self.affinity = affinity or dict()
+        self._next = 0
+        logi(
+            "Placing jobs on %s resources (policy: %s): %s",
+            len(self.resources),
+            policy,
+            self.resources,
+        )
+
+    def candidates(self, app):
+        """Get the healthy resources having a free slot for an app."""
+        now = time.time()
+        return [res for res in self.resources if res.healthy(now) and res.fits(app)]
+
+    def transfers(self, infiles):
+        """Calculate the amount of data each resource would have to transfer.
+
+        Files not on any mount point of the affinity map count for all resources
+        (they don't make a difference), as do files whose size can't be determined.
+
+        Parameters
+        ----------
+        infiles : list(str)
+
+        Returns
+        -------
+        dict
+            The resource names (as keys) and the sizes in bytes (as values).
+        """
+        transfer = dict([(res.name, 0) for res in self.resources])
+        for infile, size in zip(infiles, input_sizes(infiles)):
+            local = self.affinity.get(mount_of(infile, self.affinity.keys()))
+            if not local or size is None:
+                continue
+            for name in transfer:
+                if name not in local:
+                    transfer[name] += size
+        return transfer
+
+    def local_candidates(self, app, candidates):
+        """Reduce the candidates to the ones with the least data to transfer."""
+        infiles = app.job.get("infiles") or []
+        if not self.affinity or not infiles or len(candidates) < 2:
+            return candidates
+        transfer = self.transfers(infiles)
+        least = min([transfer[res.name] for res in candidates])
+        best = [res for res in candidates if transfer[res.name] == least]
+        logd(
+            "Resources for job [uid:%.7s] transferring %s bytes: %s (max: %s)",
+            app.job["uid"],
+            least,
+            best,
+            max(transfer.values()),
+        )
+        return best
+
+    def select(self, app):
+        """Select the resource to place an app on according to the policy.
+
+        Parameters
+        ----------
+        app : snijder.apps.AbstractApp
+
+        Returns
+        -------
+        Resource
+            The selected resource, `None` if none is available.
+        """
+        candidates = self.local_candidates(app, self.candidates(app))
+        if not candidates:
+            return None
+        if self.policy == "round-robin":
+            count = len(self.resources)
+            for offset in range(count):
+                resource = self.resources[(self._next + offset) % count]
+                if resource in candidates:
+                    self._next = (self.resources.index(resource) + 1) % count
+                    return resource
+        if self.policy == "weighted":
+            return max(
+                candidates, key=lambda res: res.max_cores / (len(res.apps) + 1.0)
+            )
+        return min(candidates, key=lambda res: res.load)
+
+    def free_slots(self):
+        """Get the number of free slots on the healthy resources."""
+        now = time.time()
+        return sum(
+            [res.slots - len(res.apps) for res in self.resources if res.healthy(now)]
+        )
+
+    def add(self, app):
+        """Place an app on a resource and add it to the resource's engine.
+
+        Raises
+        ------
+        RuntimeError
+            In case no resource is available for the app.
+        """
+        resource = self.select(app)
+        if resource is None:
+            raise RuntimeError("No resource available for placing the job!")
+        logi("Placing job [uid:%.7s] on [%s].", app.job["uid"], resource.name)
+        resource.apps.append(app)
+        self.placement[app] = resource
+        resource.engine.add(app)
+
+    def progress(self):
+        """Let the engines progress, update the slots and the health."""
+        for resource in self.resources:
+            try:
+                resource.engine.progress()
+            except Exception as err:  # pylint: disable-msg=broad-except
+                loge("Engine of resource [%s] failed: %s", resource.name, err)
+                resource.failed(self.backoff, str(err))
+                continue
+            for app in list(resource.apps):
+                # pylint: disable-msg=no-member
+                if app.execution.state != gc3libs.Run.State.TERMINATED:
+                    continue
+                resource.apps.remove(app)
+                self.placement.pop(app, None)
+                if app.execution.exitcode is None and not app.killed:
+                    resource.failed(self.backoff, "job terminated without exit code")
+                else:
+                    resource.succeeded()
+
+    def counts(self):
+        """Get the number of apps per state, summed up over all resources.
+
+        Like for a single engine, every state is present (the ones no app is in
+        having a count of 0), plus the 'total'.
+        """
+        stats = dict([(state, 0) for state in STATES + ["total"]])
+        for resource in self.resources:
+            for state, count in resource.engine.counts().items():
+                stats[state] = stats.get(state, 0) + count
+        return stats
+
+    def get_resources(self):
+        """Get the gc3 resources of all engines (each one only once)."""
+        resources = dict()
+        for resource in self.resources:
+            for gc3resource in resource.engine.get_resources():
+                resources.setdefault(gc3resource.name, gc3resource)
+        return resources.values()
+
+    def select_resource(self, name):
+        """Restrict the placement to a single resource."""
+        selected = [res for res in self.resources if res.name == name]
+        if not selected:
+            logw("Resource [%s] is not in the pool, ignoring the selection.", name)
+            return
+        logd("Restricting the placement to resource [%s].", name)
+        self.resources = selected
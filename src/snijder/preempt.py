@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Preemption of running jobs in favor of urgent ones.
+
+If all slots are occupied, a job having a high priority (see the 'priority' of the
+jobfile) that has been waiting longer than a threshold makes the spooler suspend
+the running job with the lowest (lower) priority, e.g. a long deconvolution, and
+dispatch the urgent one in its place. Suspended jobs are resumed as soon as a slot
+is free again and no urgent job is waiting, the time they spent suspended is not
+accounted as their runtime.
+
+Suspending requires an engine providing `suspend()` and `resume()`, currently the
+local one (see `snijder.executor.LocalEngine`) stopping the process group of a job
+with SIGSTOP and continuing it with SIGCONT.
+
+Classes
+-------
+
+PreemptionPolicy()
+    Decides when and which running job is to be suspended.
+"""
+
+import time
+
+import gc3libs
+
+from . import logi
+
+
+class PreemptionPolicy(object):
+
+    """Policy selecting urgent jobs and the running jobs to suspend for them.
+
+    Instance Attributes
+    -------------------
+    threshold : float
+        The time in seconds an urgent job has to be waiting before another job is
+        suspended in its favor.
+    priority : int
+        The minimum priority of urgent jobs.
+    """
+
+    def __init__(self, threshold=60, priority=1):
+        self.threshold = threshold
+        self.priority = priority
+        logi(
+            "Preempting jobs for ones with priority >= %s waiting longer than %ss.",
+            priority,
+            threshold,
+        )
+
+    def urgent_job(self, queue, now=None):
+        """Find the most urgent job that has been waiting too long (if any).
+
+        Only the first due job of each category being served is considered (see
+        `snijder.queue.JobQueue.first_due()`), as only those can be dispatched next.
+
+        Parameters
+        ----------
+        queue : snijder.queue.JobQueue
+        now : float, optional
+
+        Returns
+        -------
+        snijder.jobs.JobDescription
+            The waiting job with the highest priority, `None` if there is none.
+        """
+        now = now or time.time()
+        urgent = None
+        for category in queue.categories:
+            jobid = queue.first_due(category, now)
+            if jobid is None:
+                continue
+            job = queue.jobs[jobid]
+            priority = job.get("priority") or 0
+            if priority < self.priority:
+                continue
+            if now - job.timings.get("enqueued", now) < self.threshold:
+                continue
+            if urgent is None or priority > urgent.get("priority"):
+                urgent = job
+        return urgent
+
+    @staticmethod
+    def victim(apps, job):
+        """Select the running app to suspend in favor of a job.
+
+        Parameters
+        ----------
+        apps : list(snijder.apps.AbstractApp)
+        job : snijder.jobs.JobDescription
+            The urgent job.
+
+        Returns
+        -------
+        snijder.apps.AbstractApp
+            The app with the lowest priority (lower than the one of the job), the
+            one running longest among those, `None` if there is none.
+        """
+        # pylint: disable-msg=no-member
+        candidates = [
+            app
+            for app in apps
+            if app.execution.state == gc3libs.Run.State.RUNNING
+            and (app.job.get("priority") or 0) < job["priority"]
+        ]
+        if not candidates:
+            return None
+        return min(
+            candidates, key=lambda app: (app.job.get("priority") or 0, app.dispatched)
+        )
@@ -6,17 +6,299 @@ Classes
 
 JobQueue()
     Job handling and scheduling.
+CategoryQueue()
+    Priority queue holding the jobs of a single category.
+CategoryRing()
+    Round-robin order of the categories being served.
+CategoryLimits()
+    Limits on the running and queued jobs of each category.
+QuotaExceeded()
+    Exception raised when a job is rejected due to a category's limits.
 """
 
+import heapq
 import itertools
 import json
+import os
 import pprint
-from collections import deque
+import time
+import urllib
+from collections import OrderedDict
 
 import gc3libs
 
-from . import logi, logd, logw
-from .logger import LOGGER, LEVEL_MAPPING
+from . import logi, logd, logw, debug_enabled
+from .logger import LOGGER, LEVEL_MAPPING, job_fields
+from .memo import job_identity
+
+
+# the job keys the queue maintains secondary indexes for (see `JobQueue.find()`):
+INDEXED_KEYS = ["user", "status", "tasktype", "infile"]
+
+
+class QuotaExceeded(ValueError):
+
+    """A job can't be added to the queue as its category is over quota."""
+
+
+def write_atomically(fname, content):
+    """Write a file through a temporary one, so readers never see it incomplete."""
+    tmpname = fname + ".tmp"
+    with open(tmpname, "w") as fout:
+        fout.write(content)
+    os.rename(tmpname, fname)
+
+
+def route_deletion(uid, queues):
+    """Put a job on the deletion list of the queue holding it.
+
+    If none of the queues holds the job, the request is kept by each of them until
+    the job arrives (its jobfile might not have been processed yet) or it has
+    expired (see `JobQueue.expire_deletions()`).
+
+    Parameters
+    ----------
+    uid : str
+    queues : iterable(JobQueue)
+        The queues of the queue manager.
+
+    Returns
+    -------
+    JobQueue
+        The queue holding the job, `None` if the job is unknown.
+    """
+    queues = list(queues)
+    for queue in queues:
+        if uid in queue.jobs:
+            queue.deletion_list.add(uid)
+            return queue
+    logd("No queue holds job [uid:%.7s] (yet), keeping the request.", uid)
+    for queue in queues:
+        queue.unrouted[uid] = time.time()
+    return None
+
+
+class CategoryLimits(object):
+
+    """Limits applying to each category (user) of a queue.
+
+    All limits are optional (`None` meaning unlimited). A category having the
+    maximum number of jobs running is skipped by the scheduler until one of them
+    has finished, whereas new jobs exceeding the maximum number of queued jobs or
+    the maximum core-hours are rejected.
+
+    Instance Attributes
+    -------------------
+    running : int
+        The maximum number of jobs of a category being processed at the same time.
+    queued : int
+        The maximum number of jobs of a category waiting in the queue.
+    core_hours : float
+        The maximum sum of core-hours requested by the (queued and processing) jobs
+        of a category, the core-hours of a job being its number of 'cores' (1 if
+        unspecified) times its 'walltime'.
+    walltime : float
+        The walltime (in minutes) assumed for jobs not specifying one.
+    overrides : dict
+        Limits for specific categories (as keys), given as dicts (as values) with
+        the names of the limits to override as keys.
+    """
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(
+        self, running=None, queued=None, core_hours=None, walltime=60, overrides=None
+    ):
+        self.running = running
+        self.queued = queued
+        self.core_hours = core_hours
+        self.walltime = walltime
+        self.overrides = overrides or dict()
+
+    def get(self, category, limit):
+        """Get a limit for a category.
+
+        Parameters
+        ----------
+        category : str
+        limit : str
+            One of 'running', 'queued' or 'core_hours'.
+
+        Returns
+        -------
+        int or float
+            The limit, `None` if unlimited.
+        """
+        return self.overrides.get(category, dict()).get(limit, getattr(self, limit))
+
+    def core_hours_of(self, job):
+        """Get the core-hours requested by a job."""
+        walltime = job.get("walltime") or self.walltime
+        return (job.get("cores") or 1) * walltime / 60.0
+
+
+class CategoryQueue(object):
+
+    """Priority queue of the job UIDs of a category, backed by a binary heap.
+
+    Jobs are ordered by their effective priority, i.e. their (static) 'priority'
+    plus the aging rate times the time they have been waiting since submission.
+    As all jobs of a category age at the same rate, the order never changes while
+    they are waiting, so each job gets a constant sort key on insertion:
+
+        key = aging * timestamp - priority
+
+    The job with the smallest key comes first, jobs with equal keys are served in
+    the order they have been added. Insertion and removal of the first job are
+    O(log n), removing arbitrary jobs is done lazily.
+
+    Jobs that have to wait for a retry (i.e. having a 'not_before' time in the
+    future) are kept in a second heap ordered by that time, and are moved to the
+    first one once they are due (see `first()`).
+
+    Instance Attributes
+    -------------------
+    aging : float
+        The increase of the effective priority per second of waiting.
+    """
+
+    def __init__(self, aging=0.0):
+        self.aging = aging
+        self._heap = list()
+        self._waiting = list()
+        self._entries = dict()
+        self._counter = itertools.count()
+        self._front = itertools.count(-1, -1)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, uid):
+        return uid in self._entries
+
+    def __iter__(self):
+        """Iterate over the UIDs in the order they would be dispatched."""
+        return iter([entry[2] for entry in sorted(self._entries.values())])
+
+    def __getitem__(self, index):
+        if index == 0 and self._heap and not self._waiting:
+            return self._heap[0][2]
+        return list(self)[index]
+
+    def __repr__(self):
+        return "CategoryQueue(%s)" % list(self)
+
+    def key(self, job):
+        """Get the sort key of a job (see the class documentation)."""
+        return self.aging * job["timestamp"] - (job.get("priority") or 0)
+
+    def _push(self, uid, job, seq):
+        """Add an entry to the heap, or to the waiting ones if the job isn't due."""
+        entry = [self.key(job), seq, uid, True]
+        self._entries[uid] = entry
+        not_before = job.get("not_before", 0)
+        if not_before > time.time():
+            heapq.heappush(self._waiting, (not_before, seq, entry))
+        else:
+            heapq.heappush(self._heap, entry)
+
+    def _prune(self):
+        """Drop removed entries from the top of the heap."""
+        while self._heap and not self._heap[0][3]:
+            heapq.heappop(self._heap)
+
+    def _promote(self, now):
+        """Move the entries of the jobs being due from the waiting ones to the heap."""
+        while self._waiting and (
+            self._waiting[0][0] <= now or not self._waiting[0][2][3]
+        ):
+            entry = heapq.heappop(self._waiting)[2]
+            if entry[3]:
+                heapq.heappush(self._heap, entry)
+
+    def append(self, uid, job):
+        """Add a job, behind the ones having the same sort key."""
+        self._push(uid, job, next(self._counter))
+
+    def appendleft(self, uid, job):
+        """Add a job, in front of the ones having the same sort key."""
+        self._push(uid, job, next(self._front))
+
+    def first(self, now=None):
+        """Get the first job that doesn't have to wait for a retry.
+
+        Parameters
+        ----------
+        now : float, optional
+            The current time, by default `time.time()`.
+
+        Returns
+        -------
+        str
+            The UID of the job, `None` if all jobs have to wait (or there are none).
+        """
+        self._promote(now or time.time())
+        self._prune()
+        if not self._heap:
+            return None
+        return self._heap[0][2]
+
+    def popleft(self):
+        """Remove and return the UID of the first job that doesn't have to wait."""
+        if self.first() is None:
+            raise IndexError("pop from an empty queue")
+        uid = heapq.heappop(self._heap)[2]
+        del self._entries[uid]
+        self._prune()
+        return uid
+
+    def remove(self, uid):
+        """Remove a job by its UID."""
+        self._entries.pop(uid)[3] = False
+        self._prune()
+
+
+class CategoryRing(object):
+
+    """Round-robin order of the categories being served, backed by an OrderedDict.
+
+    The first category is the one to be served next, after being served it is
+    moved to the end (see `rotate()`). Unlike a deque, membership tests, appending,
+    moving and removing a category are O(1), as required for thousands of users.
+    """
+
+    def __init__(self, categories=()):
+        self._ring = OrderedDict((category, None) for category in categories)
+
+    def __len__(self):
+        return len(self._ring)
+
+    def __contains__(self, category):
+        return category in self._ring
+
+    def __iter__(self):
+        """Iterate over the categories in the order they will be served."""
+        return iter(self._ring)
+
+    def __getitem__(self, index):
+        if index == 0 and self._ring:
+            return next(iter(self._ring))
+        return list(self._ring)[index]
+
+    def __repr__(self):
+        return "CategoryRing(%s)" % list(self._ring)
+
+    def append(self, category):
+        """Add a category at the last position."""
+        self._ring[category] = None
+
+    def remove(self, category):
+        """Remove a category."""
+        del self._ring[category]
+
+    def rotate(self, category):
+        """Move a category to the last position, e.g. after it has been served."""
+        del self._ring[category]
+        self._ring[category] = None
 
 
 class JobQueue(object):
@@ -27,38 +309,116 @@ class JobQueue(object):
     scheduler so that it is possible for the caller to simply request the next
     job from this queue without having to care about priorities or anything
     else.
+
+    Optionally identical jobs are coalesced (single-flight): a new job that is
+    computationally identical (see `snijder.memo.job_identity()`) to one that is
+    queued or processing already is not queued on its own, but attached to that
+    job (the leader) as a follower. Followers share the status of their leader and
+    get its results once it has terminated (see `release_followers()`).
+
+    Deletion requests are routed to the queue holding the job (see
+    `route_deletion()`), requests for jobs not known (yet) are kept for
+    `deletion_ttl` seconds in case the job arrives later.
     """
 
-    def __init__(self):
+    # the time in seconds deletion requests for unknown jobs are kept:
+    deletion_ttl = 600
+
+    def __init__(self, name=None, limits=None, aging=1.0, coalesce=False):
         """Initialize an empty job queue.
 
+        Parameters
+        ----------
+        name : str, optional
+            The name of the queue, used in the structured log fields.
+        limits : CategoryLimits, optional
+            The limits for each category, by default `None` (unlimited).
+        aging : float, optional
+            The increase of a job's effective priority per hour of waiting, by
+            default 1.0 (i.e. a job submitted two hours earlier than another one
+            having a priority higher by 2 is served first), 0 disables aging.
+        coalesce : bool, optional
+            Attach new jobs identical to a queued or processing one to the latter
+            instead of queueing them, by default False.
+
         Instance Variables
         ------------------
+        name : str
+            The name of the queue (or `None`).
         statusfile : str (default=None)
-            file name used to write the JSON formatted queue status to
-        categories : deque
+            file name used to write the JSON formatted queue status to, see
+            `write_shards()` for the per-category files written alongside
+        categories : CategoryRing
             categories (users), used by the scheduler
+        parked : set
+            categories having queued jobs, but being at their limit of running jobs
+            (so they are not in `categories` and skipped by the scheduler)
+        limits : CategoryLimits
+            the limits applying to each category
+        aging : float
+            the increase of the effective priority per hour of waiting
+        coalesce : bool
+            whether identical jobs are coalesced
+        leaders : dict
+            the UIDs of the queued or processing jobs (as values) that identical
+            jobs get attached to, keyed by the job identity
+        followers : dict
+            the UIDs of the jobs attached to a leader (as values), keyed by the
+            UID of the leader
+        running : dict
+            the number of processing jobs per category
+        core_hours : dict
+            the core-hours of the queued and processing jobs per category
         jobs : dict(JobDescription)
             holding job descriptions (key: UID)
         processing : list
             UID's of jobs being processed currently
-        queue : dict(deque)
-            queues of each category (user)
-        deletion_list : list
-            UID's of jobs to be deleted from the queue (NOTE: this list may
-            contain UID's from other queues as well!)
+        queue : dict(CategoryQueue)
+            queues of each category (user), ordered by the jobs' priorities
+        deletion_list : set
+            UID's of this queue's jobs to be deleted
+        unrouted : dict
+            the time deletion requests for jobs not known (yet) were received,
+            keyed by the UID (see `route_deletion()`)
         status_changed : bool
             Flag indicating whether the queue status has changed since the
             status file has been written the last time and the status has been
             reported to the log files.
+        shards : dict
+            the content of the per-category status files written the last time,
+            keyed by the category (`None` until they have been written once)
+        dirty : set
+            the categories whose jobs have changed since the per-category status
+            files have been written the last time
+        feed : snijder.feed.ChangeFeed
+            the feed the changes of the jobs are published to, `None` (the default)
+            to disable publishing them
+        indexes : dict(dict(set))
+            the UIDs of the jobs (queued, processing or attached) by their value of
+            each of the keys in `INDEXED_KEYS`, see `find()`
         """
+        self.name = name
         self._statusfile = None
-        self.categories = deque("")
+        self.categories = CategoryRing()
+        self.parked = set()
+        self.limits = limits or CategoryLimits()
+        self.aging = aging
+        self.coalesce = coalesce
+        self.leaders = dict()
+        self.followers = dict()
+        self.running = dict()
+        self.core_hours = dict()
         self.jobs = dict()  # TODO: this should probably be private
         self.processing = list()
         self.queue = dict()
-        self.deletion_list = list()
+        self.deletion_list = set()
+        self.unrouted = dict()
         self.status_changed = False
+        self.shards = None
+        self.dirty = set()
+        self.feed = None
+        self.indexes = dict((key, dict()) for key in INDEXED_KEYS)
+        self._indexed = dict()
 
     def __len__(self):
         """Get the total number of jobs in all queues (incl. processing)."""
@@ -82,6 +442,7 @@ class JobQueue(object):
         """
         logi("Setting job queue status report file: %s", statusfile)
         self._statusfile = statusfile
+        self.shards = None
 
     # TODO: could be a property...?
     def num_jobs_queued(self):
@@ -89,6 +450,8 @@ class JobQueue(object):
         numjobs = 0
         for queue in self.queue.values():
             numjobs += len(queue)
+        for followers in self.followers.values():
+            numjobs += len(followers)
         logd("num_jobs_queued = %s", numjobs)
         return numjobs
 
@@ -99,6 +462,44 @@ class JobQueue(object):
         logd("num_jobs_processing = %s", numjobs)
         return numjobs
 
+    def check_quota(self, job):
+        """Check if a new job would exceed the limits of its category.
+
+        Parameters
+        ----------
+        job : JobDescription
+
+        Raises
+        ------
+        QuotaExceeded
+            In case the job exceeds the maximum number of queued jobs or core-hours.
+        """
+        category = job.get_category()
+        limit = self.limits.get(category, "queued")
+        if limit is not None and len(self.queue.get(category, [])) >= limit:
+            raise QuotaExceeded(
+                "Category '%s' has reached its limit of %s queued jobs!"
+                % (category, limit)
+            )
+        limit = self.limits.get(category, "core_hours")
+        requested = self.core_hours.get(category, 0) + self.limits.core_hours_of(job)
+        if limit is not None and requested > limit:
+            raise QuotaExceeded(
+                "Category '%s' would exceed its limit of %s core-hours (%s)!"
+                % (category, limit, requested)
+            )
+
+    def _add_category(self, category):
+        """Set up the queue of a category, parking it if at its running limit."""
+        self.queue[category] = CategoryQueue(self.aging / 3600.0)
+        limit = self.limits.get(category, "running")
+        if limit is not None and self.running.get(category, 0) >= limit:
+            logd("Parking category [%s], it's at its limit of running jobs.", category)
+            self.parked.add(category)
+        else:
+            self.categories.append(category)
+        logd("Current queue categories: %s", self.categories)
+
     def append(self, job):
         """Add a new job to the queue.
 
@@ -106,23 +507,163 @@ class JobQueue(object):
         ----------
         job : JobDescription
             The job to be added to the queue.
+
+        Raises
+        ------
+        QuotaExceeded
+            In case the job's category is over its quota (see `check_quota()`).
         """
-        category = job.get_category()
         uid = job["uid"]
         if uid in self.jobs:
             raise ValueError("Job with [uid:%.7s] already in this queue!" % uid)
-        logi("Enqueueing job [uid:%.7s] into category '%s'.", uid, category)
+        if self.coalesce and self._attach(job):
+            return
+        self.check_quota(job)
+        self._enqueue(job)
+
+    def _enqueue(self, job):
+        """Add a job to the queue of its category (without checking the quota)."""
+        category = job.get_category()
+        uid = job["uid"]
+        logi(
+            "Enqueueing job [uid:%.7s] into category '%s'.",
+            uid,
+            category,
+            extra=job_fields(job, self.name),
+        )
+        job.mark("enqueued")
         self.jobs[uid] = job  # store the job in the global dict
-        if category not in self.categories:
+        self._index(job)
+        self.core_hours[category] = self.core_hours.get(
+            category, 0
+        ) + self.limits.core_hours_of(job)
+        if category not in self.queue:
             logi("Adding a new queue for '%s' to the JobQueue.", category)
-            self.categories.append(category)
-            self.queue[category] = deque()
-            logd("Current queue categories: %s", self.categories)
+            self._add_category(category)
         # else:
         #     # in case there are already jobs of this category, we don't touch
         #     # the scheduler / priority queue:
         #     logd("JobQueue already contains a queue for '%s'.", category)
-        self.queue[category].append(uid)
+        if job.get("identity") is not None:
+            # identical jobs arriving from now on get attached to this one:
+            self.leaders.setdefault(job["identity"], uid)
+        self.queue[category].append(uid, job)
+        self.publish("enqueued", job, priority=job.get("priority"))
+        self.set_jobstatus(job, "queued")
+        self.status_changed = True
+
+    def _attach(self, job):
+        """Attach a job to an identical one as a follower (if there is one).
+
+        Followers don't occupy any resources, so they don't count for the
+        limits of their category.
+
+        Returns
+        -------
+        bool
+            True if the job has been attached, False if it has to be queued.
+        """
+        if job.get("identity") is None:
+            job["identity"] = job_identity(job)
+        leader = self.leaders.get(job["identity"])
+        if leader is None:
+            return False
+        logi(
+            "Coalescing job [uid:%.7s] with the identical job [uid:%.7s].",
+            job["uid"],
+            leader,
+            extra=job_fields(job, self.name),
+        )
+        job.mark("enqueued")
+        job["leader"] = leader
+        self.jobs[job["uid"]] = job
+        self._index(job)
+        self.followers.setdefault(leader, list()).append(job["uid"])
+        self.publish("enqueued", job, leader=leader)
+        self.set_jobstatus(job, self.jobs[leader]["status"])
+        return True
+
+    def release_followers(self, uid):
+        """Remove the followers of a job from the queue, e.g. once it terminated.
+
+        Parameters
+        ----------
+        uid : str
+            The UID of the leader.
+
+        Returns
+        -------
+        list(JobDescription)
+            The jobs that were attached to the leader.
+        """
+        released = [self.jobs.pop(jobid) for jobid in self.followers.pop(uid, [])]
+        for job in released:
+            self._unindex(job["uid"])
+            self.dirty.add(job.get_category())
+        if released:
+            logi("Released %s jobs attached to [uid:%.7s].", len(released), uid)
+            self.status_changed = True
+        return released
+
+    def promote_followers(self, uid):
+        """Queue the followers of a job on their own, e.g. as it has been killed.
+
+        The first of them becomes the new leader, the others are attached to it.
+        As the jobs have been accepted already, their quota is not checked again.
+
+        Parameters
+        ----------
+        uid : str
+            The UID of the former leader.
+        """
+        for job in self.release_followers(uid):
+            del job["leader"]
+            if not self._attach(job):
+                self._enqueue(job)
+
+    def requeue(self, job, delay=0, retry=True):
+        """Put a job back to its category's queue, e.g. for a retry.
+
+        The job is placed in front of all jobs having the same effective priority
+        (i.e. at the head of the queue unless jobs with a higher priority arrived).
+
+        Parameters
+        ----------
+        job : JobDescription
+            The job to be re-added to the queue.
+        delay : float, optional
+            The time in seconds the job has to wait at least before it will be
+            selected by `next_job()` again, by default 0.
+        retry : bool, optional
+            Whether this counts as a retry of the job (increasing its 'retries'),
+            by default True.
+        """
+        category = job.get_category()
+        uid = job["uid"]
+        if uid in self.jobs:
+            raise ValueError("Job with [uid:%.7s] already in this queue!" % uid)
+        logi(
+            "Re-queueing job [uid:%.7s] in category '%s'.",
+            uid,
+            category,
+            extra=job_fields(job, self.name),
+        )
+        if retry:
+            job["retries"] = job.get("retries", 0) + 1
+        job["not_before"] = time.time() + delay
+        job.mark("enqueued")
+        self.jobs[uid] = job
+        self._index(job)
+        self.core_hours[category] = self.core_hours.get(
+            category, 0
+        ) + self.limits.core_hours_of(job)
+        if job.get("identity") is not None:
+            # let identical jobs arriving in the meantime attach to this one:
+            self.leaders.setdefault(job["identity"], uid)
+        if category not in self.queue:
+            self._add_category(category)
+        self.queue[category].appendleft(uid, job)
+        self.publish("enqueued", job, retries=job.get("retries", 0))
         self.set_jobstatus(job, "queued")
         self.status_changed = True
 
@@ -138,11 +679,34 @@ class JobQueue(object):
             return False
 
         logd("Removing empty queue for [category:%s].", category)
-        self.categories.remove(category)  # remove it from the categories list
+        if category in self.parked:
+            self.parked.remove(category)
+        else:
+            self.categories.remove(category)  # remove it from the categories list
         del self.queue[category]  # delete the category from the queue dict
         return True
 
-    def next_job(self):
+    def first_due(self, category, now=None):
+        """Get the first job of a category that doesn't have to wait for a retry.
+
+        Jobs put back with a delay (see `requeue()`) are skipped until they are due,
+        so they don't block the other jobs of their category (see
+        `CategoryQueue.first()`).
+
+        Parameters
+        ----------
+        category : str
+        now : float, optional
+            The current time, by default `time.time()`.
+
+        Returns
+        -------
+        str
+            The UID of the job, `None` if all jobs of the category have to wait.
+        """
+        return self.queue[category].first(now)
+
+    def next_job(self, category=None):
         """Return the next job description for processing.
 
         Picks the next that should be processed from that queue that has the
@@ -152,22 +716,54 @@ class JobQueue(object):
         queue.
 
         This implements a very simple round-robin (token based) scheduler that
-        is going one-by-one through the existing categories.
+        is going one-by-one through the existing categories. Within a category the
+        job with the highest effective priority is picked (see `CategoryQueue`),
+        skipping jobs that have to wait before being retried (see `first_due()`).
+
+        Parameters
+        ----------
+        category : str, optional
+            Take the job from this category (if it's being served), regardless of
+            its position, e.g. for an urgent job (see `snijder.preempt`).
 
         Returns
         -------
         job : JobDescription
         """
-        if not self.categories:
+        now = time.time()
+        candidates = self.categories
+        if category is not None:
+            candidates = [category] if category in self.categories else []
+        for candidate in candidates:
+            jobid = self.first_due(candidate, now)
+            if jobid is not None:
+                category = candidate
+                break
+        else:
             return None
-        category = self.categories[0]
-        jobid = self.queue[category].popleft()
+        self.queue[category].remove(jobid)
+        self.jobs[jobid].mark("selected")
+        self.dirty.add(category)
         # put it into the list of currently processing jobs:
         self.processing.append(jobid)
-        logi("Retrieving next job: [category:%s], [uid:%.7s].", category, jobid)
+        self.running[category] = self.running.get(category, 0) + 1
+        logi(
+            "Retrieving next job: [category:%s], [uid:%.7s].",
+            category,
+            jobid,
+            extra=job_fields(self.jobs[jobid], self.name),
+        )
+        self.publish("dispatched", self.jobs[jobid])
         if not self._is_queue_empty(category):
-            logd("Pushing category [%s] to the last position in the queue.", category)
-            self.categories.rotate(-1)
+            limit = self.limits.get(category, "running")
+            if limit is not None and self.running[category] >= limit:
+                # skip the category until one of its jobs has finished:
+                logd("Parking category [%s] (%s jobs running).", category, limit)
+                self.categories.remove(category)
+                self.parked.add(category)
+            else:
+                logd("Pushing category [%s] to the last position.", category)
+                self.categories.rotate(category)
         logd("Current queue categories: %s", self.categories)
         logd("Current contents of all queues: %s", self.queue)
         self.status_changed = True
@@ -200,41 +796,193 @@ class JobQueue(object):
 
         job = self.jobs[uid]  # remember the job for returning it later
         category = job.get_category()
-        logi("Status of job to be removed: %s", job["status"])
+        logi(
+            "Status of job to be removed: %s",
+            job["status"],
+            extra=job_fields(job, self.name),
+        )
         del self.jobs[uid]  # remove the job from the jobs dict
+        self._unindex(uid)
+        self.dirty.add(category)
         self.status_changed = True
+        self.publish("removed", job)
+        if uid in self.followers.get(job.get("leader"), []):
+            logd("Detaching job [uid:%.7s] from its leader.", uid)
+            self.followers[job["leader"]].remove(uid)
+            if not self.followers[job["leader"]]:
+                del self.followers[job["leader"]]
+            if update_status:
+                logd("%s", self.update_status())
+            return job
+        if self.leaders.get(job.get("identity")) == uid:
+            del self.leaders[job["identity"]]
         if category in self.queue and uid in self.queue[category]:
             logd("Removing job from queue: [uid:%.7s] [queue:%s].", uid, category)
             self.queue[category].remove(uid)
             self._is_queue_empty(category)
+            # the job won't be processed, so the followers have to go on their own
+            # (followers of processing jobs are released by the spooler):
+            self.promote_followers(uid)
         elif uid in self.processing:
             logd("Removing job from currently processing jobs [uid:%.7s].", uid)
             self.processing.remove(uid)
+            self.running[category] -= 1
+            limit = self.limits.get(category, "running")
+            if category in self.parked and self.running[category] < limit:
+                logd("Unparking category [%s].", category)
+                self.parked.remove(category)
+                self.categories.append(category)
         else:
             logw("Can't find job in any of our queues: [uid:%.7s]!", uid)
             return None
+        self.core_hours[category] -= self.limits.core_hours_of(job)
 
         # logd("Current jobs: %s", self.jobs)
         # logd("Current queue categories: %s", self.cats)
         # logd("Current contents of all queues: %s", self.queue)
         if update_status:
-            logd(self.update_status())
+            logd("%s", self.update_status())
         return job
 
+    def expire_deletions(self, now=None):
+        """Discard deletion requests for unknown jobs older than `deletion_ttl`."""
+        deadline = (now or time.time()) - self.deletion_ttl
+        expired = [
+            uid for uid, received in self.unrouted.items() if received < deadline
+        ]
+        for uid in expired:
+            logi("Discarding the deletion request for unknown job [uid:%.7s].", uid)
+            del self.unrouted[uid]
+
     def process_deletion_list(self):
-        """Remove jobs from this queue that are on the deletion list."""
-        for uid in self.deletion_list:
+        """Remove jobs from this queue that are on the deletion list.
+
+        Returns
+        -------
+        list(JobDescription)
+            The jobs that have been removed.
+        """
+        self.expire_deletions()
+        uids = list(self.deletion_list)
+        self.deletion_list.clear()
+        for uid in uids:
             logi("Received a deletion request for job [uid:%.7s].", uid)
-            self.deletion_list.remove(uid)
-            removed = self.remove(uid, update_status=False)
-            if removed is None:
+        return self.remove_jobs(uids)
+
+    def _index(self, job):
+        """Add a job to the secondary indexes (see `find()`)."""
+        uid = job["uid"]
+        keys = [
+            ("user", job["user"]),
+            ("status", job["status"]),
+            ("tasktype", job.get("tasktype")),
+        ]
+        keys.extend(("infile", infile) for infile in set(job.get("infiles", [])))
+        for key, value in keys:
+            self.indexes[key].setdefault(value, set()).add(uid)
+        # remember the indexed values, e.g. the app adds the template to 'infiles':
+        self._indexed[uid] = keys
+        if self.unrouted.pop(uid, None) is not None:
+            logi("Job [uid:%.7s] was requested to be deleted before arriving.", uid)
+            self.deletion_list.add(uid)
+
+    def _unindex(self, uid):
+        """Remove a job from the secondary indexes."""
+        for key, value in self._indexed.pop(uid, []):
+            uids = self.indexes[key][value]
+            uids.discard(uid)
+            if not uids:
+                del self.indexes[key][value]
+
+    def _reindex_status(self, job, status):
+        """Update the status of a job in the secondary indexes.
+
+        Returns
+        -------
+        bool
+            True if the status differs from the indexed one (or the job's current
+            status if it isn't indexed).
+        """
+        keys = self._indexed.get(job["uid"])
+        if keys is None:
+            return job["status"] != status
+        previous = keys[1][1]
+        if previous == status:
+            return False
+        uids = self.indexes["status"][previous]
+        uids.discard(job["uid"])
+        if not uids:
+            del self.indexes["status"][previous]
+        self.indexes["status"].setdefault(status, set()).add(job["uid"])
+        keys[1] = ("status", status)
+        return True
+
+    def find(self, **criteria):
+        """Get the jobs matching all given criteria using the secondary indexes.
+
+        Example
+        -------
+        >>> queue.find(user="user01", status="queued")
+        >>> queue.find(infile="/data/user01/image.h5")
+
+        Parameters
+        ----------
+        criteria : dict
+            The required values of (some of) the keys in `INDEXED_KEYS`.
+
+        Returns
+        -------
+        set(str)
+            The UIDs of the matching jobs.
+        """
+        candidates = [
+            self.indexes[key].get(value, set()) for key, value in criteria.items()
+        ]
+        if not candidates:
+            return set(self.jobs)
+        candidates.sort(key=len)
+        return candidates[0].intersection(*candidates[1:])
+
+    def remove_jobs(self, uids):
+        """Remove several jobs at once, updating the status only once.
+
+        Parameters
+        ----------
+        uids : iterable(str)
+            The UIDs of the jobs, e.g. as returned by `find()`.
+
+        Returns
+        -------
+        list(JobDescription)
+            The jobs that have been removed.
+        """
+        removed = list()
+        for uid in list(uids):
+            job = self.remove(uid, update_status=False)
+            if job is None:
                 logd("No job removed, invalid uid or other queue's job.")
             else:
                 logi("Job successfully removed from the queue.")
+                removed.append(job)
         # updating the queue status file is only done now:
         queue_status = self.update_status()
         if queue_status:
-            logd("Queue status after processing the deletion list: %s", queue_status)
+            logd("Queue status after removing the jobs: %s", queue_status)
+        return removed
+
+    def publish(self, event, job, **fields):
+        """Publish a change of a job to the feed (if one is set).
+
+        Parameters
+        ----------
+        event : str
+            The kind of change, see `snijder.feed`.
+        job : JobDescription
+        fields : dict
+            Additional keys for the feed entry.
+        """
+        if self.feed is not None:
+            self.feed.publish(event, job, queue=self.name, **fields)
 
     def set_jobstatus(self, job, status):
         """Update the status of a job and trigger related actions.
@@ -246,15 +994,34 @@ class JobQueue(object):
         status : str
             The new status.
         """
-        logd("Changing job-status: [uid:%.7s] [status:%s]", job["uid"], status)
+        if debug_enabled():
+            logd(
+                "Changing job-status: [uid:%.7s] [status:%s]",
+                job["uid"],
+                status,
+                extra=job_fields(job, self.name),
+            )
+        # the apps update the job's status themselves, so compare to the indexed one:
+        changed = self._reindex_status(job, status)
         job["status"] = status
+        self.dirty.add(job.get_category())
         self.status_changed = True
+        if changed:
+            self.publish("status", job)
+        # followers share the status of their leader until it has terminated:
+        for follower in self.followers.get(job["uid"], []):
+            if status not in [gc3libs.Run.State.TERMINATED, "TERMINATED"]:
+                self._reindex_status(self.jobs[follower], status)
+                self.jobs[follower]["status"] = status
+                self.dirty.add(self.jobs[follower].get_category())
+                if changed:
+                    self.publish("status", self.jobs[follower], leader=job["uid"])
 
         # pylint: disable-msg=no-member
         if status == gc3libs.Run.State.TERMINATED or status == "TERMINATED":
             self.remove(job["uid"])
         # pylint: enable-msg=no-member
-        logd(self.update_status())
+        logd("%s", self.update_status())
 
     def update_status(self, force=False):
         """Update the queue status information (JSON and logs)
@@ -299,43 +1066,172 @@ class JobQueue(object):
                     "pid"      : "N/A",
                     "id"       : "8cd0d80f36dd8f7655bde8679b192f526f9541bb",
                     "jobType"  : "hucore",
-                    "server"   : "N/A"
+                    "server"   : "N/A",
+                    "phases"   : { "parsed": 0.0021, "enqueued": 0.0001 }
                },
             ]
         }
         """
-
-        def format_job(job):
-            """Helper function to assemble the job dict."""
-            fjob = {
-                "id": job["uid"],
-                "file": job["infiles"],
-                "username": job["user"],
-                "jobType": job["type"],
-                "status": job["status"],
-                "server": "N/A",
-                "progress": "N/A",
-                "pid": "N/A",
-                "start": "N/A",
-                "queued": job["timestamp"],
-            }
-            return fjob
-
-        joblist = self.queue_details()
-        formatted = []
-        for jobid in self.processing:
-            job = self.jobs[jobid]
-            formatted.append(format_job(job))
-        for job in joblist:
-            formatted.append(format_job(job))
-        details = {"jobs": formatted}
+        running = [
+            self.format_job(self.jobs[jobid])
+            for jobid in self.with_followers(self.processing)
+        ]
+        queued = [self.format_job(job) for job in self.queue_details()]
+        details = {"jobs": running + queued}
         queue_json = json.dumps(details, indent=4)
         if self.statusfile is not None:
             logd("Writing queue status JSON file [%s].", self.statusfile)
             with open(self.statusfile, "w") as fout:
                 fout.write(queue_json)
+            self.write_shards(running, queued)
         return queue_json
 
+    def write_shards(self, running, queued):
+        """Write the per-category status files and the summary file.
+
+        Next to the status file (e.g. 'status/hucore.json') a directory named like
+        it without the extension (e.g. 'status/hucore/') holds one file per category
+        (e.g. 'user01.json'), having the same format as the status file but only
+        containing the jobs of that category. Only the files of the categories
+        whose jobs have changed (see `dirty`) are assembled and rewritten, the ones
+        of categories without jobs are removed.
+
+        The summary file (e.g. 'status/hucore.summary.json') is rewritten every
+        time, it contains the total number of running and queued jobs plus the
+        numbers of each category's jobs and the queue position of its first queued
+        one (1 being the next job to be dispatched, `None` if none is queued):
+
+        summary = {
+            "running": 1,
+            "queued": 3,
+            "categories": {
+                "user01": { "running": 1, "queued": 2, "first": 1 },
+                "user02": { "running": 0, "queued": 1, "first": 2 }
+            }
+        }
+
+        Parameters
+        ----------
+        running : list(dict)
+            The processing jobs, formatted by `format_job()`.
+        queued : list(dict)
+            The queued jobs (in their order), formatted by `format_job()`.
+        """
+        base = os.path.splitext(self.statusfile)[0]
+        if not os.path.isdir(base):
+            os.makedirs(base)
+        dirty = self.dirty
+        self.dirty = set()
+        if self.shards is None:
+            # files of a previous run might be stale, so start from scratch:
+            self.shards = dict()
+            for fname in os.listdir(base):
+                if fname.endswith(".json"):
+                    os.remove(os.path.join(base, fname))
+            dirty = None
+        else:
+            # the order of jobs following the ones of other categories depends on
+            # the position of their leader, so always check those categories:
+            dirty.update(
+                self.jobs[uid].get_category()
+                for uids in self.followers.values()
+                for uid in uids
+            )
+
+        shards = dict()
+        summary = dict()
+        for position, fjob in enumerate(running + queued, 1 - len(running)):
+            category = fjob["username"]
+            if dirty is None or category in dirty:
+                shards.setdefault(category, list()).append(fjob)
+            counts = summary.get(category)
+            if counts is None:
+                counts = {"running": 0, "queued": 0, "first": None}
+                summary[category] = counts
+            if position > 0:
+                counts["queued"] += 1
+                if counts["first"] is None:
+                    counts["first"] = position
+            else:
+                counts["running"] += 1
+
+        for category in set(self.shards).difference(summary):
+            logd("Removing the status file of category [%s].", category)
+            os.remove(os.path.join(base, self.shard_name(category)))
+            del self.shards[category]
+        for category, jobs in shards.items():
+            content = json.dumps({"jobs": jobs}, indent=4)
+            if self.shards.get(category) == content:
+                continue
+            write_atomically(os.path.join(base, self.shard_name(category)), content)
+            self.shards[category] = content
+
+        summary = {
+            "running": len(running),
+            "queued": len(queued),
+            "categories": summary,
+        }
+        write_atomically(base + ".summary.json", json.dumps(summary, indent=4))
+
+    @staticmethod
+    def shard_name(category):
+        """Get the name of a category's status file (see `write_shards()`)."""
+        if isinstance(category, unicode):
+            category = category.encode("utf-8")
+        return urllib.quote(category, safe="") + ".json"
+
+    @staticmethod
+    def format_job(job):
+        """Assemble the dict describing a job in the queue status.
+
+        Parameters
+        ----------
+        job : snijder.jobs.JobDescription
+
+        Returns
+        -------
+        dict
+        """
+        return {
+            "id": job["uid"],
+            "file": job["infiles"],
+            "username": job["user"],
+            "jobType": job["type"],
+            "status": job["status"],
+            "server": "N/A",
+            "progress": "N/A",
+            "pid": "N/A",
+            "start": "N/A",
+            "queued": job["timestamp"],
+            "phases": job.phase_durations(),
+        }
+
+    def job_details(self, user=None):
+        """Get the dicts describing the jobs, see `queue_details_json()`.
+
+        Parameters
+        ----------
+        user : str, optional
+            Only describe the jobs of this user, by default `None` (all jobs).
+
+        Returns
+        -------
+        list(dict)
+            The running jobs first, followed by the queued ones in their order.
+        """
+        running = self.with_followers(self.processing)
+        if user is None:
+            return [self.format_job(self.jobs[uid]) for uid in running + self.joblist()]
+        uids = self.find(user=user)
+        running = [uid for uid in running if uid in uids]
+        # the queued jobs of a user are the ones of the category (see
+        # `JobDescription.get_category()`) unless some follow other users' jobs:
+        queued = self.with_followers(list(self.queue.get(user, [])))
+        queued = [uid for uid in queued if uid in uids]
+        if len(running) + len(queued) < len(uids):
+            queued = [uid for uid in self.joblist() if uid in uids]
+        return [self.format_job(self.jobs[uid]) for uid in running + queued]
+
     def queue_details_hr(self):
         """Log a human readable representation of the queue details.
 
@@ -346,7 +1242,7 @@ class JobQueue(object):
         # the information assembling and string formatting below is very
         # time-consuming, so we check the current log level first and return if
         # we wouldn't log anything anyway:
-        if LOGGER.level > LEVEL_MAPPING["info"]:
+        if not LOGGER.isEnabledFor(LEVEL_MAPPING["info"]):
             return
 
         msg = list()
@@ -354,7 +1250,7 @@ class JobQueue(object):
         msg.append("--- jobs retrieved for processing")
         if not self.processing:
             msg.append("None.")
-        for jobid in self.processing:
+        for jobid in self.with_followers(self.processing):
             job = self.jobs[jobid]
             msg.append(
                 "%s (%s): [uid:%.7s] - %s [%s]"
@@ -376,7 +1272,7 @@ class JobQueue(object):
         msg.append("%s queue status %s" % ("=" * 25, "=" * 25))
 
         logi("queue_details_hr():\n%s", "\n".join(msg))
-        if LOGGER.level > LEVEL_MAPPING["debug"]:
+        if not debug_enabled():
             return
 
         logd(
@@ -384,6 +1280,7 @@ class JobQueue(object):
             "^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^\n"
             "statusfile: %s\n"
             "categories: %s\n"
+            "parked: %s\n"
             "jobs: %s\n"
             "processing: %s\n"
             "queue: %s\n"
@@ -391,12 +1288,23 @@ class JobQueue(object):
             "^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^",
             pprint.pformat(self._statusfile),
             pprint.pformat(self.categories),
+            pprint.pformat(self.parked),
             pprint.pformat(self.jobs),
             pprint.pformat(self.processing),
             pprint.pformat(self.queue),
             pprint.pformat(self.deletion_list),
         )
 
+    def with_followers(self, joblist):
+        """Insert the followers of the jobs of a list right after their leaders."""
+        if not self.followers:
+            return joblist
+        return [
+            uid
+            for jobid in joblist
+            for uid in [jobid] + self.followers.get(jobid, [])
+        ]
+
     def queue_details(self):
         """Generate a list with the current queue details."""
         return [self.jobs[jobid] for jobid in self.joblist()]
@@ -404,8 +1312,9 @@ class JobQueue(object):
     def joblist(self):
         """Generate a list with job ids respecting the current queue order.
 
-        For now this simply interleaves all queues from all users, until we
-        have implemented a more sophisticated scheduling. However, as the plan
+        For now this simply interleaves all queues from all users (each one in
+        the order of the jobs' effective priorities), until we have implemented a
+        more sophisticated scheduling. However, as the plan
         is to have a dynamic scheduling mechanism, the order of the jobs in
         the queue will be subject to constant change - and therefore the
         queue details will in the best case give an estimate of which jobs
@@ -415,9 +1324,9 @@ class JobQueue(object):
         -------
         Given the following queue status:
             self.queue = {
-                'user00': deque(['u00_j0', 'u00_j1', 'u00_j2', 'u00_j3']),
-                'user01': deque(['u01_j0', 'u01_j1', 'u01_j2']),
-                'user02': deque(['u02_j0', 'u02_j1'])
+                'user00': CategoryQueue(['u00_j0', 'u00_j1', 'u00_j2', 'u00_j3']),
+                'user01': CategoryQueue(['u01_j0', 'u01_j1', 'u01_j2']),
+                'user02': CategoryQueue(['u02_j0', 'u02_j1'])
             }
 
         will result in a list of job dicts in the following order:
@@ -443,19 +1352,24 @@ class JobQueue(object):
         if len(self) == 0:  # pylint: disable-msg=len-as-condition
             logd("Empty queue!")
             return joblist
-        # put queues into a list of lists, respecting the current queue order:
-        queues = [self.queue[category] for category in self.categories]
-        # turn into a zipped list of the queues of all users, padding with
-        # 'None' to compensate the different queue lengths:
-        queues = [x for x in itertools.izip_longest(*queues)]
-        # with the example values, this results in the following:
-        # [('u02_j0', 'u01_j0', 'u00_j0'),
-        #  ('u02_j1', 'u01_j1', 'u00_j1'),
-        #  (None,     'u01_j2', 'u00_j2'),
-        #  (None,     None,     'u00_j3')]
-
-        # now flatten the tuple-list and fill with the job details:
-        joblist = [
-            jobid for roundlist in queues for jobid in roundlist if jobid is not None
-        ]
-        return joblist
+        # jobs of parked categories can only be selected after all others:
+        for categories in [self.categories, sorted(self.parked)]:
+            # put queues into a list of lists, respecting the current queue order:
+            queues = [self.queue[category] for category in categories]
+            # turn into a zipped list of the queues of all users, padding with
+            # 'None' to compensate the different queue lengths:
+            queues = [x for x in itertools.izip_longest(*queues)]
+            # with the example values, this results in the following:
+            # [('u02_j0', 'u01_j0', 'u00_j0'),
+            #  ('u02_j1', 'u01_j1', 'u00_j1'),
+            #  (None,     'u01_j2', 'u00_j2'),
+            #  (None,     None,     'u00_j3')]
+
+            # now flatten the tuple-list and fill with the job details:
+            joblist += [
+                jobid
+                for roundlist in queues
+                for jobid in roundlist
+                if jobid is not None
+            ]
+        return self.with_followers(joblist)
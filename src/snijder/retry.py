@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Retry policies for jobs that terminated unsuccessfully.
+
+Classes
+-------
+
+RetryPolicy()
+    Decides whether (and when) a failed job should be run again.
+"""
+
+from . import logi, logw
+
+# exit codes of 'hucore' that indicate the job can never succeed, e.g. 165 means
+# the template (.hgsb) file could not be parsed:
+HUCORE_PERMANENT = [165]
+
+# exit codes of 'hucore' considered transient: the exit code wrapper (a shell, see
+# `snijder.apps.record_exitcode()`) reports a process killed by SIGKILL (e.g. by the
+# OOM killer) as 128 + 9:
+HUCORE_TRANSIENT = [137]
+
+
+def policy_for(job, policies=None):
+    """Select the retry policy for a job, depending on its tasktype.
+
+    Parameters
+    ----------
+    job : snijder.jobs.JobDescription
+    policies : dict, optional
+        A mapping of tasktypes to RetryPolicy objects, by default `None` which gets
+        expanded to the built-in mapping (see code below).
+
+    Returns
+    -------
+    RetryPolicy
+        The policy for the job's tasktype, a policy never retrying anything in case
+        the tasktype is not in the mapping.
+    """
+    if policies is None:
+        policies = {
+            "decon": RetryPolicy(
+                max_retries=3,
+                backoff=60,
+                permanent=HUCORE_PERMANENT,
+                transient=HUCORE_TRANSIENT,
+            ),
+            "preview": RetryPolicy(
+                max_retries=2,
+                backoff=10,
+                permanent=HUCORE_PERMANENT,
+                transient=HUCORE_TRANSIENT,
+            ),
+        }
+    return policies.get(job.get("tasktype"), RetryPolicy())
+
+
+class RetryPolicy(object):
+
+    """Retry policy with exponential backoff.
+
+    A job that was killed by a signal (other than being explicitly killed by the
+    queue manager) or terminated with one of the `transient` exit codes is
+    considered to have failed transiently, unless its exit code is listed as a
+    permanent one. Other failures (e.g. jobs that couldn't be launched at all) are
+    not retried. Transient failures are retried up to `max_retries` times, the delay
+    growing exponentially.
+
+    Instance Attributes
+    -------------------
+    max_retries : int
+        The maximum number of times a job is run again.
+    backoff : float
+        The delay in seconds before the first retry.
+    factor : float
+        The factor by which the delay grows with every subsequent retry.
+    max_backoff : float
+        The upper limit for the delay in seconds.
+    permanent : list(int)
+        Exit codes indicating a permanent failure, never to be retried.
+    transient : list(int)
+        Exit codes indicating a transient failure, to be retried.
+    """
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(
+        self,
+        max_retries=0,
+        backoff=30,
+        factor=2,
+        max_backoff=3600,
+        permanent=None,
+        transient=None,
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.permanent = permanent if permanent is not None else list()
+        self.transient = transient if transient is not None else list()
+
+    def is_transient(self, exitcode, signal):
+        """Check if a failure is considered to be transient.
+
+        Parameters
+        ----------
+        exitcode : int or None
+            The exit code of the job process, `None` if unknown.
+        signal : int or None
+            The signal that terminated the job process, `None` or 0 if none.
+
+        Returns
+        -------
+        bool
+        """
+        if exitcode in self.permanent:
+            return False
+        if signal:
+            return True
+        return exitcode in self.transient
+
+    def delay(self, attempt):
+        """Calculate the backoff delay for a given retry attempt.
+
+        Parameters
+        ----------
+        attempt : int
+            The number of retries already done for the job.
+
+        Returns
+        -------
+        float
+        """
+        return min(self.backoff * self.factor ** attempt, self.max_backoff)
+
+    def retry_delay(self, job, killed=False):
+        """Decide if a terminated job should be retried.
+
+        Parameters
+        ----------
+        job : snijder.jobs.JobDescription
+            The terminated job, having the 'exitcode' and 'signal' keys set.
+        killed : bool, optional
+            Whether the job was explicitly killed by the queue manager (in which
+            case it is never retried), by default False.
+
+        Returns
+        -------
+        float or None
+            The delay in seconds after which the job should be run again, or `None`
+            if it shouldn't be retried.
+        """
+        exitcode = job.get("exitcode")
+        signal = job.get("signal")
+        if killed or (exitcode == 0 and not signal):
+            return None
+        if not self.is_transient(exitcode, signal):
+            logw(
+                "Job [uid:%.7s] failed permanently (exit code %s), not retrying.",
+                job["uid"],
+                exitcode,
+            )
+            return None
+        attempt = job.get("retries", 0)
+        if attempt >= self.max_retries:
+            logw(
+                "Job [uid:%.7s] failed, giving up after %s retries.",
+                job["uid"],
+                attempt,
+            )
+            return None
+        delay = self.delay(attempt)
+        logi(
+            "Job [uid:%.7s] failed transiently (exit code %s, signal %s), retrying "
+            "in %ss (retry %s of %s).",
+            job["uid"],
+            exitcode,
+            signal,
+            delay,
+            attempt + 1,
+            self.max_retries,
+        )
+        return delay
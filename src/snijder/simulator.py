@@ -0,0 +1,640 @@
+# -*- coding: utf-8 -*-
+"""Discrete-event simulation of the spooler's scheduling.
+
+The simulation drives the real `JobQueue` and the dispatch logic of the
+`JobSpooler` against a fake gc3 engine whose jobs "run" for a given duration on a
+virtual clock, so a day's workload can be replayed within seconds.
+
+A workload is a list of dicts, each describing a job submission with the keys
+
+    time : float
+        The submission time (absolute or relative, only differences matter).
+    user : str
+        The user submitting the job (the scheduling category).
+    duration : float, optional
+        The runtime of the job in seconds, sampled from a distribution if missing.
+    tasktype : str, optional
+        The hucore tasktype, 'decon' by default.
+    exitcode : int, optional
+        The exit code of the job, 0 by default.
+    signal : int, optional
+        The signal terminating the job, 0 by default (see `snijder.retry` for the
+        failures triggering retries).
+
+Workload files contain one JSON dict per line.
+
+Classes
+-------
+
+VirtualClock()
+    The simulated time, replacing `time.time()` while a simulation is running.
+SimApp(), SimEngine()
+    Stand-ins for the gc3 applications and the gc3 engine.
+SimSpooler()
+    A `JobSpooler` using the fake engine, optionally with several job slots.
+FifoQueue()
+    A first-come-first-served scheduler as an alternative to the round-robin one.
+Simulation()
+    Replay of a workload with a given scheduler, collecting the results.
+"""
+
+import json
+import math
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import gc3libs
+
+from . import logi, logw
+from .jobs import JobDescription
+from .queue import JobQueue
+from .spooler import JobSpooler
+
+JOBCFG = """# simulated job %(seq)s
+[snijderjob]
+version = 7
+username = %(user)s
+useremail = %(user)s@simulation
+jobtype = hucore
+timestamp = %(time).6f
+
+[hucore]
+tasktype = %(tasktype)s
+executable = /usr/local/bin/hucore
+template = simulation.hgsb
+
+[inputfiles]
+file1 = simulation.h5
+"""
+
+
+def sample_duration(rng, mean, distribution="exponential"):
+    """Draw a job runtime from a distribution with the given mean.
+
+    Parameters
+    ----------
+    rng : random.Random
+    mean : float
+        The mean runtime in seconds.
+    distribution : str, optional
+        One of 'exponential' (the default), 'lognormal' (heavy-tailed, sigma=1) or
+        'constant'.
+
+    Returns
+    -------
+    float
+    """
+    if distribution == "exponential":
+        return rng.expovariate(1.0 / mean)
+    if distribution == "lognormal":
+        # exp(mu + sigma^2 / 2) is the mean of a lognormal distribution:
+        return rng.lognormvariate(math.log(mean) - 0.5, 1.0)
+    if distribution == "constant":
+        return float(mean)
+    raise ValueError("Unknown duration distribution: %s" % distribution)
+
+
+def load_workload(fname):
+    """Read a workload from a file containing one JSON dict per line.
+
+    Parameters
+    ----------
+    fname : str
+
+    Returns
+    -------
+    list(dict)
+    """
+    workload = list()
+    with open(fname, "r") as infile:
+        for line in infile:
+            if line.strip():
+                workload.append(json.loads(line))
+    return workload
+
+
+def random_workload(count, users=10, span=86400, seed=None):
+    """Generate a workload with uniformly distributed submissions.
+
+    Parameters
+    ----------
+    count : int
+        The number of jobs.
+    users : int, optional
+        The number of users submitting jobs, by default 10.
+    span : float, optional
+        The time span (in seconds) the submissions are spread over, by default
+        one day.
+    seed : int, optional
+
+    Returns
+    -------
+    list(dict)
+        The submissions, without durations.
+    """
+    rng = random.Random(seed)
+    workload = [
+        {"time": rng.uniform(0, span), "user": "user%02i" % rng.randrange(users)}
+        for _ in range(count)
+    ]
+    return sorted(workload, key=lambda entry: entry["time"])
+
+
+def jain_index(values):
+    """Calculate Jain's fairness index, 1.0 meaning all values are equal.
+
+    Parameters
+    ----------
+    values : list(float)
+
+    Returns
+    -------
+    float
+    """
+    values = list(values)
+    squares = sum([value ** 2 for value in values])
+    if not squares:
+        return 1.0
+    return sum(values) ** 2 / (len(values) * squares)
+
+
+class VirtualClock(object):
+
+    """Simulated time, advanced explicitly by the simulation.
+
+    Instance Attributes
+    -------------------
+    now : float
+        The current simulated time.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = float(start)
+
+    def time(self):
+        """Get the simulated time, the replacement for `time.time()`."""
+        return self.now
+
+    def sleep(self, seconds):
+        """Advance the simulated time, the replacement for `time.sleep()`."""
+        self.now += seconds
+
+    @contextmanager
+    def installed(self):
+        """Context manager replacing `time.time()` and `time.sleep()`.
+
+        The replacement is process-wide, so all timestamps taken by the queue, the
+        jobs and the spooler (including the log records) use the simulated time.
+        """
+        saved = (time.time, time.sleep)
+        time.time, time.sleep = self.time, self.sleep
+        try:
+            yield self
+        finally:
+            time.time, time.sleep = saved
+
+
+class SimApp(object):
+
+    """Simulated app, "running" for the duration given in the job.
+
+    Provides the parts of the `snijder.apps.AbstractApp` interface used by the
+    spooler. The simulated runtime, exit code and signal are taken from the job's
+    'sim_duration', 'sim_exitcode' and 'sim_signal' keys.
+
+    Instance Attributes
+    -------------------
+    job : snijder.jobs.JobDescription
+    output_dir : str
+        The (never created) directory the results would be placed in.
+    state : str
+        The simulated gc3 execution state.
+    duration : float
+    started : float
+        The (simulated) time the app started running, `None` before.
+    finished : float
+        The (simulated) time the app terminated, `None` before.
+    """
+
+    def __init__(self, job, output_dir):
+        self.job = job
+        self.output_dir = output_dir
+        self.cgroup = None
+        self.killed = False
+        self.dispatched = time.time()
+        self.suspended_at = None
+        self.suspended_time = 0.0
+        self.duration = job["sim_duration"]
+        self.exitcode = job.get("sim_exitcode", 0)
+        self.signal = job.get("sim_signal", 0)
+        self.state = self.laststate = gc3libs.Run.State.NEW
+        self.started = self.finished = None
+
+    def progress(self, now):
+        """Advance the simulated execution state to the given time.
+
+        Returns
+        -------
+        bool
+            True in case the state has changed.
+        """
+        # pylint: disable-msg=no-member
+        previous = self.state
+        if self.killed and self.state != gc3libs.Run.State.TERMINATED:
+            if self.started is None:
+                self.started = now
+            self.terminated(now)
+        elif self.state == gc3libs.Run.State.NEW:
+            self.job.mark("submitted", now)
+            self.job.mark("running", now)
+            self.state = gc3libs.Run.State.RUNNING
+            self.started = now
+        elif self.state == gc3libs.Run.State.RUNNING:
+            if now >= self.started + self.duration:
+                self.terminated(now)
+        return self.state != previous
+
+    def terminated(self, now):
+        """Finish the simulated execution, recording the exit code in the job."""
+        self.job.mark("terminated", now)
+        self.state = gc3libs.Run.State.TERMINATED  # pylint: disable-msg=no-member
+        self.finished = now
+        self.job["exitcode"] = None if self.killed else self.exitcode
+        self.job["signal"] = 9 if self.killed else self.signal
+
+    def finishes(self):
+        """Get the (simulated) time the app will terminate, `None` if not running."""
+        if self.state != gc3libs.Run.State.RUNNING:  # pylint: disable-msg=no-member
+            return None
+        return self.started + self.duration
+
+    def kill(self, **extra_args):  # pylint: disable-msg=unused-argument
+        """Kill the app, it will terminate on the next engine progress."""
+        self.killed = True
+
+    def confine(self, cgroups):
+        """Simulated apps are never confined."""
+
+    def status_changed(self):
+        """Check if the state has changed since the last call, like the real app."""
+        if self.state == self.laststate:
+            return None
+        self.laststate = self.job["status"] = self.state
+        return self.state
+
+
+class SimEngine(object):
+
+    """Fake gc3 engine for simulated apps.
+
+    Instance Attributes
+    -------------------
+    clock : VirtualClock
+    apps : list(SimApp)
+        The apps currently managed by the engine.
+    done : list(SimApp)
+        All apps that have terminated.
+    transitions : int
+        The number of state changes so far, used to detect if anything happened.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.apps = list()
+        self.done = list()
+        self.transitions = 0
+
+    def add(self, app):
+        """Add an app to the engine, it will be started by the next progress()."""
+        self.apps.append(app)
+
+    def progress(self):
+        """Advance all apps to the current (simulated) time."""
+        for app in list(self.apps):
+            if app.progress(self.clock.now):
+                self.transitions += 1
+            if app.finished is not None:
+                self.apps.remove(app)
+                self.done.append(app)
+
+    def counts(self):
+        """Count the apps per state, like gc3libs.core.Engine.counts()."""
+        stats = dict.fromkeys(
+            [
+                "NEW",
+                "SUBMITTED",
+                "RUNNING",
+                "TERMINATING",
+                "TERMINATED",
+                "UNKNOWN",
+                "STOPPED",
+            ],
+            0,
+        )
+        for app in self.apps:
+            stats[app.state] += 1
+        stats["TERMINATED"] = len(self.done)
+        stats["total"] = len(self.apps) + len(self.done)
+        return stats
+
+    def next_event(self):
+        """Get the (simulated) time the next running app terminates, or `None`."""
+        finishes = [app.finishes() for app in self.apps]
+        finishes = [finish for finish in finishes if finish is not None]
+        if not finishes:
+            return None
+        return min(finishes)
+
+
+class SimSpooler(JobSpooler):
+
+    """A JobSpooler running simulated apps on a fake engine.
+
+    The set-up of the real spooler (runtime directories, gc3 configuration) is
+    skipped by injecting the engine, whereas the dispatching (`dispatch_next()`),
+    the processing of the terminated apps (`update_apps()`) and the deletion
+    handling are the real ones.
+
+    Instance Attributes
+    -------------------
+    slots : int
+        The number of jobs that may run concurrently (like the per-resource slots
+        of the production spooler, which defaults to a single one).
+    dispatched : int
+        The number of jobs dispatched so far.
+    """
+
+    apptypes = {"hucore": SimApp, "dummy": SimApp}
+
+    def __init__(self, queue, clock, slots=1):
+        super(SimSpooler, self).__init__(
+            None, queue, None, slots=slots, engine=SimEngine(clock)
+        )
+        self.dispatched = 0
+
+    def dispatch_next(self, category=None):
+        """Dispatch the next job (see `JobSpooler.dispatch_next()`), count it."""
+        app = super(SimSpooler, self).dispatch_next(category)
+        if app is not None:
+            self.dispatched += 1
+        return app
+
+    def settle(self):
+        """Run spooling iterations until nothing changes at the current time."""
+        while True:
+            before = (self.engine.transitions, self.dispatched)
+            self.spool_step()
+            if (self.engine.transitions, self.dispatched) == before:
+                return
+
+
+class FifoQueue(JobQueue):
+
+    """Queue serving jobs strictly in the order of their submission.
+
+    An alternative to the round-robin scheduler of `JobQueue` for comparison,
+    ignoring the categories (users) when selecting the next job.
+    """
+
+    def next_job(self, category=None):
+        """Return the job submitted first, skipping ones waiting for a retry."""
+        if category is not None:
+            return super(FifoQueue, self).next_job(category)
+        now = time.time()
+        due = dict()
+        for cat in self.categories:
+            jobid = self.first_due(cat, now)
+            if jobid is not None:
+                due[cat] = self.jobs[jobid]["timestamp"]
+        if not due:
+            return None
+        oldest = min(due, key=due.get)
+        return super(FifoQueue, self).next_job(oldest)
+
+
+# mapping from scheduler names to queue classes:
+SCHEDULERS = {"roundrobin": JobQueue, "fifo": FifoQueue}
+
+
+class Simulation(object):
+
+    """Replay of a workload through a queue and a simulated spooler.
+
+    Instance Attributes
+    -------------------
+    workload : list(dict)
+        The job submissions, see the module documentation for the format.
+    scheduler : str
+        The name of the scheduler, one of the keys of `SCHEDULERS`.
+    slots : int
+        The number of concurrently running jobs.
+    clock : VirtualClock
+    queue : snijder.queue.JobQueue
+    spooler : SimSpooler
+    submissions : dict
+        The workload entries of all submitted jobs (key: UID).
+    """
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(
+        self,
+        workload,
+        scheduler="roundrobin",
+        slots=1,
+        mean_duration=600,
+        distribution="exponential",
+        seed=None,
+    ):
+        """Prepare the simulation.
+
+        Parameters
+        ----------
+        workload : list(dict)
+        scheduler : str, optional
+            The scheduler to use, by default 'roundrobin'.
+        slots : int, optional
+            The number of concurrently running jobs, by default 1.
+        mean_duration : float, optional
+            The mean runtime for jobs not specifying a duration, by default 600.
+        distribution : str, optional
+            The distribution the missing durations are sampled from, see
+            `sample_duration()`.
+        seed : int, optional
+            The seed for sampling the durations.
+        """
+        rng = random.Random(seed)
+        self.workload = sorted(workload, key=lambda entry: entry["time"])
+        for entry in self.workload:
+            if entry.get("duration") is None:
+                entry["duration"] = sample_duration(rng, mean_duration, distribution)
+        self.scheduler = scheduler
+        self.slots = slots
+        start = self.workload[0]["time"] if self.workload else 0
+        self.clock = VirtualClock(start)
+        self.queue = SCHEDULERS[scheduler](scheduler)
+        self.spooler = SimSpooler(self.queue, self.clock, slots)
+        self.submissions = dict()
+
+    def submit(self, seq, entry):
+        """Create the job for a workload entry and add it to the queue."""
+        job = JobDescription(
+            JOBCFG
+            % {
+                "seq": seq,
+                "user": entry["user"],
+                "time": entry["time"],
+                "tasktype": entry.get("tasktype", "decon"),
+            },
+            "string",
+        )
+        job["sim_duration"] = entry["duration"]
+        job["sim_exitcode"] = entry.get("exitcode", 0)
+        job["sim_signal"] = entry.get("signal", 0)
+        self.submissions[job["uid"]] = entry
+        self.queue.append(job)
+
+    def next_event(self, pending):
+        """Get the (simulated) time of the next event, `None` if there is none.
+
+        Events are submissions, terminating jobs and retry delays running out.
+        """
+        candidates = list()
+        if pending:
+            candidates.append(pending[0][1]["time"])
+        finish = self.spooler.engine.next_event()
+        if finish is not None:
+            candidates.append(finish)
+        for job in self.queue.jobs.values():
+            if job.get("not_before", 0) > self.clock.now:
+                candidates.append(job["not_before"])
+        if not candidates:
+            return None
+        return max(min(candidates), self.clock.now)
+
+    def run(self):
+        """Run the simulation and return the report (see `report()`)."""
+        spooldirs = JobDescription.spooldirs
+        # no jobfiles are involved, an empty dict avoids the warnings on parsing:
+        JobDescription.spooldirs = dict()
+        pending = deque(enumerate(self.workload))
+        logi(
+            "Simulating %s jobs with scheduler '%s' on %s slot(s).",
+            len(pending),
+            self.scheduler,
+            self.slots,
+        )
+        try:
+            with self.clock.installed():
+                while True:
+                    while pending and pending[0][1]["time"] <= self.clock.now:
+                        self.submit(*pending.popleft())
+                    self.spooler.settle()
+                    upcoming = self.next_event(pending)
+                    if upcoming is None:
+                        break
+                    self.clock.now = upcoming
+        finally:
+            JobDescription.spooldirs = spooldirs
+        if self.queue.jobs:
+            logw("Simulation ended with %s jobs left.", len(self.queue.jobs))
+        return self.report()
+
+    def report(self):
+        """Assemble the results of the simulation.
+
+        The wait time of a job is the time from its submission until it started
+        running the first time, its slowdown is the time from submission until
+        its (last) termination relative to its runtime. Fairness is measured as
+        Jain's index over the mean slowdown of each user.
+
+        Returns
+        -------
+        dict
+        """
+        per_job = dict()
+        for app in self.spooler.engine.done:
+            entry = self.submissions[app.job["uid"]]
+            record = per_job.setdefault(
+                app.job["uid"],
+                {"user": entry["user"], "submitted": entry["time"], "runtime": 0},
+            )
+            record.setdefault("started", app.started)
+            record["started"] = min(record["started"], app.started)
+            record["finished"] = max(record.get("finished", 0), app.finished)
+            record["runtime"] += app.finished - app.started
+
+        users = dict()
+        for record in per_job.values():
+            wait = record["started"] - record["submitted"]
+            slowdown = (record["finished"] - record["submitted"]) / max(
+                record["runtime"], 1.0
+            )
+            stats = users.setdefault(record["user"], {"waits": [], "slowdowns": []})
+            stats["waits"].append(wait)
+            stats["slowdowns"].append(slowdown)
+
+        waits = list()
+        for stats in users.values():
+            waits.extend(stats["waits"])
+            stats["jobs"] = len(stats["waits"])
+            stats["mean_wait"] = sum(stats["waits"]) / len(stats["waits"])
+            stats["max_wait"] = max(stats.pop("waits"))
+            stats["mean_slowdown"] = sum(stats["slowdowns"]) / len(stats["slowdowns"])
+            del stats["slowdowns"]
+
+        makespan = 0.0
+        if per_job:
+            makespan = max([rec["finished"] for rec in per_job.values()]) - min(
+                [rec["submitted"] for rec in per_job.values()]
+            )
+        busy = sum([rec["runtime"] for rec in per_job.values()])
+        return {
+            "scheduler": self.scheduler,
+            "slots": self.slots,
+            "jobs": len(per_job),
+            "makespan": makespan,
+            "utilization": busy / (self.slots * makespan) if makespan else 0.0,
+            "mean_wait": sum(waits) / len(waits) if waits else 0.0,
+            "max_wait": max(waits) if waits else 0.0,
+            "fairness": jain_index([s["mean_slowdown"] for s in users.values()]),
+            "users": users,
+        }
+
+
+def format_report(report):
+    """Format a simulation report as a human readable text.
+
+    Parameters
+    ----------
+    report : dict
+        A report as returned by `Simulation.run()`.
+
+    Returns
+    -------
+    str
+    """
+    lines = [
+        "scheduler: %(scheduler)s (%(slots)s slots), %(jobs)s jobs" % report,
+        "  makespan:    %10.1f s" % report["makespan"],
+        "  utilization: %10.3f" % report["utilization"],
+        "  mean wait:   %10.1f s" % report["mean_wait"],
+        "  max wait:    %10.1f s" % report["max_wait"],
+        "  fairness:    %10.3f (Jain's index of the mean slowdown per user)"
+        % report["fairness"],
+        "  %-16s %6s %12s %12s %10s"
+        % ("user", "jobs", "mean wait", "max wait", "slowdown"),
+    ]
+    for user, stats in sorted(report["users"].items()):
+        lines.append(
+            "  %-16s %6s %12.1f %12.1f %10.2f"
+            % (
+                user,
+                stats["jobs"],
+                stats["mean_wait"],
+                stats["max_wait"],
+                stats["mean_slowdown"],
+            )
+        )
+    return "\n".join(lines)
@@ -16,18 +16,25 @@ JobSpooler()
 #       instead a notification needs to be sent/printed to the user (later
 #       this should trigger an email).
 
+import json
 import os
 import pprint
+import threading
 import time
 import psutil
 
 import gc3libs
 import gc3libs.config
 
-from . import logi, logd, logw, logc, loge
+from . import logi, logd, logw, logc, loge, lazy
 from . import JOBFILE_VER
-from .apps import hucore, dummy
+from . import metrics, retry, trace
+from .logger import job_fields
+from .memo import link_tree
+from .apps import hucore, dummy, synthetic
+from .executor import LocalEngine
 from .jobs import JobDescription
+from .placement import Resource, ResourcePool
 
 
 class JobSpooler(object):
@@ -44,19 +51,64 @@ class JobSpooler(object):
         # queues : dict(snijder.JobQueue)  # TODO: multi-queue logic (#136, #272)
         gc3cfg : dict
             A dict with gc3 config paths as returned by JobSpooler.check_gc3conf().
-        engine : gc3libs.core.Engine
-            The gc3 engine object to be used for this spooler.
+        engine : gc3libs.core.Engine or snijder.executor.LocalEngine
+            The engine object to be used for this spooler.
+        executor : str
+            The kind of engine, either 'gc3' or 'local'.
+        placement : str
+            The placement policy in case multiple gc3 resources are enabled, see
+            `snijder.placement`.
+        slots : int
+            The number of jobs running concurrently per resource.
+        affinity : dict
+            The data locality affinity map, see `snijder.placement.load_affinity()`.
+        cgroups : snijder.cgroups.CgroupManager
+            The manager used to confine each job in its own cgroup, `None` (the
+            default) to launch jobs unconfined.
+        memo : snijder.memo.ResultCache
+            The cache used to serve the results of identical jobs without running
+            them again, `None` (the default) to disable memoization.
+        preemption : snijder.preempt.PreemptionPolicy
+            The policy for suspending running jobs in favor of urgent ones, `None`
+            (the default) to disable preemption.
+        suspended : list
+            The apps that have been suspended, in the order of their suspension.
+        drain_until : float
+            The time when draining (see `drain()`) gives up waiting for the running
+            jobs, `None` to wait for them indefinitely.
+        lock : threading.RLock
+            Held by the spooling loop while processing the queue and the apps, other
+            threads (e.g. `snijder.control.ControlServer`) have to acquire it before
+            accessing them.
         status : str
             The current spooler status.
     """
 
-    __allowed_status_values__ = ["shutdown", "refresh", "pause", "run"]
-
-    def __init__(self, spooldir, queue, gc3conf):
+    __allowed_status_values__ = ["shutdown", "refresh", "pause", "run", "drain"]
+
+    # mapping from jobtypes to app classes:
+    apptypes = {
+        "hucore": hucore.HuDeconApp,
+        "dummy": dummy.DummySleepApp,
+        "synthetic": synthetic.SyntheticApp,
+    }
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(
+        self,
+        spooldir,
+        queue,
+        gc3conf,
+        executor="gc3",
+        placement="least-loaded",
+        slots=1,
+        affinity=None,
+        engine=None,
+    ):
         """Prepare the spooler.
 
-        Check the GC3Pie config file, set up the gc3 engine, check the resource
-        directories.
+        Check the GC3Pie config file, set up the engine, check the resource
+        directories (see `setup()`).
 
         Parameters
         ----------
@@ -65,17 +117,63 @@ class JobSpooler(object):
         queue : snijder.JobQueue
         gc3conf : str
             The path to a gc3pie configuration file.
+        executor : str, optional
+            Use the gc3 engine ('gc3', the default) or launch jobs directly as
+            local subprocesses ('local', see `snijder.executor`). In both cases the
+            gc3pie configuration defines where the job outputs are placed.
+        placement : str, optional
+            The policy for placing jobs on the gc3 resources, by default
+            'least-loaded' (only used if multiple resources are enabled).
+        slots : int, optional
+            The number of jobs running concurrently per resource, by default 1.
+        affinity : dict, optional
+            The resources having local access to the storage volumes, to prefer
+            placing jobs where their input files don't need to be transferred.
+        engine : object, optional
+            An engine to use instead of the one defined by the gc3pie configuration,
+            e.g. for a simulation (see `snijder.simulator`). Neither the runtime
+            directories nor the gc3pie configuration are set up in that case, and
+            the job outputs are placed in `spooldir`.
         """
+        if executor not in ["gc3", "local"]:
+            raise ValueError("Unknown executor: %s" % executor)
+        self.executor = executor
+        self.placement = placement
+        self.slots = slots
+        self.affinity = affinity
         self.apps = list()
-        self.dirs = self.setup_rundirs(spooldir)
-        # set the JobDescription class variable for the spooldirs:
-        JobDescription.spooldirs = self.dirs
         self.queue = queue
         # self.queues = dict()  # TODO: multi-queue logic (#136, #272)
         self._status = self._status_pre = "run"  # the initial status is 'run'
+        if engine is None:
+            self.setup(spooldir, gc3conf)
+        else:
+            self.dirs = dict()
+            self.gc3cfg = {"spooldir": spooldir, "conffile": None}
+            self.engine = engine
+        self.cgroups = None
+        self.memo = None
+        self.preemption = None
+        self.suspended = list()
+        self.drain_until = None
+        self.lock = threading.RLock()
+        logi("Created JobSpooler.")
+
+    def setup(self, spooldir, gc3conf):
+        """Set up the runtime directories, the gc3pie configuration and the engine.
+
+        Parameters
+        ----------
+        spooldir : str
+            Spooling directory base path.
+        gc3conf : str
+            The path to a gc3pie configuration file.
+        """
+        self.dirs = self.setup_rundirs(spooldir)
+        # set the JobDescription class variable for the spooldirs:
+        JobDescription.spooldirs = self.dirs
         self.gc3cfg = self.check_gc3conf(gc3conf)
         self.engine = self.setup_engine()
-        logi("Created JobSpooler.")
 
     @property
     def status(self):
@@ -127,6 +225,23 @@ class JobSpooler(object):
         """Request the spooler to shut down."""
         self.status = "shutdown"
 
+    def drain(self, deadline=None):
+        """Request the spooler to shut down once the running jobs have finished.
+
+        No more jobs are dispatched, the queued ones are kept for the next start
+        (see `persist_queue()` and `pending_jobfiles()`).
+
+        Parameters
+        ----------
+        deadline : float, optional
+            The time in seconds to wait at most for the running jobs, those still
+            running afterwards are killed. By default `None` (no deadline).
+        """
+        self.drain_until = None
+        if deadline is not None:
+            self.drain_until = time.time() + deadline
+        self.status = "drain"
+
     @staticmethod
     def setup_rundirs(base_dir):
         """Check if all runtime dirs exist or try to create them otherwise.
@@ -194,7 +309,7 @@ class JobSpooler(object):
                 logw("- file: %s", fname)
                 full_subdirs["newfiles"].append(fname)
             logw("%s PRE-SUBMITTED JOBS %s", "=" * 60, "=" * 60)
-        logi("Runtime directories:\n%s", pprint.pformat(full_subdirs))
+        logi("Runtime directories:\n%s", lazy(pprint.pformat, full_subdirs))
 
         # check 'cur' dir and remember files for resuming from a queue shutdown:
         full_subdirs["curfiles"] = list()
@@ -223,10 +338,18 @@ class JobSpooler(object):
         Returns
         -------
         cfg : dict
-            A dict with keys 'spooldir' and 'conffile'.
+            A dict with keys 'spooldir', 'conffile' and 'resources', the latter
+            mapping the names of all enabled resources to their 'max_cores'.
         """
         cfg = dict()
         gc3conf = gc3libs.config.Configuration(gc3conffile)
+        cfg["resources"] = dict()
+        for name, resource in gc3conf.resources.items():
+            enabled = resource.get("enabled", True)
+            if isinstance(enabled, basestring):
+                enabled = enabled.lower() in ["1", "yes", "true", "on"]
+            if enabled:
+                cfg["resources"][name] = int(resource.get("max_cores", 1))
         try:
             cfg["spooldir"] = gc3conf.resources["localhost"].spooldir
             logi("Using gc3pie spooldir: %s", cfg["spooldir"])
@@ -346,18 +469,37 @@ class JobSpooler(object):
             raise RuntimeError(msg)
 
     def setup_engine(self):
-        """Wrapper to set up the GC3Pie engine.
+        """Wrapper to set up the GC3Pie engine (or the local one).
 
         Returns
         -------
-        gc3libs.core.Engine
+        gc3libs.core.Engine or snijder.executor.LocalEngine
         """
+        if self.executor == "local":
+            return LocalEngine()
         logi('Creating GC3Pie engine using config file "%s".', self.gc3cfg["conffile"])
-        engine = gc3libs.create_engine(self.gc3cfg["conffile"])
+        if len(self.gc3cfg["resources"]) > 1:
+            engine = self.setup_resource_pool()
+        else:
+            engine = gc3libs.create_engine(self.gc3cfg["conffile"])
         self.check_gc3_resources(engine)
 
         return engine
 
+    def setup_resource_pool(self):
+        """Set up an engine for each enabled gc3 resource and bundle them.
+
+        Returns
+        -------
+        snijder.placement.ResourcePool
+        """
+        resources = list()
+        for name, max_cores in sorted(self.gc3cfg["resources"].items()):
+            engine = gc3libs.create_engine(self.gc3cfg["conffile"])
+            engine.select_resource(name)
+            resources.append(Resource(name, engine, self.slots, max_cores))
+        return ResourcePool(resources, self.placement, affinity=self.affinity)
+
     def engine_status(self):
         """Helper to get the engine status and print a formatted log."""
         stats = self.engine.counts()
@@ -375,30 +517,83 @@ class JobSpooler(object):
         )
         return stats
 
+    def free_slots(self, stats):
+        """Get the number of jobs that may be dispatched right now.
+
+        Parameters
+        ----------
+        stats : dict
+            The engine status as returned by `engine_status()`.
+
+        Returns
+        -------
+        int
+        """
+        if isinstance(self.engine, ResourcePool):
+            return self.engine.free_slots()
+        # NOTE: in theory, we could simply add all apps to the engine
+        # and let gc3 decide when to dispatch the next one, however
+        # this it is causing a lot of error messages if the engine has
+        # more tasks than available resources, see ticket #421 and
+        # upstream gc3pie ticket #359 for more details. For now we only
+        # submit new jobs as long as there are less than `slots` running,
+        # submitted or about to be submitted (a single one by default):
+        busy = stats["NEW"] + stats["SUBMITTED"] + stats["RUNNING"]
+        return max(self.slots - busy, 0)
+
     def check_status_request(self):
         """Check if a status change for the QM was requested."""
         for fname in self.__allowed_status_values__:
             check_file = os.path.join(self.dirs["requests"], fname)
             if os.path.exists(check_file):
+                if fname == "drain":
+                    self.drain(self.read_deadline(check_file))
+                else:
+                    self.status = fname
                 os.remove(check_file)
-                self.status = fname
                 # we don't process more than one request at a time, so exit:
                 return
 
+    @staticmethod
+    def read_deadline(fname):
+        """Read the (optional) deadline in seconds from a drain request file.
+
+        Returns
+        -------
+        float
+            The deadline, `None` if the file is empty or can't be parsed.
+        """
+        try:
+            with open(fname, "r") as request:
+                content = request.read().strip()
+        except IOError as err:
+            logw("Unable to read the drain request [%s]: %s", fname, err)
+            return None
+        if not content:
+            return None
+        try:
+            return float(content)
+        except ValueError:
+            logw("Ignoring invalid drain deadline: %s", content)
+            return None
+
     def check_for_jobs_to_delete(self):
         """Process job deletion requests for all queues."""
         # first process jobs that have been dispatched already:
-        for app in self.apps:
-            uid = app.job["uid"]
-            if uid in self.queue.deletion_list:
-                # TODO: we need to make sure that the calls to the engine in
-                # kill_running_job() do not accidentally submit the next job
-                # as it could be potentially enlisted for removal...
-                self.kill_running_job(app)
-                self.queue.deletion_list.remove(uid)
+        apps = dict((app.job["uid"], app) for app in self.apps)
+        for uid in self.queue.deletion_list.intersection(apps):
+            app = apps[uid]
+            # TODO: we need to make sure that the calls to the engine in
+            # kill_running_job() do not accidentally submit the next job
+            # as it could be potentially enlisted for removal...
+            self.kill_running_job(app)
+            self.queue.deletion_list.discard(uid)
+            # don't resume the deleted job on the next start:
+            app.job.move_jobfile("done", ".deleted")
         # then process deletion requests for waiting jobs (note: killed jobs
         # have been removed from the queue by the kill_running_job() method)
-        self.queue.process_deletion_list()
+        for job in self.queue.process_deletion_list():
+            job.move_jobfile("done", ".deleted")
 
     def spool(self):
         """Wrapper for the spooler to catch Ctrl-C and clean up after spooling."""
@@ -407,7 +602,8 @@ class JobSpooler(object):
         except KeyboardInterrupt:
             logi("Received keyboard interrupt, stopping queue manager.")
         finally:
-            self.cleanup()
+            with self.lock:
+                self.cleanup()
 
     def _spool(self):
         """Spooler function dispatching jobs from the queues. BLOCKING!"""
@@ -415,73 +611,352 @@ class JobSpooler(object):
         print "snijder-queue spooler running, press ctrl-c to shut it down"
         print "*" * 80
         logi("SNIJDER spooler started, expected jobfile version: %s.", JOBFILE_VER)
-        # dict with a mapping from jobtypes to app classes:
-        apptypes = {
-            "hucore": hucore.HuDeconApp,
-            "dummy": dummy.DummySleepApp,
-        }
         while True:
-            self.check_status_request()
-            if self.status == "run":
-                # process deletion requests before anything else
-                self.check_for_jobs_to_delete()
-                # TODO: gc3pie logs an 'UnrecoverableDataStagingError' in case
-                # one of the input files can't be found - can we somehow catch
-                # this (it doesn't seem to raise an exception)?
-                self.engine.progress()
-                for i, app in enumerate(self.apps):
-                    new_state = app.status_changed()
-                    if new_state is not None:
-                        self.queue.set_jobstatus(app.job, new_state)
-
-                    # pylint: disable-msg=no-member
-                    if new_state == gc3libs.Run.State.TERMINATED:
-                        app.job.move_jobfile("done")
-                        self.apps.pop(i)
-                    # pylint: enable-msg=no-member
-
-                stats = self.engine_status()
-                # NOTE: in theory, we could simply add all apps to the engine
-                # and let gc3 decide when to dispatch the next one, however
-                # this it is causing a lot of error messages if the engine has
-                # more tasks than available resources, see ticket #421 and
-                # upstream gc3pie ticket #359 for more details. For now we do
-                # not submit new jobs if there are any running or submitted:
-                if stats["RUNNING"] > 0 or stats["SUBMITTED"] > 0:
-                    time.sleep(1)
-                    continue
-                nextjob = self.queue.next_job()
-                if nextjob is not None:
-                    logd("Current joblist: %s", self.queue.queue)
-                    apptype = apptypes[nextjob["type"]]
-                    logi("Adding job (type '%s') to the gc3 engine.", apptype.__name__)
-                    app = apptype(nextjob, self.gc3cfg["spooldir"])
-                    self.apps.append(app)
-                    self.engine.add(app)
-                    # as a new job is dispatched now, we also print out the
-                    # human readable queue status:
-                    self.queue.queue_details_hr()
-            elif self.status == "shutdown":
-                return True
-
-            elif self.status == "refresh":
-                # the actual refresh action is handled by the status.setter
-                # method, so we simply pass on:
-                pass
-            elif self.status == "pause":
-                # no need to do anything, just sleep and check requests again:
-                pass
-            time.sleep(0.5)
+            busy = False
+            # other threads may only access the queue while we're sleeping:
+            with self.lock:
+                self.check_status_request()
+                if self.status == "run":
+                    started = time.time()
+                    busy = self.spool_step()
+                    metrics.SPOOL_ITERATION.observe(time.time() - started)
+                elif self.status == "shutdown":
+                    return True
+
+                elif self.status == "drain":
+                    if self.drain_step():
+                        return True
+
+                elif self.status == "refresh":
+                    # the actual refresh action is handled by the status.setter
+                    # method, so we simply pass on:
+                    pass
+                elif self.status == "pause":
+                    # no need to do anything, just sleep and check requests again:
+                    pass
+            time.sleep(1 if busy else 0.5)
+
+    def spool_step(self):
+        """Run a single iteration of the spooling loop in status 'run'.
+
+        Process deletion requests, update the status of the running apps and
+        dispatch jobs as long as there are free slots (see `free_slots()`).
+
+        Returns
+        -------
+        bool
+            True in case the engine is busy (so no job has been dispatched), False
+            otherwise.
+        """
+        # process deletion requests before anything else
+        self.check_for_jobs_to_delete()
+        self.update_apps()
+        free = self.free_slots(self.engine_status())
+        if self.preemption is not None:
+            free = self.preempt(free)
+        for _ in range(free):
+            if self.dispatch_next() is None:
+                break
+        return free <= 0
+
+    def drain_step(self):
+        """Run a single iteration of the spooling loop in status 'drain'.
+
+        Like `spool_step()`, but without dispatching any jobs (suspended ones are
+        resumed so they can finish).
+
+        Returns
+        -------
+        bool
+            True in case draining is completed, i.e. no jobs are running anymore
+            or the deadline has passed.
+        """
+        self.check_for_jobs_to_delete()
+        while self.suspended:
+            app = self.suspended.pop(0)
+            self.engine.resume(app)
+            self.queue.set_jobstatus(app.job, app.execution.state)
+        self.update_apps()
+        if not self.apps:
+            logi("Draining completed, no jobs running anymore.")
+            return True
+        if self.drain_until is not None and time.time() > self.drain_until:
+            logw("Draining deadline passed, %s jobs still running.", len(self.apps))
+            return True
+        return False
+
+    def persist_queue(self):
+        """Record the order of the queued jobs for resuming them on the next start.
+
+        The jobfiles of the queued jobs remain in the 'cur' spooling directory, their
+        names are written (in the order of the queue) to the file 'pending.json' in
+        the 'status' directory.
+
+        Returns
+        -------
+        list(str)
+            The names of the jobfiles.
+        """
+        pending = [
+            os.path.basename(job.fname)
+            for job in self.queue.queue_details()
+            if job.fname is not None
+        ]
+        fname = os.path.join(self.dirs["status"], "pending.json")
+        with open(fname, "w") as outfile:
+            json.dump({"jobfiles": pending}, outfile, indent=4)
+        logi("Recorded %s queued jobs in [%s].", len(pending), fname)
+        return pending
+
+    def pending_jobfiles(self):
+        """Get the jobfiles in the 'cur' spooling directory to be resumed.
+
+        Jobfiles missing in the queue order recorded by `persist_queue()`, i.e. the
+        ones of jobs that were running when the queue manager stopped, come first
+        (ordered by their modification time), followed by the recorded ones.
+
+        Returns
+        -------
+        list(str)
+            The names of the jobfiles (relative to the 'cur' directory).
+        """
+        curfiles = set(self.dirs["curfiles"])
+        fname = os.path.join(self.dirs["status"], "pending.json")
+        try:
+            with open(fname, "r") as infile:
+                recorded = json.load(infile)["jobfiles"]
+        except (IOError, ValueError, KeyError) as err:
+            logd("No queue order recorded in [%s]: %s", fname, err)
+            recorded = list()
+        recorded = [jobfile for jobfile in recorded if jobfile in curfiles]
+        unrecorded = sorted(
+            curfiles.difference(recorded),
+            key=lambda jobfile: os.path.getmtime(
+                os.path.join(self.dirs["cur"], jobfile)
+            ),
+        )
+        return unrecorded + recorded
+
+    def preempt(self, free):
+        """Suspend or resume apps according to the preemption policy.
+
+        If an urgent job is waiting (see `snijder.preempt.PreemptionPolicy`) and
+        there is no free slot, the running app with the lowest priority gets
+        suspended, then the urgent job is dispatched. Otherwise suspended apps are
+        resumed (before any new job is dispatched) as long as there are free slots.
+
+        Parameters
+        ----------
+        free : int
+            The number of free slots, see `free_slots()`.
+
+        Returns
+        -------
+        int
+            The number of slots remaining for dispatching jobs.
+        """
+        urgent = self.preemption.urgent_job(self.queue)
+        if urgent is None:
+            while self.suspended and free > 0:
+                app = self.suspended.pop(0)
+                self.engine.resume(app)
+                self.queue.set_jobstatus(app.job, app.execution.state)
+                free -= 1
+            return free
+        if free <= 0:
+            victim = self.preemption.victim(self.apps, urgent)
+            if victim is None:
+                return free
+            logi(
+                "Suspending job [uid:%.7s] in favor of job [uid:%.7s].",
+                victim.job["uid"],
+                urgent["uid"],
+                extra=job_fields(victim.job, self.queue.name),
+            )
+            self.engine.suspend(victim)
+            self.suspended.append(victim)
+            self.queue.set_jobstatus(victim.job, victim.execution.state)
+            free = self.free_slots(self.engine_status())
+        if free > 0 and self.dispatch_next(urgent.get_category()) is not None:
+            free -= 1
+        return free
+
+    def update_apps(self):
+        """Let the engine progress and process status changes of the apps."""
+        # TODO: gc3pie logs an 'UnrecoverableDataStagingError' in case
+        # one of the input files can't be found - can we somehow catch
+        # this (it doesn't seem to raise an exception)?
+        started = time.time()
+        self.engine.progress()
+        metrics.ENGINE_PROGRESS.observe(time.time() - started)
+        # terminated apps are removed from the list, so iterate a copy:
+        for app in list(self.apps):
+            new_state = app.status_changed()
+            if new_state is not None:
+                self.queue.set_jobstatus(app.job, new_state)
+
+            # pylint: disable-msg=no-member
+            if new_state == gc3libs.Run.State.TERMINATED:
+                self.apps.remove(app)
+                if app in self.suspended:
+                    self.suspended.remove(app)
+                app.job.mark("harvested")
+                # the time the app has been suspended doesn't count:
+                runtime = time.time() - app.dispatched - app.suspended_time
+                metrics.JOB_RUNTIME.observe(runtime, tasktype=app.job["tasktype"])
+                policy = retry.policy_for(app.job)
+                delay = policy.retry_delay(app.job, killed=app.killed)
+                trace.record_termination(app.job, runtime, delay is not None)
+                if self.memo is not None and app.job.get("exitcode") == 0:
+                    self.memo.store(app.job.get("memo_key"), app.output_dir)
+                if delay is None:
+                    app.job.move_jobfile("done")
+                    self.complete_followers(
+                        app.job, app.output_dir, runtime, app.killed
+                    )
+                else:
+                    self.queue.requeue(app.job, delay)
+            # pylint: enable-msg=no-member
+
+    def dispatch_next(self, category=None):
+        """Fetch the next job from the queue and add it to the engine.
+
+        Parameters
+        ----------
+        category : str, optional
+            Dispatch the next job of this category, see `JobQueue.next_job()`.
+
+        Returns
+        -------
+        snijder.apps.AbstractApp
+            The app created for the dispatched job, `None` if the queue is empty.
+        """
+        nextjob = self.queue.next_job(category)
+        # jobs whose results are cached don't need a slot, so keep on fetching:
+        while nextjob is not None and self.serve_memoized(nextjob):
+            nextjob = self.queue.next_job()
+        if nextjob is None:
+            return None
+        logd("Current joblist: %s", self.queue.queue)
+        metrics.DISPATCH_LATENCY.observe(time.time() - nextjob.timings["enqueued"])
+        apptype = self.apptypes[nextjob["type"]]
+        logi(
+            "Adding job (type '%s') to the gc3 engine.",
+            apptype.__name__,
+            extra=job_fields(nextjob, self.queue.name),
+        )
+        app = apptype(nextjob, self.gc3cfg["spooldir"])
+        if self.cgroups is not None:
+            app.confine(self.cgroups)
+        try:
+            self.engine.add(app)
+        except RuntimeError as err:
+            # no resource can take the job right now (e.g. too few cores free):
+            logw(
+                "Unable to place job [uid:%.7s], deferring it: %s", nextjob["uid"], err
+            )
+            if app.cgroup is not None:
+                app.cgroup.remove()
+            self.queue.remove(nextjob["uid"], update_status=False)
+            self.queue.requeue(nextjob, delay=10, retry=False)
+            return None
+        self.apps.append(app)
+        # as a new job is dispatched now, we also print out the
+        # human readable queue status:
+        self.queue.queue_details_hr()
+        return app
+
+    def serve_memoized(self, job):
+        """Complete a job using the cached results of an identical one (if any).
+
+        Parameters
+        ----------
+        job : snijder.jobs.JobDescription
+            A job that has just been selected by the queue.
+
+        Returns
+        -------
+        bool
+            True in case the job has been completed from the cache, False if it
+            needs to be run (in which case its identity is remembered as the
+            'memo_key' so the results can be cached on termination).
+        """
+        if self.memo is None:
+            return False
+        job["memo_key"] = self.memo.identity(job)
+        if job["memo_key"] is None:
+            return False
+        target = os.path.join(self.gc3cfg["spooldir"], "results_%s" % job["uid"])
+        if not self.memo.serve(job["memo_key"], target):
+            metrics.MEMO_LOOKUPS.inc(result="miss")
+            return False
+        metrics.MEMO_LOOKUPS.inc(result="hit")
+        logi(
+            "Job [uid:%.7s] is identical to a previous one, results are in [%s].",
+            job["uid"],
+            target,
+            extra=job_fields(job, self.queue.name),
+        )
+        job.mark("terminated")
+        job["exitcode"], job["signal"] = 0, 0
+        self.queue.set_jobstatus(job, "TERMINATED")
+        job.mark("harvested")
+        trace.record_termination(job, 0.0)
+        job.move_jobfile("done")
+        self.complete_followers(job, target, 0.0)
+        return True
+
+    def complete_followers(self, leader, output_dir, runtime, killed=False):
+        """Hand the results of a terminated job to the jobs attached to it.
+
+        The followers (see `snijder.queue.JobQueue`) get the exit code of the leader
+        and links to its output files in their own results directories. If the
+        leader has been killed, they are queued on their own instead.
+
+        Parameters
+        ----------
+        leader : snijder.jobs.JobDescription
+            The terminated job, run by an app or served from the result cache.
+        output_dir : str
+            The directory holding the results of the leader.
+        runtime : float
+            The runtime of the leader in seconds.
+        killed : bool, optional
+            Whether the leader has been killed, by default False.
+        """
+        uid = leader["uid"]
+        if killed:
+            self.queue.promote_followers(uid)
+            return
+        for job in self.queue.release_followers(uid):
+            target = os.path.join(self.gc3cfg["spooldir"], "results_%s" % job["uid"])
+            try:
+                link_tree(output_dir, target)
+            except (IOError, OSError) as err:
+                loge("Unable to provide the results to [uid:%.7s]: %s", job["uid"], err)
+            logi(
+                "Job [uid:%.7s] completed by the identical job [uid:%.7s].",
+                job["uid"],
+                uid,
+                extra=job_fields(job, self.queue.name),
+            )
+            job.mark("terminated")
+            job["exitcode"], job["signal"] = leader["exitcode"], leader["signal"]
+            job["status"] = leader["status"]
+            job.mark("harvested")
+            trace.record_termination(job, runtime)
+            job.move_jobfile("done")
+        self.queue.update_status()
 
     def cleanup(self):
         """Clean up the spooler, terminate jobs, store status."""
-        # TODO: store the current queue (see #516)
         logw("Queue Manager shutdown initiated.")
         logi("QM shutdown: cleaning up spooler.")
         if self.apps:
             logw("v%sv", "-" * 80)
             logw("Unfinished jobs, trying to stop them:")
-            for app in self.apps:
+            # kill_running_job() removes the app from the list, so iterate a copy:
+            for app in list(self.apps):
                 logw("Status of running job: %s", app.job["status"])
                 self.kill_running_job(app)
             logw("^%s^", "-" * 80)
@@ -491,6 +966,7 @@ class JobSpooler(object):
                 logc("Killing jobs failed, %s still running.", stats["RUNNING"])
             else:
                 logi("Successfully terminated remaining jobs, none left.")
+        self.persist_queue()
         self.check_gc3_resources(self.engine)
         logi("QM shutdown: spooler cleanup completed.")
 
@@ -498,6 +974,8 @@ class JobSpooler(object):
         """Helper method to kill a running job."""
         logw("<KILLING> [%s] %s", app.job["user"], type(app).__name__)
         app.kill()
+        if app in self.suspended:
+            self.suspended.remove(app)
         self.engine.progress()
         state = app.status_changed()
         if state != "TERMINATED":
@@ -513,8 +991,9 @@ class JobSpooler(object):
         # ## self.engine.fetch_output(app)
         # ## app.fetch_output()
         # ## self.engine.progress()
-        # remove the job from the queue:
+        # remove the job from the queue, the jobs attached to it go on their own:
         self.queue.remove(app.job["uid"])
+        self.queue.promote_followers(app.job["uid"])
         # trigger an update of the queue status:
         self.queue.update_status()
         # this is just to trigger the stats messages in debug mode:
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""Recording and replaying of job arrival traces.
+
+If recording is enabled (see `enable_recording()`), every jobfile seen by
+`snijder.jobs.process_jobfile()` and every job harvested by the spooler is written
+as a JSON dict to a trace file, one per line. Jobfile entries look like this:
+
+    {"event": "jobfile", "time": 1583312400.51, "outcome": "queued",
+     "file": "job.cfg", "uid": "8cd0d80f...", "user": "user01", "type": "hucore",
+     "tasktype": "decon", "timestamp": 1583312400.2, "infiles": [12582912]}
+
+The 'outcome' is one of 'queued', 'deletion', 'rejected', 'over_quota',
+'no_queue', 'invalid' or 'unreadable'. Deletion requests have the requested UIDs
+in 'ids', the sizes of the input files in 'infiles' are `null` if a file can't be
+found. Harvested jobs are recorded with the 'event' key set to 'terminated',
+having the keys 'uid', 'runtime', 'exitcode', 'signal' and 'retry'.
+
+A trace can be re-injected into the spooling directory of a (scratch) queue
+manager at an accelerated speed, using dummy or synthetic jobs in place of the
+real ones (see `replay()`), or be converted to a workload for `snijder.simulator`.
+
+Classes
+-------
+
+TraceRecorder()
+    Thread-safe writer for trace entries.
+"""
+
+import json
+import os
+import threading
+import time
+from hashlib import sha1
+
+from . import logi, logd, logw, JOBFILE_VER
+
+# the recorder in use, `None` meaning recording is disabled:
+RECORDER = None
+
+DUMMY_JOBFILE = """# replay of job %(uid)s
+[snijderjob]
+version = %(version)s
+username = %(user)s
+useremail = %(user)s@replay
+jobtype = dummy
+timestamp = %(timestamp).6f
+
+[hucore]
+tasktype = sleep
+executable = /bin/sleep
+"""
+
+SYNTHETIC_JOBFILE = """# replay of job %(uid)s
+[snijderjob]
+version = %(version)s
+username = %(user)s
+useremail = %(user)s@replay
+jobtype = synthetic
+timestamp = %(timestamp).6f
+
+[synthetic]
+cpu = %(cpu).3f
+"""
+
+DELETE_JOBFILE = """# replay of deletion request %(uid)s
+[snijderjob]
+version = %(version)s
+username = %(user)s
+useremail = %(user)s@replay
+jobtype = deletejobs
+timestamp = %(timestamp).6f
+
+[deletejobs]
+ids = %(ids)s
+"""
+
+
+class TraceRecorder(object):
+
+    """Writer appending trace entries as JSON-lines to a file.
+
+    Instance Attributes
+    -------------------
+    fname : str
+        The trace file.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._lock = threading.Lock()
+        self._file = open(fname, "a")
+        logi("Recording the job arrival trace to [%s].", fname)
+
+    def write(self, entry):
+        """Append an entry to the trace file.
+
+        Parameters
+        ----------
+        entry : dict
+        """
+        line = json.dumps(entry, sort_keys=True) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        """Close the trace file."""
+        with self._lock:
+            self._file.close()
+
+
+def enable_recording(fname):
+    """Start recording the arrival trace to a file.
+
+    Parameters
+    ----------
+    fname : str
+        The trace file, new entries are appended if it exists already.
+
+    Returns
+    -------
+    TraceRecorder
+    """
+    global RECORDER  # pylint: disable-msg=global-statement
+    RECORDER = TraceRecorder(fname)
+    return RECORDER
+
+
+def disable_recording():
+    """Stop recording the arrival trace."""
+    global RECORDER  # pylint: disable-msg=global-statement
+    if RECORDER is not None:
+        RECORDER.close()
+        RECORDER = None
+
+
+def input_sizes(infiles):
+    """Get the sizes of a job's input files.
+
+    Parameters
+    ----------
+    infiles : list(str)
+
+    Returns
+    -------
+    list(int)
+        The sizes in bytes, `None` for files that can't be accessed.
+    """
+    sizes = list()
+    for infile in infiles:
+        try:
+            sizes.append(os.path.getsize(infile))
+        except OSError:
+            sizes.append(None)
+    return sizes
+
+
+def record_jobfile(fname, outcome, job=None):
+    """Record a jobfile seen by `process_jobfile()` (if recording is enabled).
+
+    Parameters
+    ----------
+    fname : str
+        The name of the jobfile.
+    outcome : str
+        What happened to the jobfile, e.g. 'queued' (see the module docs).
+    job : snijder.jobs.JobDescription, optional
+        The parsed job, `None` if parsing failed.
+    """
+    recorder = RECORDER
+    if recorder is None:
+        return
+    entry = {
+        "event": "jobfile",
+        "time": time.time(),
+        "outcome": outcome,
+        "file": os.path.basename(fname),
+    }
+    if job is not None:
+        entry.update(
+            uid=job["uid"],
+            user=job["user"],
+            type=job["type"],
+            tasktype=job.get("tasktype"),
+            timestamp=job["timestamp"],
+            infiles=input_sizes(job.get("infiles", [])),
+        )
+        if job["type"] == "deletejobs":
+            entry["ids"] = job["ids"]
+    recorder.write(entry)
+
+
+def record_termination(job, runtime, retry=False):
+    """Record a job harvested by the spooler (if recording is enabled).
+
+    Parameters
+    ----------
+    job : snijder.jobs.JobDescription
+    runtime : float
+        The time from dispatching the job until it was harvested.
+    retry : bool, optional
+        Whether the job has been put back to the queue for a retry.
+    """
+    recorder = RECORDER
+    if recorder is None:
+        return
+    recorder.write(
+        {
+            "event": "terminated",
+            "time": time.time(),
+            "uid": job["uid"],
+            "runtime": runtime,
+            "exitcode": job.get("exitcode"),
+            "signal": job.get("signal"),
+            "retry": retry,
+        }
+    )
+
+
+def load_trace(fname):
+    """Read the entries of a trace file.
+
+    Parameters
+    ----------
+    fname : str
+
+    Returns
+    -------
+    list(dict)
+        The entries, sorted by time.
+    """
+    entries = list()
+    with open(fname, "r") as infile:
+        for line in infile:
+            if line.strip():
+                entries.append(json.loads(line))
+    return sorted(entries, key=lambda entry: entry["time"])
+
+
+def to_workload(entries):
+    """Convert a trace to a workload for `snijder.simulator.Simulation`.
+
+    The duration, exit code and signal of a job are taken from its first termination
+    recorded in the trace, jobs without one will get a sampled duration.
+
+    Parameters
+    ----------
+    entries : list(dict)
+
+    Returns
+    -------
+    list(dict)
+    """
+    terminations = dict()
+    for entry in entries:
+        if entry["event"] == "terminated":
+            terminations.setdefault(entry["uid"], entry)
+    workload = list()
+    for entry in entries:
+        if entry["event"] != "jobfile" or entry["outcome"] != "queued":
+            continue
+        job = {"time": entry["time"], "user": entry["user"]}
+        if entry.get("tasktype") in ["decon", "preview"]:
+            job["tasktype"] = entry["tasktype"]
+        if entry["uid"] in terminations:
+            job["duration"] = terminations[entry["uid"]]["runtime"]
+            job["exitcode"] = terminations[entry["uid"]]["exitcode"]
+            if terminations[entry["uid"]].get("signal"):
+                job["signal"] = terminations[entry["uid"]]["signal"]
+        workload.append(job)
+    return workload
+
+
+def percentile(values, fraction):
+    """Get a percentile (nearest rank) of a list of values, `None` if empty."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def write_jobfile(directory, template, values):
+    """Write a jobfile for a replayed entry into a directory.
+
+    Returns
+    -------
+    str
+        The UID the queue manager will assign to the job.
+    """
+    content = template % values
+    uid = sha1(content).hexdigest()
+    with open(os.path.join(directory, "replay_%s.cfg" % uid[:12]), "w") as jobfile:
+        jobfile.write(content)
+    return uid
+
+
+# pylint: disable-msg=too-many-arguments
+def replay(entries, spooldir, speed=1.0, timeout=600, poll=0.2, synthetic=False):
+    """Re-inject the jobfiles of a trace into a spooling directory.
+
+    Jobs are submitted as 'dummy' jobs at the (accelerated) pace of the trace,
+    keeping the users and the deletion requests (which are re-mapped to the UIDs
+    of the replayed jobs). A job is considered to be completed once its jobfile
+    shows up in the 'done' spooling directory.
+
+    Alternatively 'synthetic' jobs can be used, burning CPU for the (accelerated)
+    runtime recorded in the trace (the original input files are not used).
+
+    Parameters
+    ----------
+    entries : list(dict)
+        The trace entries, see `load_trace()`.
+    spooldir : str
+        The spooling directory of a running queue manager.
+    speed : float, optional
+        The acceleration factor, by default 1.0 (the original pace).
+    timeout : float, optional
+        The time to wait for outstanding jobs after the last submission.
+    poll : float, optional
+        The interval for checking the 'done' directory.
+    synthetic : bool, optional
+        Use synthetic jobs instead of dummy ones, by default False.
+
+    Returns
+    -------
+    dict
+        The replay report with the number of submitted, completed and deleted
+        jobs, the throughput (completed jobs per second) and latency statistics
+        (seconds from submission to completion).
+    """
+    newdir = os.path.join(spooldir, "spool", "new")
+    donedir = os.path.join(spooldir, "spool", "done")
+    arrivals = [
+        entry
+        for entry in entries
+        if entry["event"] == "jobfile" and entry["outcome"] in ["queued", "deletion"]
+    ]
+    runtimes = dict()
+    for entry in entries:
+        if entry["event"] == "terminated":
+            runtimes.setdefault(entry["uid"], entry["runtime"])
+    uidmap = dict()
+    submitted = dict()
+    completed = dict()
+    # jobs deleted while still queued don't show up in 'done', so don't wait:
+    deleted = set()
+
+    def check_done():
+        """Record the submitted jobs whose jobfiles have arrived in 'done'."""
+        now = time.time()
+        for fname in os.listdir(donedir):
+            uid = fname.split(".")[0]
+            if uid in submitted and uid not in completed:
+                completed[uid] = now
+
+    if not arrivals:
+        logw("No jobfiles to replay in the trace.")
+    started = time.time()
+    for entry in arrivals:
+        due = started + (entry["time"] - arrivals[0]["time"]) / speed
+        while time.time() < due:
+            check_done()
+            time.sleep(min(poll, max(due - time.time(), 0)))
+        values = {
+            "uid": entry["uid"],
+            "version": JOBFILE_VER,
+            "user": entry["user"],
+            "timestamp": time.time(),
+        }
+        if entry["outcome"] == "deletion":
+            ids = [uidmap.get(uid, uid) for uid in entry["ids"]]
+            deleted.update(ids)
+            values["ids"] = ", ".join(ids)
+            write_jobfile(newdir, DELETE_JOBFILE, values)
+            continue
+        if synthetic:
+            values["cpu"] = runtimes.get(entry["uid"], 0) / speed
+            uid = write_jobfile(newdir, SYNTHETIC_JOBFILE, values)
+        else:
+            uid = write_jobfile(newdir, DUMMY_JOBFILE, values)
+        uidmap[entry["uid"]] = uid
+        submitted[uid] = time.time()
+        logd("Replayed job [uid:%.7s] as [uid:%.7s].", entry["uid"], uid)
+
+    deadline = time.time() + timeout
+    while set(submitted) - set(completed) - deleted and time.time() < deadline:
+        check_done()
+        time.sleep(poll)
+    check_done()
+    elapsed = max(completed.values()) - started if completed else 0.0
+
+    latencies = [completed[uid] - submitted[uid] for uid in completed]
+    return {
+        "speed": speed,
+        "submitted": len(submitted),
+        "completed": len(completed),
+        "deleted": len(deleted.intersection(submitted).difference(completed)),
+        "elapsed": elapsed,
+        "throughput": len(completed) / elapsed if elapsed else 0.0,
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_max": max(latencies) if latencies else None,
+    }
+
+
+def format_replay_report(report):
+    """Format a replay report as a human readable text.
+
+    Parameters
+    ----------
+    report : dict
+        A report as returned by `replay()`.
+
+    Returns
+    -------
+    str
+    """
+    lines = [
+        "replay at %(speed)sx: %(completed)s of %(submitted)s jobs completed "
+        "(%(deleted)s deleted)" % report,
+        "  elapsed:      %10.1f s" % report["elapsed"],
+        "  throughput:   %10.3f jobs/s" % report["throughput"],
+    ]
+    for key in ["latency_mean", "latency_p50", "latency_p95", "latency_max"]:
+        if report[key] is not None:
+            label = key.replace("_", " ") + ":"
+            lines.append("  %-13s %10.2f s" % (label, report[key]))
+    return "\n".join(lines)
@@ -209,6 +209,13 @@ def jobfile_valid_sleep():
     return file_path
 
 
+@pytest.fixture(scope="module")
+def jobfile_valid_synthetic():
+    """A valid jobfile for a synthetic workload job for `user01`."""
+    file_path = jobfile_path("synthetic_user01.cfg")
+    return file_path
+
+
 @pytest.fixture(scope="module")
 def jobfile_valid_delete():
     """A valid jobfile for a deletejobs job."""
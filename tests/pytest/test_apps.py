@@ -4,8 +4,16 @@
 
 from __future__ import print_function
 
+import os
+import subprocess
+import sys
+
 import snijder.apps
+import snijder.apps.dummy
 import snijder.apps.hucore
+import snijder.apps.synthetic
+import snijder.jobs
+import snijder.retry
 
 import pytest  # pylint: disable-msg=unused-import
 
@@ -34,3 +42,75 @@ def test_hucoreapp_constructor():
     """
     with pytest.raises(TypeError, match="Not instantiating the virtual class"):
         snijder.apps.hucore.HuCoreApp(job=None, output_dir="")
+
+
+def test_record_exitcode(tmp_path):
+    """Test wrapping a command for recording its exit code."""
+    wrapped = snijder.apps.record_exitcode(["/bin/sleep", "1.6"])
+    assert wrapped[:2] == ["/bin/sh", "-c"]
+    assert snijder.apps.EXITCODE_FILE in wrapped[2]
+    assert wrapped[-2:] == ["/bin/sleep", "1.6"]
+
+    exitcode = tmp_path / snijder.apps.EXITCODE_FILE
+    wrapped = snijder.apps.record_exitcode(["/bin/sh", "-c", "exit 165"])
+    assert subprocess.call(wrapped, cwd=str(tmp_path)) == 165
+    assert exitcode.read_text() == u"165\n"
+    # a command killed by a signal is reported as 128 + signum by the shell:
+    wrapped = snijder.apps.record_exitcode(["/bin/sh", "-c", "kill -9 $$"])
+    assert subprocess.call(wrapped, cwd=str(tmp_path)) == 137
+    assert exitcode.read_text() == u"137\n"
+
+
+def test_read_exitcode(tmp_path, jobfile_valid_decon_user01):
+    """Test reading the exit code of a job and deciding on a retry."""
+    job = snijder.jobs.JobDescription(jobfile_valid_decon_user01, "file")
+    app = snijder.apps.dummy.DummySleepApp(job, str(tmp_path))
+    os.makedirs(app.output_dir)
+    exitcode = os.path.join(app.output_dir, snijder.apps.EXITCODE_FILE)
+    with open(exitcode, "w") as outfile:
+        outfile.write("165\n")
+    assert app.read_exitcode() == (165, 0)
+
+    # the template couldn't be parsed, so the job is never retried:
+    job["exitcode"], job["signal"] = app.read_exitcode()
+    assert snijder.retry.policy_for(job).retry_delay(job) is None
+
+    # whereas a job killed by the OOM killer is:
+    with open(exitcode, "w") as outfile:
+        outfile.write("137\n")
+    job["exitcode"], job["signal"] = app.read_exitcode()
+    assert snijder.retry.policy_for(job).retry_delay(job) == 60
+
+
+def test_synthetic_app(jobfile_valid_synthetic):
+    """Test setting up a synthetic workload app."""
+    job = snijder.jobs.JobDescription(jobfile_valid_synthetic, "file")
+    app = snijder.apps.synthetic.SyntheticApp(job, "/tmp/gc3")
+    assert snijder.apps.synthetic.WORKER in app.inputs
+    assert "synthetic_worker.py" in app.arguments
+    assert "python" in app.arguments
+    assert app.arguments[-1] == "faba128.h5"
+    assert app.requested_cores == 2
+    assert app.output_dir == "/tmp/gc3/results_%s" % job["uid"]
+
+
+def test_synthetic_worker(tmp_path):
+    """Test running the synthetic worker script with a small load."""
+    infile = tmp_path / "input.bin"
+    infile.write_bytes(b"x" * 1024)
+    command = [
+        sys.executable,
+        snijder.apps.synthetic.WORKER,
+        "--cpu=0.2",
+        "--threads=2",
+        "--footprint=4",
+        "--read=0.01",
+        "--write=1",
+        "--output=0.5",
+        "--outdir=%s" % (tmp_path / "output"),
+        str(infile),
+    ]
+    output = subprocess.check_output(command, cwd=str(tmp_path))
+    assert b"synthetic load done" in output
+    assert (tmp_path / "output" / "result.bin").stat().st_size == 512 * 1024
+    assert not (tmp_path / "synthetic-scratch.bin").exists()
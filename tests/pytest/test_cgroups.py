@@ -0,0 +1,89 @@
+"""Tests for the snijder.cgroups module."""
+
+# pylint: disable-msg=invalid-name
+
+from __future__ import print_function
+
+import os
+
+import snijder.cgroups
+import snijder.logger
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+def prepare_fake_cgroup(basedir, controllers="cpu memory io pids", procs=u""):
+    """Helper function to set up a directory mimicking a delegated cgroup.
+
+    Parameters
+    ----------
+    basedir : Pathlib
+        The directory to use as the (fake) cgroup.
+    controllers : str, optional
+        The content of the 'cgroup.controllers' file.
+    procs : str, optional
+        The content of the 'cgroup.procs' file.
+
+    Returns
+    -------
+    str
+        The path to the fake cgroup.
+    """
+    (basedir / "cgroup.controllers").write_text(u"%s\n" % controllers)
+    (basedir / "cgroup.subtree_control").write_text(u"")
+    (basedir / "cgroup.procs").write_text(procs)
+    return str(basedir)
+
+
+def test_cgroup_manager_unavailable(caplog, tmp_path):
+    """Test the fallback if the given directory is not a cgroup."""
+    manager = snijder.cgroups.CgroupManager(str(tmp_path))
+    assert not manager.available
+    assert "cgroup enforcement disabled" in caplog.text
+    assert manager.create("some_uid") is None
+
+
+def test_cgroup_manager_no_controllers(caplog, tmp_path):
+    """Test the fallback if none of the required controllers is available."""
+    base = prepare_fake_cgroup(tmp_path, controllers="pids")
+    manager = snijder.cgroups.CgroupManager(base)
+    assert not manager.available
+    assert "none of" in caplog.text
+
+
+def test_cgroup_manager_setup(caplog, tmp_path):
+    """Test preparing a (fake) delegated cgroup with processes in it."""
+    base = prepare_fake_cgroup(tmp_path, controllers="cpu memory", procs=u"1234\n")
+    manager = snijder.cgroups.CgroupManager(base)
+    assert manager.available
+    assert manager.controllers == ["cpu", "memory"]
+    assert "Using cgroup" in caplog.text
+    subtree = (tmp_path / "cgroup.subtree_control").read_text()
+    assert subtree == "+cpu +memory"
+    leaf_procs = (tmp_path / "snijder-spooler" / "cgroup.procs").read_text()
+    assert leaf_procs == str(os.getpid())
+
+
+def test_job_cgroup_limits(tmp_path):
+    """Test the limits written when creating a job cgroup."""
+    base = prepare_fake_cgroup(tmp_path)
+    manager = snijder.cgroups.CgroupManager(base)
+    cgroup = manager.create("abcdef0123", cores=2, memory=512 * 1024 * 1024)
+    assert cgroup is not None
+    path = tmp_path / "job-abcdef0123"
+    assert cgroup.path == str(path)
+    assert (path / "cpu.max").read_text() == "200000 100000"
+    assert (path / "memory.max").read_text() == "536870912"
+    assert (path / "io.weight").read_text() == "default 200"
+
+    cgroup = manager.create("unlimited_memory")
+    assert (tmp_path / "job-unlimited_memory" / "memory.max").read_text() == "max"
+
+
+def test_job_cgroup_wrap():
+    """Test wrapping a command for launching it inside the cgroup."""
+    cgroup = snijder.cgroups.JobCgroup("/sys/fs/cgroup/snijder/job-x", ["cpu"])
+    wrapped = cgroup.wrap(["/bin/sleep", "1.6"])
+    assert wrapped[0] == "/bin/sh"
+    assert wrapped[3] == "/sys/fs/cgroup/snijder/job-x/cgroup.procs"
+    assert wrapped[-2:] == ["/bin/sleep", "1.6"]
@@ -0,0 +1,135 @@
+"""Tests for the snijder.control module."""
+
+# pylint: disable-msg=invalid-name
+
+import os
+import threading
+import time
+
+import snijder.control
+import snijder.jobs
+import snijder.queue
+import snijder.spooler
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+class FakeSpooler(object):
+    """Minimal spooler recording the requested status changes."""
+
+    def __init__(self, dirs):
+        self.dirs = dirs
+        self.status = "run"
+        self.deadline = None
+        self.lock = threading.RLock()
+
+    def pause(self):
+        """Set the status to 'pause'."""
+        self.status = "pause"
+
+    def run(self):
+        """Set the status to 'run'."""
+        self.status = "run"
+
+    def drain(self, deadline=None):
+        """Set the status to 'drain', recording the deadline."""
+        self.status = "drain"
+        self.deadline = deadline
+
+    @staticmethod
+    def shutdown():
+        """Fail unexpectedly."""
+        raise RuntimeError("spooler is gone")
+
+
+def hold_lock(lock, locked, duration=0.3):
+    """Helper function holding a lock for a while, like a spooling iteration."""
+    with lock:
+        locked.set()
+        time.sleep(duration)
+
+
+def test_control_server(tmp_path, jobfile_valid_sleep, jobfile_valid_decon_user02):
+    """Test querying and controlling through the control socket."""
+    dirs = snijder.spooler.JobSpooler.setup_rundirs(str(tmp_path / "spool"))
+    snijder.jobs.JobDescription.spooldirs = dirs
+    spooler = FakeSpooler(dirs)
+    limits = snijder.queue.CategoryLimits(overrides={"user02": {"queued": 1}})
+    queues = {"hucore": snijder.queue.JobQueue("hucore", limits)}
+    path = str(tmp_path / "control.sock")
+    server = snijder.control.ControlServer(path, spooler, queues)
+    try:
+        response = snijder.control.request(path, {"cmd": "status"})
+        assert response == {"ok": True, "status": "run", "total": 0, "jobs": []}
+
+        sleep, decon = jobfile_valid_sleep, jobfile_valid_decon_user02
+        for fname in [sleep, sleep, decon]:
+            with open(fname, "r") as jobfile:
+                message = {"cmd": "submit", "jobfile": jobfile.read()}
+            response = snijder.control.request(path, message)
+            assert response["ok"]
+            assert response["queued"]
+            assert response["status"] == "queued"
+        # the jobfiles have been processed and moved to 'cur':
+        assert len(queues["hucore"]) == 3
+        assert len(os.listdir(dirs["cur"])) == 3
+
+        # jobs rejected by the queue are reported with the reason:
+        with open(decon, "r") as jobfile:
+            message = {"cmd": "submit", "jobfile": jobfile.read()}
+        response = snijder.control.request(path, message)
+        assert response["ok"] and not response["queued"]
+        assert response["status"] == "over_quota"
+        assert "limit of 1 queued jobs" in response["reason"]
+        message = {"cmd": "submit", "jobfile": "[snijderjob]\n"}
+        assert not snijder.control.request(path, message)["ok"]
+
+        response = snijder.control.request(path, {"cmd": "status", "user": "user01"})
+        assert response["total"] == 2
+        message = {"cmd": "status", "user": "user01", "offset": 1, "limit": 5}
+        response = snijder.control.request(path, message)
+        assert [job["username"] for job in response["jobs"]] == ["user01"]
+        response = snijder.control.request(path, {"cmd": "status", "limit": 1})
+        assert response["total"] == 3
+        assert len(response["jobs"]) == 1
+
+        response = snijder.control.request(path, {"cmd": "status", "user": "user02"})
+        uid = response["jobs"][0]["id"]
+        message = {"cmd": "delete", "ids": [uid, "zzzz"]}
+        response = snijder.control.request(path, message)
+        assert response["unknown"] == ["zzzz"]
+        assert queues["hucore"].deletion_list == set([uid])
+        assert "zzzz" in queues["hucore"].unrouted
+
+        # deleting all jobs of a user:
+        message = {"cmd": "delete", "user": "user01"}
+        response = snijder.control.request(path, message)
+        assert len(response["ids"]) == 2
+        assert queues["hucore"].deletion_list == set([uid] + response["ids"])
+        assert len(queues["hucore"].process_deletion_list()) == 3
+
+        response = snijder.control.request(path, {"cmd": "pause"})
+        assert response == {"ok": True, "status": "pause"}
+        response = snijder.control.request(path, {"cmd": "drain", "deadline": 60})
+        assert response == {"ok": True, "status": "drain"}
+        assert spooler.deadline == 60
+
+        # requests are only answered while the spooling loop isn't holding the lock:
+        locked = threading.Event()
+        spooling = threading.Thread(target=hold_lock, args=(spooler.lock, locked))
+        spooling.start()
+        locked.wait()
+        started = time.time()
+        assert snijder.control.request(path, {"cmd": "run"})["ok"]
+        assert time.time() - started >= 0.2
+        spooling.join()
+
+        assert not snijder.control.request(path, {"cmd": "reboot"})["ok"]
+        # unexpected errors are answered as well:
+        response = snijder.control.request(path, {"cmd": "shutdown"})
+        assert response == {"ok": False, "error": "spooler is gone"}
+        assert not snijder.control.request(path, ["status"])["ok"]
+    finally:
+        server.shutdown()
+        snijder.jobs.JobDescription.spooldirs = None
+    assert not os.path.exists(path)
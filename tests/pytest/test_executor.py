@@ -0,0 +1,107 @@
+"""Tests for the snijder.executor module."""
+
+# pylint: disable-msg=invalid-name
+
+import os
+import time
+
+from gc3libs.quantity import seconds
+
+import snijder.apps.dummy
+import snijder.executor
+import snijder.jobs
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+def wait_for_termination(engine, app, timeout=10):
+    """Helper function letting the engine progress until the app has terminated."""
+    deadline = time.time() + timeout
+    while app.execution.state != "TERMINATED" and time.time() < deadline:
+        engine.progress()
+        time.sleep(0.05)
+    return app.execution.state
+
+
+def test_local_engine_run(tmp_path, jobfile_valid_sleep):
+    """Test running a dummy job as a local subprocess until it terminates."""
+    job = snijder.jobs.JobDescription(jobfile_valid_sleep, "file")
+    app = snijder.apps.dummy.DummySleepApp(job, str(tmp_path))
+    engine = snijder.executor.LocalEngine()
+    engine.add(app)
+    assert engine.counts()["NEW"] == 1
+
+    engine.progress()
+    assert app.execution.state == "RUNNING"
+    assert engine.counts()["RUNNING"] == 1
+    assert engine.get_resources() == []
+
+    assert wait_for_termination(engine, app) == "TERMINATED"
+    assert app.execution.exitcode == 0
+    assert app.execution.signal == 0
+    assert app.execution.duration.amount(seconds) >= 1.6
+    assert engine.counts()["TERMINATED"] == 1
+    assert engine.counts()["total"] == 1
+    assert os.path.exists(os.path.join(app.output_dir, "stdout.txt"))
+    # the exit code recording wrapper works as with the gc3 engine:
+    assert app.read_exitcode() == (0, 0)
+
+
+def test_local_engine_kill(tmp_path, jobfile_valid_sleep):
+    """Test killing a job running as a local subprocess."""
+    job = snijder.jobs.JobDescription(jobfile_valid_sleep, "file")
+    app = snijder.apps.dummy.DummySleepApp(job, str(tmp_path))
+    engine = snijder.executor.LocalEngine(grace=1)
+    engine.add(app)
+    engine.progress()
+    assert app.execution.state == "RUNNING"
+
+    started = time.time()
+    app.kill()
+    # killing is blocking, the app is expected to be terminated right away:
+    assert app.execution.state == "TERMINATED"
+    assert time.time() - started < 1.6
+    assert app.killed
+    assert app.execution.signal == 15
+    assert app.execution.exitcode is None
+    assert engine.procs == {}
+
+
+def test_staged_inputs():
+    """Test the mapping of the input files to their names in the working dir."""
+
+    class FakeApp(object):  # pylint: disable-msg=too-few-public-methods
+        """Minimal app providing a list of inputs."""
+
+        inputs = ["/data/image.h5", "/templates/decon.hgsb"]
+
+    assert snijder.executor.staged_inputs(FakeApp()) == [
+        ("/data/image.h5", "image.h5"),
+        ("/templates/decon.hgsb", "decon.hgsb"),
+    ]
+
+
+def test_local_engine_suspend(tmp_path, jobfile_valid_sleep):
+    """Test suspending and resuming a job running as a local subprocess."""
+    job = snijder.jobs.JobDescription(jobfile_valid_sleep, "file")
+    app = snijder.apps.dummy.DummySleepApp(job, str(tmp_path))
+    engine = snijder.executor.LocalEngine()
+    engine.add(app)
+    engine.progress()
+
+    engine.suspend(app)
+    assert app.execution.state == "STOPPED"
+    assert engine.counts()["STOPPED"] == 1
+    time.sleep(1)
+    engine.progress()
+    assert app.execution.state == "STOPPED"
+    engine.resume(app)
+    assert app.execution.state == "RUNNING"
+    assert app.suspended_at is None
+    assert app.suspended_time >= 1
+
+    assert wait_for_termination(engine, app) == "TERMINATED"
+    assert app.execution.exitcode == 0
+    # the suspended time is not part of the duration:
+    duration = app.execution.duration.amount(seconds)
+    assert duration < time.time() - app.execution.started - 0.9
@@ -0,0 +1,74 @@
+"""Tests for the snijder.feed module."""
+
+# pylint: disable-msg=invalid-name
+
+import os
+
+import snijder.feed
+import snijder.jobs
+import snijder.queue
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+def test_queue_feed(tmp_path, jobfile_valid_decon_user01):
+    """Test publishing the changes of a queue's jobs and reading them back."""
+    fname = str(tmp_path / "feed.json")
+    queue = snijder.queue.JobQueue("hucore")
+    queue.feed = snijder.feed.ChangeFeed(fname)
+    jobs = [snijder.jobs.JobDescription(jobfile_valid_decon_user01, "file")]
+    jobs.append(snijder.jobs.JobDescription(jobfile_valid_decon_user01, "file"))
+    for job in jobs:
+        queue.append(job)
+    queue.next_job()
+    queue.set_jobstatus(jobs[0], "RUNNING")
+    queue.remove(jobs[1]["uid"])
+
+    entries = snijder.feed.read_feed(fname)
+    assert [entry["seq"] for entry in entries] == range(1, 8)
+    events = [(entry["event"], entry["uid"], entry["status"]) for entry in entries]
+    assert events == [
+        ("enqueued", jobs[0]["uid"], "N/A"),
+        ("status", jobs[0]["uid"], "queued"),
+        ("enqueued", jobs[1]["uid"], "N/A"),
+        ("status", jobs[1]["uid"], "queued"),
+        ("dispatched", jobs[0]["uid"], "queued"),
+        ("status", jobs[0]["uid"], "RUNNING"),
+        ("removed", jobs[1]["uid"], "queued"),
+    ]
+    assert entries[-1]["queue"] == "hucore"
+
+    # a consumer only gets the entries following the ones it has processed:
+    assert [entry["seq"] for entry in snijder.feed.read_feed(fname, 5)] == [6, 7]
+    assert snijder.feed.read_feed(fname, 7) == []
+
+    # the sequence numbers keep increasing when the feed is re-opened:
+    queue.feed.close()
+    queue.feed = snijder.feed.ChangeFeed(fname)
+    queue.set_jobstatus(jobs[0], "TERMINATED")
+    assert [entry["seq"] for entry in snijder.feed.read_feed(fname, 7)] == [8, 9]
+    queue.feed.close()
+
+
+def test_feed_rotation(tmp_path, jobfile_valid_decon_user01):
+    """Test rotating the feed file and reading across the rotated files."""
+    fname = str(tmp_path / "feed.json")
+    feed = snijder.feed.ChangeFeed(fname, max_bytes=1000, backups=2)
+    job = snijder.jobs.JobDescription(jobfile_valid_decon_user01, "file")
+    for _ in range(30):
+        feed.publish("status", job)
+    assert os.path.exists(fname + ".1")
+    assert os.path.exists(fname + ".2")
+    assert not os.path.exists(fname + ".3")
+
+    # the oldest entries have been rotated away, the remaining ones are complete:
+    seqs = [entry["seq"] for entry in snijder.feed.read_feed(fname)]
+    assert seqs[0] > 1
+    assert seqs == range(seqs[0], 31)
+    assert [entry["seq"] for entry in snijder.feed.read_feed(fname, 28)] == [29, 30]
+
+    # after a rotation the sequence number is taken from the rotated file:
+    while os.path.getsize(fname) > 0:
+        feed.publish("status", job)
+    feed.close()
+    assert snijder.feed.ChangeFeed(fname).seq == feed.seq
@@ -8,7 +8,9 @@ import os
 import glob
 import pprint
 
+import snijder.feed
 import snijder.jobs
+import snijder.queue
 import snijder.logger
 import snijder.spooler
 
@@ -48,6 +50,27 @@ def test_select_queue_for_job(caplog, jobfile_valid_sleep):
     assert "Selected queue does not exist" in caplog.text
 
 
+def test_process_jobfile_over_quota(caplog, tmp_path, jobfile_valid_sleep):
+    """Test rejecting a jobfile as its category exceeds the queue limits."""
+    prepare_logging(caplog)
+    limits = snijder.queue.CategoryLimits(queued=0)
+    queues = {"hucore": snijder.queue.JobQueue("hucore", limits)}
+    feed = str(tmp_path / "feed.json")
+    queues["hucore"].feed = snijder.feed.ChangeFeed(feed)
+    job = snijder.jobs.process_jobfile(jobfile_valid_sleep, queues)
+    assert "Rejecting the job" in caplog.text
+    assert "limit of 0 queued jobs" in caplog.text
+    assert job["status"] == "over_quota"
+    assert "limit of 0 queued jobs" in job["rejection"]
+    # the rejection is published to the feed, too:
+    queues["hucore"].feed.close()
+    entries = snijder.feed.read_feed(feed)
+    assert [entry["event"] for entry in entries] == ["rejected"]
+    assert entries[0]["status"] == "over_quota"
+    assert entries[0]["reason"] == job["rejection"]
+    assert len(queues["hucore"]) == 0
+
+
 def test_snijder_job_config_parser(caplog):
     """Test the SnijderJobConfigParser constructor."""
     prepare_logging(caplog)
@@ -257,6 +280,19 @@ def test_job_description__move_jobfile(caplog, tmp_path, jobcfg_valid_delete):
     assert "/cur/" in caplog.text
     assert "Adding suffix to prevent overwriting file" in caplog.text
 
+    # moving it to where it is already (e.g. when resuming a job) does nothing:
+    fname = os.path.join(spooldirs["cur"], job["uid"] + ".jobfile")
+    os.remove(fname)
+    job.move_jobfile("cur")
+    assert job.fname == fname
+    caplog.clear()
+    fname = job.fname
+    job.move_jobfile("cur")
+    assert "is in place already" in caplog.text
+    assert "Moved job file" not in caplog.text
+    assert job.fname == fname
+    assert os.path.exists(fname)
+
 
 def test_abstract_job_config_parser(caplog, jobcfg_valid_delete):
     """Test the AbstractJobConfigParser class."""
@@ -267,3 +303,86 @@ def test_abstract_job_config_parser(caplog, jobcfg_valid_delete):
         snijder.jobs.AbstractJobConfigParser(jobcfg_valid_delete, srctype="string")
     assert "Read job configuration file / string." in caplog.text
     assert "Job description sections" in caplog.text
+
+
+def test_job_description_resources(caplog, jobcfg_valid_delete):
+    """Test parsing the optional resource requests of a job configuration."""
+    prepare_logging(caplog)
+
+    job = snijder.jobs.JobDescription(jobcfg_valid_delete, srctype="string")
+    assert job["cores"] is None
+    assert job["memory"] is None
+    assert job["walltime"] is None
+    assert job["priority"] == 0
+
+    config = jobcfg_valid_delete.replace(u"[deletejobs]", u"cores = 4\n[deletejobs]")
+    config = config.replace(u"[deletejobs]", u"memory = 2048\n[deletejobs]")
+    config = config.replace(u"[deletejobs]", u"walltime = 90\n[deletejobs]")
+    config = config.replace(u"[deletejobs]", u"priority = -3\n[deletejobs]")
+    job = snijder.jobs.JobDescription(config, srctype="string")
+    assert job["cores"] == 4
+    assert job["memory"] == 2048
+    assert job["walltime"] == 90
+    assert job["priority"] == -3
+
+    config = jobcfg_valid_delete.replace(u"[deletejobs]", u"cores = 0\n[deletejobs]")
+    with pytest.raises(ValueError, match="Invalid value for 'cores'"):
+        snijder.jobs.JobDescription(config, srctype="string")
+
+    config = jobcfg_valid_delete.replace(u"[deletejobs]", u"priority = x\n[deletejobs]")
+    with pytest.raises(ValueError, match="Invalid value for 'priority'"):
+        snijder.jobs.JobDescription(config, srctype="string")
+
+
+def test_job_description_phases(caplog, jobfile_valid_decon_user01):
+    """Test recording the lifecycle phases of a job."""
+    prepare_logging(caplog)
+
+    job = snijder.jobs.JobDescription(jobfile_valid_decon_user01, "file")
+    assert sorted(job.timings.keys()) == ["created", "parsed"]
+    assert job.last_phase() == "parsed"
+
+    job.mark("enqueued", job.timings["parsed"] + 1)
+    job.mark("selected", job.timings["parsed"] + 4)
+    durations = job.phase_durations()
+    assert durations["enqueued"] == 1
+    assert durations["selected"] == 3
+    assert "created" not in durations
+
+    # marking an earlier phase again discards the later ones:
+    job.mark("enqueued")
+    assert job.last_phase() == "enqueued"
+    assert "selected" not in job.phase_durations()
+
+
+def test_job_description_synthetic(caplog, jobfile_valid_synthetic):
+    """Test parsing a synthetic workload job configuration."""
+    prepare_logging(caplog)
+
+    job = snijder.jobs.JobDescription(jobfile_valid_synthetic, "file")
+    assert job["type"] == "synthetic"
+    assert job["tasktype"] == "synthetic"
+    assert job["cpu"] == 5.0
+    assert job["threads"] == 2
+    assert job["footprint"] == 256.0
+    assert job["infiles"] == ["resources/sample_data/hucore/faba128.h5"]
+    assert snijder.jobs.select_queue_for_job(job) == "hucore"
+
+    with open(jobfile_valid_synthetic, "r") as jobfile:
+        config = jobfile.read()
+    # all options of the 'synthetic' section are optional:
+    minimal = config.split("[synthetic]")[0] + "[synthetic]\n"
+    job = snijder.jobs.JobDescription(minimal, "string")
+    assert job["cpu"] == 1.0
+    assert job["threads"] == 1
+    assert job["output"] == 0.0
+    assert job["infiles"] == []
+
+    with pytest.raises(ValueError, match="Negative value for 'write'"):
+        snijder.jobs.JobDescription(minimal + "write = -1\n", "string")
+    with pytest.raises(ValueError, match="unknown options"):
+        snijder.jobs.JobDescription(minimal + "gpu = 1\n", "string")
+    # the inputs are staged into the same directory, so their names must differ:
+    inputs = "\n[inputfiles]\nfile1 = /data/a/image.h5\nfile2 = /data/b/image.h5\n"
+    with pytest.raises(ValueError, match="Duplicate input file name: image.h5"):
+        snijder.jobs.JobDescription(minimal + inputs, "string")
@@ -0,0 +1,95 @@
+"""Tests for the snijder.loadgen module."""
+
+# pylint: disable-msg=invalid-name
+
+from __future__ import print_function
+
+import json
+import os
+import threading
+import time
+from hashlib import sha1
+
+import snijder.jobs
+import snijder.loadgen
+import snijder.spooler
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+def fake_status_writer(spooldirs, stop):
+    """Helper function mimicking a queue manager listing all new jobs in its status.
+
+    Every jobfile found in the 'new' spooling directory is removed and its UID is
+    added to the 'hucore.json' status file, until `stop` is set.
+    """
+    uids = list()
+    while not stop.is_set():
+        for fname in os.listdir(spooldirs["new"]):
+            src = os.path.join(spooldirs["new"], fname)
+            with open(src, "r") as jobfile:
+                content = jobfile.read()
+            # jobfiles are renamed into place once they have been written:
+            assert content
+            os.remove(src)
+            if "deletejobs" not in content:
+                uids.append(sha1(content).hexdigest())
+        with open(os.path.join(spooldirs["status"], "hucore.json"), "w") as status:
+            json.dump({"jobs": [{"id": uid} for uid in uids]}, status)
+        time.sleep(0.01)
+
+
+def test_zipf_weights():
+    """Test the weights of the Zipf distribution."""
+    weights = snijder.loadgen.zipf_weights(4)
+    assert abs(sum(weights) - 1.0) < 1e-9
+    assert weights[0] == 2 * weights[1]
+    assert snijder.loadgen.zipf_weights(3, exponent=0) == [1 / 3.0] * 3
+
+
+def test_parse_mix():
+    """Test parsing the tasktype mix."""
+    mix = snijder.loadgen.parse_mix("decon=3, preview=1")
+    assert mix == {"decon": 0.75, "preview": 0.25}
+    assert snijder.loadgen.parse_mix("sleep") == {"sleep": 1.0}
+    with pytest.raises(ValueError):
+        snijder.loadgen.parse_mix("fft=1")
+
+
+def test_generated_jobfiles_are_valid(tmp_path):
+    """Test that the generated jobfiles can be parsed."""
+    generator = snijder.loadgen.LoadGenerator(str(tmp_path))
+    for tasktype in ["decon", "preview", "sleep"]:
+        job = snijder.jobs.JobDescription(
+            generator.jobfile("loaduser000", tasktype), "string"
+        )
+        assert job["tasktype"] == tasktype
+        assert job["user"] == "loaduser000"
+    job = snijder.jobs.JobDescription(
+        generator.deletion("loaduser000", ["abc", "def"]), "string"
+    )
+    assert job["ids"] == ["abc", "def"]
+
+
+def test_load_generator_run(tmp_path):
+    """Test submitting jobs and measuring when they appear in the status."""
+    spooldirs = snijder.spooler.JobSpooler.setup_rundirs(str(tmp_path))
+    generator = snijder.loadgen.LoadGenerator(
+        str(tmp_path), rate=200, burst=5, users=3, deletions=0.2, seed=1
+    )
+    stop = threading.Event()
+    worker = threading.Thread(target=fake_status_writer, args=(spooldirs, stop))
+    worker.start()
+    try:
+        report = generator.run(20, timeout=5, poll=0.01)
+    finally:
+        stop.set()
+        worker.join()
+    assert report["submitted"] == 20
+    assert report["deleted"] > 0
+    assert report["seen"] == 20
+    assert report["missed"] == 0
+    assert report["latency_max"] < 5
+    assert "20 jobs submitted" in snijder.loadgen.format_report(report)
+    # no temporary jobfiles are left behind:
+    assert sorted(os.listdir(str(tmp_path / "spool"))) == ["cur", "done", "new"]
@@ -2,6 +2,7 @@
 
 from __future__ import print_function
 
+import json
 import logging
 
 import snijder.logger
@@ -30,3 +31,68 @@ def test_set_gc3loglevel():
 
     snijder.logger.set_gc3loglevel("debug")
     assert gc3libs.log.level == logging.DEBUG
+
+
+def test_json_formatter():
+    """Test the JSON-lines formatter including the structured job fields."""
+    job = {"uid": "u000_aaa", "user": "u000", "status": "queued"}
+    record = logging.LogRecord(
+        "snijder", logging.INFO, __file__, 1, "job %s", ("x",), None
+    )
+    record.__dict__.update(snijder.logger.job_fields(job, "hucore"))
+    entry = json.loads(snijder.logger.JsonFormatter().format(record))
+    assert entry["message"] == "job x"
+    assert entry["level"] == "INFO"
+    assert entry["uid"] == "u000_aaa"
+    assert entry["user"] == "u000"
+    assert entry["queue"] == "hucore"
+    assert entry["state"] == "queued"
+
+
+def test_structured_logging(tmp_path):
+    """Test logging through the background writer into a JSON-lines file."""
+    logfile = tmp_path / "snijder.log"
+    snijder.logger.set_loglevel("info")
+    writer = snijder.logger.enable_structured_logging(str(logfile))
+    try:
+        job = {"uid": "u111_ddd", "user": "u111", "status": "RUNNING"}
+        snijder.logger.logi("first %s", "message")
+        snijder.logger.logw("second", extra=snijder.logger.job_fields(job))
+    finally:
+        snijder.logger.disable_structured_logging(writer)
+    assert snijder.logger.LOG_HANDLER in logging.getLogger().handlers
+
+    entries = [json.loads(line) for line in logfile.read_text().splitlines()]
+    messages = [entry["message"] for entry in entries]
+    assert "first message" in messages
+    second = entries[messages.index("second")]
+    assert second["uid"] == "u111_ddd"
+    assert second["state"] == "RUNNING"
+    assert "queue" not in second
+
+
+def test_lazy(caplog):
+    """Test that lazy arguments are only formatted if the message is emitted."""
+    calls = list()
+
+    def expensive(value):
+        """Record the call and return the value."""
+        calls.append(value)
+        return value
+
+    snijder.logger.set_loglevel("warn")
+    assert not snijder.logger.debug_enabled()
+    snijder.logger.logd("%s", snijder.logger.lazy(expensive, "skipped"))
+    assert calls == []
+
+    snijder.logger.set_loglevel("debug")
+    assert snijder.logger.debug_enabled()
+    snijder.logger.logd("%s", snijder.logger.lazy(expensive, "formatted"))
+    assert calls == ["formatted"]
+    assert "formatted" in caplog.text
+
+    # formatting the record again (e.g. for another handler) doesn't call it again:
+    calls[:] = []
+    message = snijder.logger.lazy(expensive, "cached")
+    assert str(message) == str(message) == "cached"
+    assert calls == ["cached"]
@@ -0,0 +1,111 @@
+"""Tests for the snijder.memo module."""
+
+# pylint: disable-msg=invalid-name
+
+import os
+import time
+
+import snijder.jobs
+import snijder.memo
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+def make_job(basedir, timestamp=1583312400.5, jobtype="hucore"):
+    """Helper function creating a hucore job with a template and an input file."""
+    template, infile = basedir / "decon.hgsb", basedir / "image.h5"
+    if not template.exists():
+        template.write_text(u"setp -iterations 3\n")
+        infile.write_bytes(b"x" * 1024)
+    config = (
+        u"[snijderjob]\n"
+        u"version = 7\n"
+        u"username = user01\n"
+        u"useremail = user01@mail.xy\n"
+        u"jobtype = hucore\n"
+        u"timestamp = %s\n"
+        u"\n"
+        u"[hucore]\n"
+        u"tasktype = decon\n"
+        u"executable = /usr/local/bin/hucore\n"
+        u"template = %s\n"
+        u"\n"
+        u"[inputfiles]\n"
+        u"file1 = %s\n"
+    ) % (timestamp, template, infile)
+    job = snijder.jobs.JobDescription(config, "string")
+    job["type"] = jobtype
+    return job
+
+
+def make_results(resultdir):
+    """Helper function creating a results directory like the ones of hucore."""
+    (resultdir / "resultdir").mkdir(parents=True)
+    (resultdir / "resultdir" / "image_decon.h5").write_bytes(b"r" * 2048)
+    (resultdir / "stdout.txt").write_text(u"done\n")
+
+
+def test_job_identity(tmp_path):
+    """Test identical jobs having the same identity, regardless of the timestamp."""
+    first = make_job(tmp_path)
+    second = make_job(tmp_path, timestamp=1583316000.0)
+    assert first["uid"] != second["uid"]
+    key = snijder.memo.job_identity(first)
+    assert key == snijder.memo.job_identity(second)
+    # adding the template to the input files (as done by the app) doesn't matter:
+    second["infiles"].append(second["template"])
+    assert key == snijder.memo.job_identity(second)
+
+    # touching an input file changes the identity, unless the content is used:
+    content_key = snijder.memo.job_identity(first, content=True)
+    os.utime(first["infiles"][0], (time.time() - 60, time.time() - 60))
+    assert snijder.memo.job_identity(first) != key
+    assert snijder.memo.job_identity(first, content=True) == content_key
+    (tmp_path / "decon.hgsb").write_text(u"setp -iterations 5\n")
+    assert snijder.memo.job_identity(first, content=True) != content_key
+
+    assert snijder.memo.job_identity(make_job(tmp_path, jobtype="dummy")) is None
+    os.remove(first["infiles"][0])
+    assert snijder.memo.job_identity(first) is None
+
+
+def test_result_cache(tmp_path):
+    """Test storing, serving and evicting results."""
+    cache = snijder.memo.ResultCache(str(tmp_path / "cache"), budget=5000)
+    make_results(tmp_path / "results_a")
+    make_results(tmp_path / "results_b")
+    assert cache.lookup("aaa") is None
+    cache.store("aaa", str(tmp_path / "results_a"))
+    assert len(cache) == 1
+    assert cache.size == 2053
+
+    target = tmp_path / "results_new"
+    assert cache.serve("aaa", str(target))
+    served = target / "resultdir" / "image_decon.h5"
+    original = tmp_path / "results_a" / "resultdir" / "image_decon.h5"
+    with open(str(served), "rb") as result:
+        assert result.read() == b"r" * 2048
+    # the results are hard links, not copies:
+    assert os.stat(str(served)).st_ino == os.stat(str(original)).st_ino
+    assert not cache.serve("bbb", str(tmp_path / "results_none"))
+
+    # exceeding the budget evicts the least recently used entry:
+    cache.store("bbb", str(tmp_path / "results_b"))
+    assert len(cache) == 2
+    assert cache.lookup("aaa") is not None
+    make_results(tmp_path / "results_c")
+    cache.store("ccc", str(tmp_path / "results_c"))
+    assert sorted(cache._sizes) == ["aaa", "ccc"]  # pylint: disable-msg=W0212
+    assert cache.size == 2 * 2053
+    assert not os.path.exists(cache.path_of("bbb"))
+
+    # the entries are picked up again (in the order of their last use), leftovers
+    # of interrupted stores removed:
+    (tmp_path / "cache" / ".ddd").mkdir()
+    os.utime(cache.path_of("ccc"), (time.time() - 60, time.time() - 60))
+    cache = snijder.memo.ResultCache(str(tmp_path / "cache"), budget=3000)
+    assert len(cache) == 2
+    assert cache.size == 2 * 2053
+    assert not (tmp_path / "cache" / ".ddd").exists()
+    cache.evict()
+    assert list(cache._sizes) == ["aaa"]  # pylint: disable-msg=W0212
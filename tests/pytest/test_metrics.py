@@ -0,0 +1,76 @@
+"""Tests for the snijder.metrics module."""
+
+# pylint: disable-msg=invalid-name
+
+from __future__ import print_function
+
+import urllib2
+
+import snijder.metrics
+import snijder.queue
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+def test_counter_and_gauge():
+    """Test rendering counters and gauges."""
+    counter = snijder.metrics.Counter("test_total", "A counter.", ["user"])
+    counter.inc(user="u000")
+    counter.inc(2, user="u000")
+    counter.inc(user='u"1')
+    lines = counter.render()
+    assert lines[0] == "# HELP test_total A counter."
+    assert lines[1] == "# TYPE test_total counter"
+    assert 'test_total{user="u000"} 3' in lines
+    assert r'test_total{user="u\"1"} 1' in lines
+
+    with pytest.raises(ValueError, match="requires labels"):
+        counter.inc(queue="hucore")
+
+    gauge = snijder.metrics.Gauge("test_gauge", "A gauge.")
+    gauge.set(1.5)
+    assert "test_gauge 1.5" in gauge.render()
+    gauge.collector = lambda: {(): 7}
+    assert "test_gauge 7" in gauge.render()
+
+
+def test_histogram():
+    """Test the cumulative buckets, sum and count of a histogram."""
+    histogram = snijder.metrics.Histogram("test_seconds", "A hist.", buckets=[1, 5])
+    for value in [0.5, 2, 3, 10]:
+        histogram.observe(value)
+    lines = histogram.render()
+    assert 'test_seconds_bucket{le="1"} 1' in lines
+    assert 'test_seconds_bucket{le="5"} 3' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+    assert "test_seconds_sum 15.5" in lines
+    assert "test_seconds_count 4" in lines
+
+
+def test_watch_queues(joblist):
+    """Test the queue depth and job state collectors."""
+    queue = snijder.queue.JobQueue()
+    for job in joblist:
+        queue.append(job)
+    queue.next_job()
+    snijder.metrics.watch_queues({"hucore": queue})
+    rendered = snijder.metrics.REGISTRY.render()
+    assert 'snijder_queue_depth{queue="hucore",category="u000"} 2' in rendered
+    assert 'snijder_queue_depth{queue="hucore",category="u111"} 4' in rendered
+    assert 'snijder_jobs{queue="hucore",state="queued"} 7' in rendered
+
+
+def test_metrics_server():
+    """Test fetching the metrics through the HTTP endpoint."""
+    registry = snijder.metrics.Registry()
+    registry.register(snijder.metrics.Counter("test_total", "A counter.")).inc()
+    server = snijder.metrics.MetricsServer(0, registry=registry)
+    try:
+        url = "http://%s:%s" % server.address
+        response = urllib2.urlopen(url + "/metrics")
+        assert response.info()["Content-Type"].startswith("text/plain")
+        assert "test_total 1" in response.read()
+        with pytest.raises(urllib2.HTTPError):
+            urllib2.urlopen(url + "/other")
+    finally:
+        server.shutdown()
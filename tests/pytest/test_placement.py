@@ -0,0 +1,225 @@
+"""Tests for the snijder.placement module."""
+
+# pylint: disable-msg=invalid-name
+
+import snijder.placement
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+### FUNCTIONS ###
+
+
+class FakeExecution(object):  # pylint: disable-msg=too-few-public-methods
+    """Minimal execution state of an app."""
+
+    def __init__(self):
+        self.state = "NEW"
+        self.exitcode = None
+
+
+class FakeApp(object):  # pylint: disable-msg=too-few-public-methods
+    """Minimal app with a job UID and requested cores."""
+
+    def __init__(self, uid, cores=1):
+        self.job = {"uid": uid}
+        self.requested_cores = cores
+        self.execution = FakeExecution()
+        self.killed = False
+
+
+class FakeEngine(object):
+    """Engine recording the added apps, optionally failing on progress."""
+
+    def __init__(self, fail=False):
+        self.apps = list()
+        self.fail = fail
+
+    def add(self, app):
+        """Add an app."""
+        self.apps.append(app)
+
+    def progress(self):
+        """Fail if requested."""
+        if self.fail:
+            raise RuntimeError("engine failure")
+
+    def counts(self):
+        """Count the running apps."""
+        return {"RUNNING": len(self.apps), "total": len(self.apps)}
+
+    @staticmethod
+    def get_resources():
+        """No gc3 resources."""
+        return []
+
+
+def make_pool(policy, slots=(1, 1), cores=None):
+    """Helper function setting up a pool with a resource per entry in `slots`."""
+    if cores is None:
+        cores = [1] * len(slots)
+    resources = [
+        snijder.placement.Resource("res%s" % i, FakeEngine(), slot, core)
+        for i, (slot, core) in enumerate(zip(slots, cores))
+    ]
+    return snijder.placement.ResourcePool(resources, policy, backoff=60)
+
+
+def terminate(app, exitcode=0):
+    """Helper function marking an app as terminated."""
+    app.execution.state = "TERMINATED"
+    app.execution.exitcode = exitcode
+
+
+### TESTS ###
+
+
+def test_invalid_policy():
+    """Test setting up a pool with an unknown policy."""
+    with pytest.raises(ValueError, match="Unknown placement policy"):
+        make_pool("random")
+
+
+def test_least_loaded():
+    """Test the least-loaded policy filling up the resources evenly."""
+    pool = make_pool("least-loaded", slots=(2, 4))
+    placed = list()
+    for i in range(6):
+        app = FakeApp("app%s" % i)
+        pool.add(app)
+        placed.append(pool.placement[app].name)
+    assert placed.count("res0") == 2
+    assert placed.count("res1") == 4
+    assert pool.free_slots() == 0
+    with pytest.raises(RuntimeError, match="No resource available"):
+        pool.add(FakeApp("overflow"))
+
+
+def test_round_robin():
+    """Test the round-robin policy, skipping resources without free slots."""
+    pool = make_pool("round-robin", slots=(1, 3))
+    names = list()
+    for i in range(4):
+        app = FakeApp("app%s" % i)
+        pool.add(app)
+        names.append(pool.placement[app].name)
+    assert names == ["res0", "res1", "res1", "res1"]
+
+
+def test_weighted():
+    """Test the weighted policy preferring resources with more cores."""
+    pool = make_pool("weighted", slots=(4, 4), cores=(8, 3))
+    names = list()
+    for i in range(4):
+        app = FakeApp("app%s" % i)
+        pool.add(app)
+        names.append(pool.placement[app].name)
+    # cores per job: 8 vs. 3, then 4 vs. 3, then 2.67 vs. 3, then 2.67 vs. 1.5:
+    assert names == ["res0", "res0", "res1", "res0"]
+
+
+def test_requested_cores():
+    """Test jobs never being placed on resources having less cores than needed."""
+    pool = make_pool("least-loaded", slots=(1, 1), cores=(2, 8))
+    big = FakeApp("big", cores=4)
+    pool.add(big)
+    assert pool.placement[big].name == "res1"
+    with pytest.raises(RuntimeError, match="No resource available"):
+        pool.add(FakeApp("bigger", cores=4))
+
+
+def test_slots_freed_and_health():
+    """Test terminated apps freeing their slots and unhealthy resources."""
+    pool = make_pool("least-loaded")
+    first, second = FakeApp("first"), FakeApp("second")
+    pool.add(first)
+    pool.add(second)
+    assert pool.free_slots() == 0
+
+    terminate(first)
+    # the second one got lost (no exit code), so its resource is excluded:
+    terminate(second, exitcode=None)
+    pool.progress()
+    assert pool.free_slots() == 1
+    assert pool.placement == {}
+    lost = pool.resources[1]
+    assert lost.failures == 1
+    assert not lost.healthy()
+    assert pool.candidates(FakeApp("next")) == [pool.resources[0]]
+
+    lost.succeeded()
+    assert lost.healthy()
+    pool.resources[0].engine.fail = True
+    pool.progress()
+    assert not pool.resources[0].healthy()
+    counts = pool.counts()
+    assert counts["RUNNING"] == 2
+    assert counts["total"] == 2
+    # states none of the engines reports are included as well:
+    assert counts["NEW"] == 0
+    assert counts["TERMINATED"] == 0
+
+
+def test_select_resource():
+    """Test restricting the pool to a single resource."""
+    pool = make_pool("least-loaded", slots=(1, 1, 1))
+    pool.select_resource("res2")
+    assert [res.name for res in pool.resources] == ["res2"]
+    pool.select_resource("nonexisting")
+    assert [res.name for res in pool.resources] == ["res2"]
+
+
+def test_load_affinity(tmp_path):
+    """Test reading an affinity map."""
+    affinity = tmp_path / "affinity.ini"
+    affinity.write_text(u"[affinity]\n/mnt/Storage1/ = res0, res1\n/mnt/s2 = res2\n")
+    assert snijder.placement.load_affinity(str(affinity)) == {
+        "/mnt/Storage1": set(["res0", "res1"]),
+        "/mnt/s2": set(["res2"]),
+    }
+    with pytest.raises(IOError, match="Unable to read affinity map"):
+        snijder.placement.load_affinity(str(tmp_path / "nonexisting.ini"))
+
+
+def test_mount_of():
+    """Test finding the mount point of a path."""
+    mounts = ["/mnt/data", "/mnt/data/fast", "/mnt/database"]
+    assert snijder.placement.mount_of("/mnt/data/x.h5", mounts) == "/mnt/data"
+    assert snijder.placement.mount_of("/mnt/data/fast/x.h5", mounts) == (
+        "/mnt/data/fast"
+    )
+    assert snijder.placement.mount_of("/mnt/database/x.h5", mounts) == (
+        "/mnt/database"
+    )
+    assert snijder.placement.mount_of("/home/x.h5", mounts) is None
+
+
+def test_data_locality(tmp_path):
+    """Test preferring resources with local access to the input files."""
+    storage1, storage2 = tmp_path / "storage1", tmp_path / "storage2"
+    storage1.mkdir()
+    storage2.mkdir()
+    big, small = storage1 / "big.h5", storage2 / "small.h5"
+    big.write_bytes(b"x" * 4096)
+    small.write_bytes(b"x" * 1024)
+    pool = make_pool("least-loaded", slots=(1, 1, 1))
+    pool.affinity = {str(storage1): set(["res1"]), str(storage2): set(["res2"])}
+    assert pool.transfers([str(big), str(small)]) == {
+        "res0": 5120,
+        "res1": 1024,
+        "res2": 4096,
+    }
+
+    first = FakeApp("first")
+    first.job["infiles"] = [str(big), str(small)]
+    pool.add(first)
+    assert pool.placement[first].name == "res1"
+    # the local resource is saturated now, so fall back to the next best one:
+    second = FakeApp("second")
+    second.job["infiles"] = [str(big)]
+    pool.add(second)
+    assert pool.placement[second].name == "res0"
+    # jobs without input files are placed according to the policy only:
+    third = FakeApp("third")
+    pool.add(third)
+    assert pool.placement[third].name == "res2"
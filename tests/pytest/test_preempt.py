@@ -0,0 +1,61 @@
+"""Tests for the snijder.preempt module."""
+
+# pylint: disable-msg=invalid-name
+
+import time
+
+import snijder.preempt
+import snijder.queue
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+class FakeExecution(object):  # pylint: disable-msg=too-few-public-methods
+    """Minimal execution state of an app."""
+
+    def __init__(self, state):
+        self.state = state
+
+
+class FakeApp(object):  # pylint: disable-msg=too-few-public-methods
+    """Minimal app with a job priority and a dispatch time."""
+
+    def __init__(self, priority, dispatched, state="RUNNING"):
+        self.job = {"priority": priority}
+        self.dispatched = dispatched
+        self.execution = FakeExecution(state)
+
+
+def test_urgent_job(joblist):
+    """Test finding urgent jobs that have been waiting longer than the threshold."""
+    policy = snijder.preempt.PreemptionPolicy(threshold=60, priority=2)
+    queue = snijder.queue.JobQueue()
+    joblist[1]["priority"] = 2
+    joblist[4]["priority"] = 3
+    for job in joblist:
+        queue.append(job)
+    assert policy.urgent_job(queue) is None
+    now = time.time() + 61
+    assert policy.urgent_job(queue, now) is joblist[4]
+
+    # jobs waiting for a retry are not urgent:
+    queue.requeue(queue.remove(joblist[4]["uid"]), delay=3600, retry=False)
+    assert policy.urgent_job(queue, now) is joblist[1]
+    del joblist[4]["not_before"]
+    assert policy.urgent_job(snijder.queue.JobQueue(), now) is None
+    joblist[1]["priority"] = joblist[4]["priority"] = 0
+
+
+def test_victim():
+    """Test selecting the running app with the lowest priority to suspend."""
+    urgent = {"priority": 2}
+    apps = [
+        FakeApp(1, 100.0),
+        FakeApp(0, 300.0),
+        FakeApp(0, 200.0),
+        FakeApp(0, 50.0, state="STOPPED"),
+        FakeApp(5, 10.0),
+    ]
+    assert snijder.preempt.PreemptionPolicy.victim(apps, urgent) is apps[2]
+    assert snijder.preempt.PreemptionPolicy.victim(apps[3:], urgent) is None
+    assert snijder.preempt.PreemptionPolicy.victim(apps, {"priority": 0}) is None
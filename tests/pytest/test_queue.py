@@ -8,6 +8,8 @@
 
 from __future__ import print_function
 
+import os
+import time
 import logging
 import json
 
@@ -171,6 +173,47 @@ def test_job_queue_rotation(
         logging.warning("queue of [%s]: %s", cat, queue.queue[cat])
 
 
+def test_requeue(caplog, joblist):
+    """Test re-queueing a job (e.g. for a retry) with and without a delay."""
+    prepare_logging(caplog)
+
+    queue = snijder.queue.JobQueue()
+    for job in joblist[:4]:
+        queue.append(job)
+    assert queue.joblist() == ["u000_aaa", "u111_ddd", "u000_bbb", "u000_ccc"]
+
+    # a job put back without delay is the next one of its category:
+    job = queue.next_job()
+    assert job["uid"] == "u000_aaa"
+    queue.set_jobstatus(job, "TERMINATED")
+    queue.requeue(job)
+    assert "Re-queueing job" in caplog.text
+    assert job["retries"] == 1
+    assert job["status"] == "queued"
+    assert list(queue.queue["u000"]) == ["u000_aaa", "u000_bbb", "u000_ccc"]
+    with pytest.raises(ValueError, match="already in this queue"):
+        queue.requeue(job)
+
+    # a delayed job is skipped until it's due, the others of its category are not:
+    job = queue.next_job()
+    assert job["uid"] == "u111_ddd"
+    job = queue.next_job()
+    assert job["uid"] == "u000_aaa"
+    queue.set_jobstatus(job, "TERMINATED")
+    queue.requeue(job, delay=3600)
+    assert job["retries"] == 2
+    assert queue.next_job()["uid"] == "u000_bbb"
+    assert queue.next_job()["uid"] == "u000_ccc"
+    assert queue.next_job() is None
+    assert queue.first_due("u000", time.time() + 3600) == "u000_aaa"
+    assert queue.next_job()["uid"] == "u000_aaa"
+
+    # deferring a job (e.g. as it can't be placed) doesn't count as a retry:
+    job = queue.remove("u000_bbb")
+    queue.requeue(job, retry=False)
+    assert job.get("retries", 0) == 0
+
+
 def test_process_deletion_list(caplog, jobfile_valid_decon_fixedtimestamp):
     """Test the process_deletion_list() method."""
     prepare_logging(caplog)
@@ -186,9 +229,9 @@ def test_process_deletion_list(caplog, jobfile_valid_decon_fixedtimestamp):
 
     # place the job's UID on the deletion list
     assert len(queue.deletion_list) == 0
-    queue.deletion_list.append(job["uid"])
+    queue.deletion_list.add(job["uid"])
     assert len(queue.deletion_list) == 1
-    queue.process_deletion_list()
+    assert queue.process_deletion_list() == [job]
     assert len(queue.deletion_list) == 0
     assert "Received a deletion request for job" in caplog.text
     assert "Status of job to be removed: queued" in caplog.text
@@ -200,9 +243,9 @@ def test_process_deletion_list(caplog, jobfile_valid_decon_fixedtimestamp):
     # try with an unknown UID
     caplog.clear()
     assert len(queue.deletion_list) == 0
-    queue.deletion_list.append("zzzz")
+    queue.deletion_list.add("zzzz")
     assert len(queue.deletion_list) == 1
-    queue.process_deletion_list()
+    assert queue.process_deletion_list() == []
     assert len(queue.deletion_list) == 0
     assert "Received a deletion request for job" in caplog.text
     assert "Job not found, discarding the request" in caplog.text
@@ -276,6 +319,12 @@ def test_queue_details_json(
 
     details = queue.queue_details_json()
     logging.debug("JSON encoded queue details:\n%s", details)
+    assert sorted(processing_job.timings.keys()) == [
+        "created",
+        "enqueued",
+        "parsed",
+        "selected",
+    ]
 
     # now parse the JSON formatted string back into a Python object
     parsed_json = json.loads(details)
@@ -288,6 +337,7 @@ def test_queue_details_json(
     assert jobs[0]["id"] == job_fixed["uid"]
     assert jobs[0]["username"] == job_fixed["user"]
     assert jobs[0]["queued"] == job_fixed["timestamp"]
+    assert sorted(jobs[0]["phases"].keys()) == ["enqueued", "parsed", "selected"]
 
     # followed by job2
     assert jobs[1]["id"] == job2["uid"]
@@ -302,6 +352,44 @@ def test_queue_details_json(
     logging.info("Re-parsed queue details from JSON.")
 
 
+def test_write_shards(tmp_path, joblist):
+    """Test writing the per-category status files and the summary."""
+    queue = snijder.queue.JobQueue()
+    queue.statusfile = str(tmp_path / "hucore.json")
+    for job in joblist:
+        queue.append(job)
+    queue.next_job()
+    queue.update_status(force=True)
+
+    sharddir = tmp_path / "hucore"
+    assert sorted(os.listdir(str(sharddir))) == ["u000.json", "u111.json"]
+    with open(str(sharddir / "u111.json"), "r") as shard:
+        jobs = json.load(shard)["jobs"]
+    assert [job["id"] for job in jobs] == [job["uid"] for job in joblist[3:]]
+    with open(str(tmp_path / "hucore.summary.json"), "r") as summary:
+        summary = json.load(summary)
+    assert summary["running"] == 1
+    assert summary["queued"] == 6
+    assert summary["categories"]["u000"] == {
+        "running": 1,
+        "queued": 2,
+        "first": 2,
+    }
+    assert summary["categories"]["u111"]["first"] == 1
+
+    # only the status files of categories whose jobs have changed are rewritten:
+    inode = os.stat(str(sharddir / "u111.json")).st_ino
+    queue.remove("u000_bbb")
+    assert queue.dirty == set()
+    assert os.stat(str(sharddir / "u111.json")).st_ino == inode
+    with open(str(sharddir / "u000.json"), "r") as shard:
+        jobs = json.load(shard)["jobs"]
+    assert [job["id"] for job in jobs] == ["u000_aaa", "u000_ccc"]
+    for job in joblist[3:]:
+        queue.remove(job["uid"])
+    assert sorted(os.listdir(str(sharddir))) == ["u000.json"]
+
+
 def test_queue_details_hr(
     caplog, jobfile_valid_decon_user01, jobfile_valid_decon_user02
 ):
@@ -353,6 +441,7 @@ def test_joblist(joblist):
     assert len(queue) == 7
     assert list(queue.queue["u000"]) == ["u000_aaa", "u000_bbb", "u000_ccc"]
     assert list(queue.queue["u111"]) == ["u111_ddd", "u111_eee", "u111_fff", "u111_ggg"]
+    joblist[1]["priority"] = joblist[2]["priority"] = joblist[6]["priority"] = 0
 
     expected_order = [
         "u000_aaa",
@@ -434,3 +523,250 @@ def test_add_duplicate_jobs(joblist):
     queue.append(joblist[0])
     with pytest.raises(ValueError, match="\[uid:u000_aa\] already in this queue"):
         queue.append(joblist[0])
+
+
+def test_limit_running(joblist):
+    """Test categories being skipped while at their limit of running jobs."""
+    limits = snijder.queue.CategoryLimits(running=1, overrides={"u111": {"running": 2}})
+    queue = snijder.queue.JobQueue(limits=limits)
+    for job in joblist:
+        queue.append(job)
+
+    assert queue.next_job()["uid"] == "u000_aaa"
+    assert queue.parked == set(["u000"])
+    assert list(queue.categories) == ["u111"]
+    # parked categories are still part of the predicted order, but at the end:
+    assert queue.joblist() == [
+        "u111_ddd",
+        "u111_eee",
+        "u111_fff",
+        "u111_ggg",
+        "u000_bbb",
+        "u000_ccc",
+    ]
+    assert queue.next_job()["uid"] == "u111_ddd"
+    assert queue.next_job()["uid"] == "u111_eee"
+    assert queue.parked == set(["u000", "u111"])
+    assert queue.next_job() is None
+    assert queue.running == {"u000": 1, "u111": 2}
+
+    # once a job has finished, its category is served again:
+    queue.set_jobstatus(joblist[3], "TERMINATED")
+    assert queue.parked == set(["u000"])
+    assert queue.next_job()["uid"] == "u111_fff"
+    queue.set_jobstatus(joblist[0], "TERMINATED")
+    assert queue.next_job()["uid"] == "u000_bbb"
+
+    # removing the last queued job of a parked category cleans it up:
+    queue.remove("u000_ccc")
+    assert queue.parked == set(["u111"])
+    assert "u000" not in queue.queue
+    for uid in list(queue.processing) + ["u111_ggg"]:
+        queue.remove(uid)
+    assert len(queue) == 0
+    assert queue.parked == set()
+    assert queue.running == {"u000": 0, "u111": 0}
+
+
+def test_limit_quota(joblist):
+    """Test rejecting jobs exceeding the limits of queued jobs and core-hours."""
+    limits = snijder.queue.CategoryLimits(queued=2, core_hours=3.5, walltime=60)
+    queue = snijder.queue.JobQueue(limits=limits)
+    queue.append(joblist[0])
+    queue.append(joblist[1])
+    with pytest.raises(snijder.queue.QuotaExceeded, match="limit of 2 queued jobs"):
+        queue.append(joblist[2])
+    # processing jobs don't count as queued, but for the core-hours:
+    queue.next_job()
+    queue.append(joblist[2])
+    assert queue.core_hours["u000"] == 3
+    queue.next_job()
+    joblist[3]["walltime"] = 30
+    joblist[3]["cores"] = 8
+    with pytest.raises(snijder.queue.QuotaExceeded, match="3.5 core-hours"):
+        queue.append(joblist[3])
+    joblist[3]["cores"] = 7
+    queue.append(joblist[3])
+    assert queue.core_hours == {"u000": 3, "u111": 3.5}
+    del joblist[3]["walltime"]
+    del joblist[3]["cores"]
+
+
+def test_priority(joblist):
+    """Test jobs of a category being served by their effective priority."""
+    queue = snijder.queue.JobQueue()
+    joblist[1]["priority"] = 2
+    joblist[2]["priority"] = 5
+    joblist[6]["priority"] = -1
+    for job in joblist:
+        queue.append(job)
+    assert list(queue.queue["u000"]) == ["u000_ccc", "u000_bbb", "u000_aaa"]
+    assert queue.joblist() == [
+        "u000_ccc",
+        "u111_ddd",
+        "u000_bbb",
+        "u111_eee",
+        "u000_aaa",
+        "u111_fff",
+        "u111_ggg",
+    ]
+    assert queue.next_job()["uid"] == "u000_ccc"
+    queue.remove("u000_bbb")
+    assert queue.queue["u000"][0] == "u000_aaa"
+
+    # a retried job goes in front of the jobs having the same priority:
+    job = queue.next_job()
+    assert job["uid"] == "u111_ddd"
+    queue.remove(job["uid"])
+    queue.requeue(job)
+    assert list(queue.queue["u111"]) == ["u111_ddd", "u111_eee", "u111_fff", "u111_ggg"]
+
+
+def test_priority_aging(joblist):
+    """Test jobs with a low priority overtaking newer ones after waiting long."""
+    queue = snijder.queue.JobQueue(aging=2.0)
+    # submitted three hours earlier, so the effective priority is higher by 6:
+    joblist[0]["timestamp"] -= 3 * 3600
+    joblist[1]["priority"] = 5
+    joblist[2]["priority"] = 7
+    for job in joblist[:3]:
+        queue.append(job)
+    assert list(queue.queue["u000"]) == ["u000_ccc", "u000_aaa", "u000_bbb"]
+
+    queue = snijder.queue.JobQueue(aging=0)
+    for job in joblist[:3]:
+        queue.append(job)
+    assert list(queue.queue["u000"]) == ["u000_ccc", "u000_bbb", "u000_aaa"]
+    joblist[0]["timestamp"] += 3 * 3600
+    joblist[1]["priority"] = joblist[2]["priority"] = 0
+
+
+def test_coalesce(tmp_path):
+    """Test identical jobs being attached to the first one instead of queued."""
+    template, infile = tmp_path / "decon.hgsb", tmp_path / "image.h5"
+    template.write_text(u"setp -iterations 3\n")
+    infile.write_bytes(b"x" * 1024)
+    config = (
+        u"[snijderjob]\nversion = 7\nusername = %s\nuseremail = %s@mail.xy\n"
+        u"jobtype = hucore\ntimestamp = on_parsing\n\n"
+        u"[hucore]\ntasktype = preview\nexecutable = /usr/local/bin/hucore\n"
+        u"template = %s\n\n[inputfiles]\nfile1 = %s\n"
+    )
+    jobs = [
+        snijder.jobs.JobDescription(
+            config % (user, user, template, infile), srctype="string"
+        )
+        for user in ["u000", "u111", "u111", "u000", "u111"]
+    ]
+    uids = [job["uid"] for job in jobs]
+
+    queue = snijder.queue.JobQueue(coalesce=True)
+    queue.append(jobs[0])
+    queue.append(jobs[1])
+    assert queue.followers == {uids[0]: [uids[1]]}
+    assert "u111" not in queue.queue
+    assert len(queue) == 2
+    assert queue.joblist() == uids[:2]
+    assert jobs[1]["status"] == "queued"
+    # a follower is listed for its user, even if not in the user's category:
+    assert [job["id"] for job in queue.job_details("u111")] == uids[1:2]
+
+    # followers share the status of their (processing) leader:
+    assert queue.next_job() is jobs[0]
+    assert queue.next_job() is None
+    queue.set_jobstatus(jobs[0], "RUNNING")
+    assert jobs[1]["status"] == "RUNNING"
+    details = json.loads(queue.queue_details_json())["jobs"]
+    assert [job["id"] for job in details] == uids[:2]
+    queue.append(jobs[2])
+    queue.remove(uids[2])
+    assert queue.followers == {uids[0]: [uids[1]]}
+
+    # once the leader has terminated, its followers are released:
+    queue.set_jobstatus(jobs[0], "TERMINATED")
+    assert len(queue) == 1
+    assert queue.release_followers(uids[0]) == [jobs[1]]
+    assert len(queue) == 0
+    assert queue.leaders == {}
+
+    # removing a queued leader lets its first follower take over:
+    queue.append(jobs[3])
+    queue.append(jobs[4])
+    queue.remove(uids[3])
+    assert list(queue.queue["u111"]) == [uids[4]]
+    assert queue.leaders == {jobs[4]["identity"]: uids[4]}
+
+    # without coalescing, identical jobs are queued separately:
+    queue = snijder.queue.JobQueue()
+    queue.append(jobs[0])
+    queue.append(jobs[1])
+    assert queue.followers == {}
+    assert queue.joblist() == uids[:2]
+
+
+def test_find(joblist):
+    """Test the secondary indexes used by find() and the bulk removal of jobs."""
+    queue = snijder.queue.JobQueue()
+    for job in joblist:
+        queue.append(job)
+    assert queue.find(user="u000") == set(["u000_aaa", "u000_bbb", "u000_ccc"])
+    assert queue.find(tasktype="decon") == set(queue.jobs)
+    assert queue.find(infile=joblist[0]["infiles"][0]) == set(queue.jobs)
+    assert queue.find() == set(queue.jobs)
+    assert queue.find(user="u222") == set()
+
+    # status changes are tracked, also when the app has updated the job already:
+    queue.next_job()
+    joblist[0]["status"] = "RUNNING"
+    queue.set_jobstatus(joblist[0], "RUNNING")
+    assert queue.find(status="RUNNING") == set(["u000_aaa"])
+    assert queue.find(user="u000", status="queued") == set(["u000_bbb", "u000_ccc"])
+    details = queue.job_details("u000")
+    assert [job["id"] for job in details] == ["u000_aaa", "u000_bbb", "u000_ccc"]
+
+    # delete all queued jobs of a user at once:
+    removed = queue.remove_jobs(queue.find(user="u111", status="queued"))
+    assert sorted(job["uid"] for job in removed) == [
+        "u111_ddd",
+        "u111_eee",
+        "u111_fff",
+        "u111_ggg",
+    ]
+    assert queue.find(user="u111") == set()
+    assert "u111" not in queue.indexes["user"]
+    queue.set_jobstatus(joblist[0], "TERMINATED")
+    assert queue.find(status="RUNNING") == set()
+    assert sorted(queue.find()) == ["u000_bbb", "u000_ccc"]
+
+
+def test_route_deletion(jobfile_valid_decon_user01):
+    """Test routing deletion requests to the queue holding the job."""
+    jobs = [
+        snijder.jobs.JobDescription(jobfile_valid_decon_user01, "file")
+        for _ in range(3)
+    ]
+    queues = [snijder.queue.JobQueue("first"), snijder.queue.JobQueue("second")]
+    queues[0].append(jobs[0])
+    queues[1].append(jobs[1])
+    assert snijder.queue.route_deletion(jobs[1]["uid"], queues) is queues[1]
+    assert queues[1].deletion_list == set([jobs[1]["uid"]])
+    assert not queues[0].deletion_list
+
+    # a request for a job arriving later is kept until the job is added:
+    assert snijder.queue.route_deletion(jobs[2]["uid"], queues) is None
+    queues[0].append(jobs[2])
+    assert queues[0].deletion_list == set([jobs[2]["uid"]])
+    assert queues[0].process_deletion_list() == [jobs[2]]
+
+    # requests for unknown jobs are kept by each queue (only), until they expire:
+    assert snijder.queue.route_deletion("zzzz", queues) is None
+    assert "zzzz" in queues[1].unrouted
+    assert "zzzz" not in snijder.queue.JobQueue().unrouted
+    queues[0].expire_deletions(time.time() + 599)
+    assert "zzzz" in queues[0].unrouted
+    queues[0].expire_deletions(time.time() + 601)
+    assert "zzzz" not in queues[0].unrouted
+
+    # removed jobs are not routed anymore:
+    assert queues[1].process_deletion_list() == [jobs[1]]
+    assert snijder.queue.route_deletion(jobs[1]["uid"], queues) is None
@@ -0,0 +1,63 @@
+"""Tests for the snijder.retry module."""
+
+# pylint: disable-msg=invalid-name
+
+from __future__ import print_function
+
+import snijder.retry
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+def fake_job(exitcode, signal=0, retries=0, tasktype="decon"):
+    """Helper function to assemble a (minimal) terminated job dict."""
+    job = {
+        "uid": "u000_aaa",
+        "tasktype": tasktype,
+        "exitcode": exitcode,
+        "signal": signal,
+        "retries": retries,
+    }
+    return job
+
+
+def test_policy_for():
+    """Test selecting the retry policy by tasktype."""
+    policy = snijder.retry.policy_for(fake_job(1, tasktype="decon"))
+    assert policy.max_retries == 3
+    assert 165 in policy.permanent
+    assert 137 in policy.transient
+
+    policy = snijder.retry.policy_for(fake_job(1, tasktype="sleep"))
+    assert policy.max_retries == 0
+
+
+def test_retry_delay(caplog):
+    """Test the retry decisions and the exponential backoff."""
+    policy = snijder.retry.RetryPolicy(
+        max_retries=3, backoff=10, max_backoff=25, permanent=[165], transient=[75]
+    )
+
+    # successful and explicitly killed jobs are never retried:
+    assert policy.retry_delay(fake_job(0)) is None
+    assert policy.retry_delay(fake_job(None), killed=True) is None
+
+    # permanent failures fail fast, even if the exit code looks like a signal:
+    caplog.clear()
+    assert policy.retry_delay(fake_job(165)) is None
+    assert "failed permanently" in caplog.text
+    assert policy.retry_delay(fake_job(165, signal=37)) is None
+
+    # as are other exit codes and jobs that couldn't be launched at all:
+    assert policy.retry_delay(fake_job(1)) is None
+    assert policy.retry_delay(fake_job(None)) is None
+
+    # transient failures are retried with increasing delays:
+    assert policy.retry_delay(fake_job(75)) == 10
+    assert policy.retry_delay(fake_job(None, signal=15, retries=1)) == 20
+    assert policy.retry_delay(fake_job(137, signal=9, retries=2)) == 25
+
+    # until the maximum number of retries is reached:
+    caplog.clear()
+    assert policy.retry_delay(fake_job(75, retries=3)) is None
+    assert "giving up after 3 retries" in caplog.text
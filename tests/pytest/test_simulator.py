@@ -0,0 +1,99 @@
+"""Tests for the snijder.simulator module."""
+
+# pylint: disable-msg=invalid-name
+
+from __future__ import print_function
+
+import time
+
+import snijder.simulator
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+def workload_two_users():
+    """Helper function providing a workload of two users with fixed durations.
+
+    User 'alice' submits three jobs at once, 'bob' a single one a second later.
+    """
+    workload = [{"time": 0, "user": "alice", "duration": 10} for _ in range(3)]
+    workload.append({"time": 1, "user": "bob", "duration": 10})
+    return workload
+
+
+def test_virtual_clock():
+    """Test replacing the time functions by the virtual clock."""
+    clock = snijder.simulator.VirtualClock(100)
+    with clock.installed():
+        assert time.time() == 100
+        time.sleep(5)
+        assert time.time() == 105
+    assert time.time() > 1000000000
+    assert clock.now == 105
+
+
+def test_sample_duration():
+    """Test sampling durations from the distributions."""
+    rng = snijder.simulator.random.Random(42)
+    assert snijder.simulator.sample_duration(rng, 60, "constant") == 60
+    samples = [snijder.simulator.sample_duration(rng, 60) for _ in range(5000)]
+    assert 55 < sum(samples) / len(samples) < 65
+    with pytest.raises(ValueError):
+        snijder.simulator.sample_duration(rng, 60, "uniform")
+
+
+def test_jain_index():
+    """Test the fairness index."""
+    assert snijder.simulator.jain_index([2.0, 2.0, 2.0]) == 1.0
+    assert snijder.simulator.jain_index([1.0, 0.0]) == 0.5
+
+
+def test_simulation_roundrobin():
+    """Test simulating the round-robin scheduler on a single slot."""
+    report = snijder.simulator.Simulation(workload_two_users()).run()
+    assert report["jobs"] == 4
+    assert report["makespan"] == 40
+    assert report["utilization"] == 1.0
+    # bob's category is appended behind alice's, so his job runs third:
+    assert report["users"]["bob"]["max_wait"] == 19
+    assert report["users"]["alice"]["max_wait"] == 30
+
+
+def test_simulation_fifo():
+    """Test simulating the first-come-first-served scheduler."""
+    simulation = snijder.simulator.Simulation(workload_two_users(), scheduler="fifo")
+    report = simulation.run()
+    assert report["makespan"] == 40
+    # bob has to wait until all of alice's jobs are done:
+    assert report["users"]["bob"]["max_wait"] == 29
+    assert report["users"]["alice"]["max_wait"] == 20
+    assert not simulation.queue.jobs
+
+
+def test_simulation_slots():
+    """Test simulating several concurrently running jobs."""
+    report = snijder.simulator.Simulation(workload_two_users(), slots=2).run()
+    assert report["makespan"] == 20
+    assert report["utilization"] == 1.0
+    assert report["users"]["bob"]["max_wait"] == 9
+
+
+def test_simulation_retries():
+    """Test that failing jobs are retried according to the retry policy."""
+    workload = [
+        {"time": 0, "user": "carol", "duration": 10, "exitcode": 137, "signal": 9}
+    ]
+    report = snijder.simulator.Simulation(workload).run()
+    assert report["jobs"] == 1
+    # the 'decon' policy retries three times, with delays of 60, 120 and 240 s:
+    assert report["makespan"] == 460
+    assert report["users"]["carol"]["mean_slowdown"] == 460 / 40.0
+
+
+def test_format_report():
+    """Test the human readable report."""
+    report = snijder.simulator.Simulation(workload_two_users()).run()
+    text = snijder.simulator.format_report(report)
+    assert "roundrobin" in text
+    assert "alice" in text
+    assert "bob" in text
@@ -14,7 +14,10 @@ import time
 import logging
 import shutil
 
+import snijder.jobs
 import snijder.logger
+import snijder.memo
+import snijder.placement
 import snijder.queue
 import snijder.spooler
 import snijder.cmdline
@@ -396,6 +399,221 @@ def test_check_gc3conf(tmp_path, gc3conf_with_basedir):
         snijder.spooler.JobSpooler.check_gc3conf(str(gc3conf))
 
 
+def test_multiple_resources(tmp_path, gc3conf_with_basedir):
+    """Test setting up a spooler with multiple enabled gc3 resources."""
+    snijder_basedir = pathlib2.Path(tmp_path) / "snijder"
+    config = gc3conf_with_basedir(str(snijder_basedir))
+    # add a copy of the 'localhost' resource, plus a disabled one:
+    resource = config[config.index("[resource/localhost]") :]
+    config += resource.replace("localhost", "workstation").replace(
+        "max_cores = 2", "max_cores = 8"
+    )
+    config += resource.replace("localhost", "offline").replace("= yes", "= no")
+    gc3conf = tmp_path / "gc3conf_multi.conf"
+    gc3conf.write_text(config)
+
+    cfg = snijder.spooler.JobSpooler.check_gc3conf(str(gc3conf))
+    assert cfg["resources"] == {"localhost": 2, "workstation": 8}
+
+    spooler = prepare_spooler(snijder_basedir, gc3conf)
+    assert isinstance(spooler.engine, snijder.placement.ResourcePool)
+    assert [res.name for res in spooler.engine.resources] == [
+        "localhost",
+        "workstation",
+    ]
+    assert spooler.free_slots(spooler.engine_status()) == 2
+
+
+def test_serve_memoized(tmp_path, gc3conf_with_basedir, jobfile_valid_decon_user01):
+    """Test completing jobs from the result cache instead of dispatching them."""
+    snijder_basedir, gc3conf = prepare_basedir_and_gc3conf(
+        tmp_path, gc3conf_with_basedir
+    )
+    spooler = prepare_spooler(snijder_basedir, gc3conf)
+    spooler.memo = snijder.memo.ResultCache(str(tmp_path / "cache"))
+    template, infile = tmp_path / "decon.hgsb", tmp_path / "image.h5"
+    template.write_text(u"setp -iterations 3\n")
+    infile.write_bytes(b"x" * 1024)
+    results = tmp_path / "results"
+    results.mkdir()
+    (results / "stdout.txt").write_text(u"done\n")
+
+    # use the content of the jobfile, so it doesn't get moved to 'done':
+    with open(jobfile_valid_decon_user01, "r") as jobfile:
+        job = snijder.jobs.JobDescription(jobfile.read(), "string")
+    job.update(template=str(template), infiles=[str(infile)])
+    spooler.queue.append(job)
+    key = spooler.memo.identity(job)
+    spooler.memo.store(key, str(results))
+
+    assert spooler.dispatch_next() is None
+    assert len(spooler.queue) == 0
+    assert job["memo_key"] == key
+    assert job["exitcode"] == 0
+    resultdir = os.path.join(spooler.gc3cfg["spooldir"], "results_%s" % job["uid"])
+    assert os.path.exists(os.path.join(resultdir, "stdout.txt"))
+
+
+def test_serve_memoized_followers(
+    tmp_path, gc3conf_with_basedir, jobfile_valid_decon_user01
+):
+    """Test completing the followers of a job served from the result cache."""
+    snijder_basedir, gc3conf = prepare_basedir_and_gc3conf(
+        tmp_path, gc3conf_with_basedir
+    )
+    spooler = prepare_spooler(snijder_basedir, gc3conf)
+    spooler.queue.coalesce = True
+    spooler.memo = snijder.memo.ResultCache(str(tmp_path / "cache"))
+    template, infile = tmp_path / "decon.hgsb", tmp_path / "image.h5"
+    template.write_text(u"setp -iterations 3\n")
+    infile.write_bytes(b"x" * 1024)
+    results = tmp_path / "results"
+    results.mkdir()
+    (results / "stdout.txt").write_text(u"done\n")
+
+    with open(jobfile_valid_decon_user01, "r") as jobfile:
+        jobcfg = jobfile.read()
+    jobs = [snijder.jobs.JobDescription(jobcfg, "string") for _ in range(2)]
+    for job in jobs:
+        job.update(template=str(template), infiles=[str(infile)])
+        spooler.queue.append(job)
+    assert spooler.queue.followers == {jobs[0]["uid"]: [jobs[1]["uid"]]}
+    spooler.memo.store(spooler.memo.identity(jobs[0]), str(results))
+
+    # the follower is completed together with its leader:
+    assert spooler.dispatch_next() is None
+    assert len(spooler.queue) == 0
+    assert spooler.queue.jobs == {}
+    assert spooler.queue.followers == {}
+    assert jobs[1]["exitcode"] == 0
+    resultdir = os.path.join(spooler.gc3cfg["spooldir"], "results_%s" % jobs[1]["uid"])
+    assert os.path.exists(os.path.join(resultdir, "stdout.txt"))
+
+
+def test_drain_and_resume(tmp_path, gc3conf_with_basedir, jobfile_valid_sleep):
+    """Test draining the spooler, recording the queue and resuming it."""
+    snijder_basedir, gc3conf = prepare_basedir_and_gc3conf(
+        tmp_path, gc3conf_with_basedir
+    )
+    spooler = prepare_spooler(snijder_basedir, gc3conf)
+    spooler.drain(deadline=60)
+    assert spooler.status == "drain"
+    assert spooler.drain_until > time.time()
+    # nothing is running, so draining completes right away:
+    assert spooler.drain_step()
+
+    curdir = pathlib2.Path(spooler.dirs["cur"])
+    for name in ["aaa", "bbb", "ccc"]:
+        (curdir / (name + ".jobfile")).write_text(u"")
+    with open(jobfile_valid_sleep, "r") as jobfile:
+        jobcfg = jobfile.read()
+    for name in ["ccc", "aaa"]:
+        job = snijder.jobs.JobDescription(jobcfg, "string")
+        job.fname = str(curdir / (name + ".jobfile"))
+        spooler.queue.append(job)
+    assert spooler.persist_queue() == ["ccc.jobfile", "aaa.jobfile"]
+
+    # 'bbb' is not recorded (e.g. it was running), so it's resumed first:
+    spooler.dirs["curfiles"] = sorted(os.listdir(str(curdir)))
+    assert spooler.pending_jobfiles() == ["bbb.jobfile", "ccc.jobfile", "aaa.jobfile"]
+
+
+def test_update_apps(tmp_path, gc3conf_with_basedir, jobfile_valid_sleep):
+    """Test harvesting several apps terminating in the same iteration."""
+
+    class FakeApp(object):  # pylint: disable-msg=too-few-public-methods
+        """Minimal app that has terminated (successfully)."""
+
+        def __init__(self, job):
+            self.job = job
+            self.killed = False
+            self.dispatched = time.time()
+            self.suspended_time = 0.0
+            self.output_dir = str(tmp_path / ("results_%s" % job["uid"]))
+
+        @staticmethod
+        def status_changed():
+            """Report the termination."""
+            return "TERMINATED"
+
+    snijder_basedir, gc3conf = prepare_basedir_and_gc3conf(
+        tmp_path, gc3conf_with_basedir
+    )
+    spooler = prepare_spooler(snijder_basedir, gc3conf)
+    with open(jobfile_valid_sleep, "r") as jobfile:
+        jobcfg = jobfile.read()
+    for _ in range(3):
+        job = snijder.jobs.JobDescription(jobcfg, "string")
+        job["exitcode"], job["signal"] = 0, 0
+        spooler.queue.append(job)
+        spooler.apps.append(FakeApp(spooler.queue.next_job()))
+    assert len(spooler.queue) == 3
+
+    # all of them are harvested right away, none is skipped:
+    spooler.update_apps()
+    assert spooler.apps == []
+    assert len(spooler.queue) == 0
+
+
+def test_dispatch_unplaceable(tmp_path, gc3conf_with_basedir, jobfile_valid_sleep):
+    """Test deferring a job that can't be placed, removing its cgroup."""
+
+    class FakeCgroup(object):  # pylint: disable-msg=too-few-public-methods
+        """Cgroup remembering whether it has been removed."""
+
+        def __init__(self):
+            self.removed = False
+
+        @staticmethod
+        def wrap(arguments):
+            """Leave the command unchanged."""
+            return arguments
+
+        def remove(self):
+            """Remember the removal."""
+            self.removed = True
+
+    class FakeManager(object):  # pylint: disable-msg=too-few-public-methods
+        """Cgroup manager handing out fake cgroups."""
+
+        def __init__(self):
+            self.created = list()
+
+        def create(self, *_):
+            """Create a fake cgroup."""
+            self.created.append(FakeCgroup())
+            return self.created[-1]
+
+    def add(_):
+        """Refuse to place any app."""
+        raise RuntimeError("no free cores")
+
+    snijder_basedir, gc3conf = prepare_basedir_and_gc3conf(
+        tmp_path, gc3conf_with_basedir
+    )
+    spooler = prepare_spooler(snijder_basedir, gc3conf)
+    spooler.cgroups = FakeManager()
+    spooler.engine.add = add
+    job = snijder.jobs.JobDescription(jobfile_valid_sleep, "file")
+    spooler.queue.append(job)
+    assert spooler.dispatch_next() is None
+    assert spooler.cgroups.created[0].removed
+    assert spooler.apps == []
+    assert job["not_before"] > time.time()
+    assert job.get("retries", 0) == 0
+
+
+def test_read_deadline(tmp_path):
+    """Test reading the deadline from a drain request file."""
+    request = tmp_path / "drain"
+    request.write_text(u"")
+    assert snijder.spooler.JobSpooler.read_deadline(str(request)) is None
+    request.write_text(u"3600\n")
+    assert snijder.spooler.JobSpooler.read_deadline(str(request)) == 3600.0
+    request.write_text(u"soon")
+    assert snijder.spooler.JobSpooler.read_deadline(str(request)) is None
+
+
 def test_setup_engine_and_status(caplog, tmp_path, gc3conf_with_basedir):
     """Set up a spooler with a pre-existing basedir and check the engine status."""
     snijder_basedir = tmp_path / "snijder"
@@ -623,16 +841,13 @@ def test_remove_nonexisting_job(caplog, snijder_spooler, jobfile_valid_delete):
     assert "Error reading job description file" not in caplog.text
     assert message_timeout(caplog, "Received job deletion", "deletion-request", 0.1)
 
+    # the request is kept (in case the job arrives later) until it expires:
     assert message_timeout(
-        caplog, "Trying to remove job", "request-processing", timeout=2, sleep_for=0.1
-    )
-    assert message_timeout(
-        caplog,
-        "Job not found, discarding the request",
-        "request being discarded",
-        timeout=2,
-        sleep_for=0.1,
+        caplog, "No queue holds job", "request-routing", timeout=2, sleep_for=0.1
     )
+    assert "Trying to remove job" not in caplog.text
+    snijder_spooler.spooler.queue.expire_deletions(time.time() + 3600)
+    assert "Discarding the deletion request for unknown job" in caplog.text
 
 
 @pytest.mark.runjobs
@@ -0,0 +1,153 @@
+"""Tests for the snijder.trace module."""
+
+# pylint: disable-msg=invalid-name
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import threading
+import time
+from hashlib import sha1
+
+import snijder.jobs
+import snijder.queue
+import snijder.spooler
+import snijder.trace
+
+import pytest  # pylint: disable-msg=unused-import
+
+
+def fake_queue_manager(spooldirs, stop):
+    """Helper function mimicking a queue manager finishing each job immediately.
+
+    Moves every jobfile from the 'new' to the 'done' spooling directory, naming it
+    after the UID the real queue manager would assign, until `stop` is set.
+    """
+    while not stop.is_set():
+        for fname in os.listdir(spooldirs["new"]):
+            src = os.path.join(spooldirs["new"], fname)
+            with open(src, "r") as jobfile:
+                content = jobfile.read()
+            if not content:
+                # the file is still being written, pick it up in the next round:
+                continue
+            uid = sha1(content).hexdigest()
+            shutil.move(src, os.path.join(spooldirs["done"], uid + ".jobfile"))
+        time.sleep(0.01)
+
+
+def test_record_jobfiles(
+    tmp_path, jobfile_valid_decon_fixedtimestamp, jobfile_valid_delete
+):
+    """Test recording the outcome of jobfiles processed by process_jobfile()."""
+    spooldirs = snijder.spooler.JobSpooler.setup_rundirs(str(tmp_path / "run"))
+    snijder.jobs.JobDescription.spooldirs = spooldirs
+    queues = {"hucore": snijder.queue.JobQueue()}
+    tracefile = str(tmp_path / "trace.jsonl")
+    snijder.trace.enable_recording(tracefile)
+    try:
+        for jobfile in [jobfile_valid_decon_fixedtimestamp, jobfile_valid_delete]:
+            shutil.copy(jobfile, spooldirs["new"])
+            fname = os.path.join(spooldirs["new"], os.path.basename(jobfile))
+            snijder.jobs.process_jobfile(fname, queues)
+        invalid = os.path.join(spooldirs["new"], "invalid.cfg")
+        with open(invalid, "w") as jobfile:
+            jobfile.write("no sections at all")
+        snijder.jobs.process_jobfile(invalid, queues)
+        job = queues["hucore"].next_job()
+        job["exitcode"], job["signal"] = 0, 0
+        snijder.trace.record_termination(job, 42.0)
+    finally:
+        snijder.trace.disable_recording()
+        snijder.jobs.JobDescription.spooldirs = None
+    assert snijder.trace.RECORDER is None
+
+    entries = snijder.trace.load_trace(tracefile)
+    assert [entry["outcome"] for entry in entries[:3]] == [
+        "queued",
+        "deletion",
+        "invalid",
+    ]
+    queued = entries[0]
+    assert queued["uid"] == job["uid"]
+    assert queued["user"] == "user01"
+    assert queued["tasktype"] == "decon"
+    assert queued["infiles"] == [None]
+    assert entries[1]["ids"] == ["bfbe38a1c35ec1e8ad7eb881f0258f8ce15d2721"]
+    assert "uid" not in entries[2]
+    assert entries[3]["event"] == "terminated"
+    assert entries[3]["runtime"] == 42.0
+
+
+def test_no_recording(tmp_path):
+    """Test that nothing is recorded unless recording has been enabled."""
+    snijder.trace.record_jobfile(str(tmp_path / "job.cfg"), "invalid")
+    assert snijder.trace.RECORDER is None
+
+
+def test_to_workload():
+    """Test converting a trace to a workload for the simulator."""
+    queued = {"event": "jobfile", "outcome": "queued"}
+    entries = [
+        dict(queued, time=10.0, uid="a", user="u1", tasktype="decon"),
+        {"event": "jobfile", "time": 12.0, "outcome": "invalid"},
+        dict(queued, time=13.0, uid="b", user="u2", tasktype="sleep"),
+        {"event": "terminated", "time": 90.0, "uid": "a", "runtime": 80, "exitcode": 0},
+    ]
+    workload = snijder.trace.to_workload(entries)
+    assert workload == [
+        dict(time=10.0, user="u1", tasktype="decon", duration=80, exitcode=0),
+        {"time": 13.0, "user": "u2"},
+    ]
+
+
+def test_replay(tmp_path):
+    """Test replaying a trace against a (fake) queue manager."""
+    spooldirs = snijder.spooler.JobSpooler.setup_rundirs(str(tmp_path))
+    queued = {"event": "jobfile", "outcome": "queued"}
+    entries = [
+        dict(queued, time=100.0 + i, uid="orig%s" % i, user="user0%s" % (i % 2))
+        for i in range(4)
+    ]
+    deletion = {"event": "jobfile", "outcome": "deletion", "ids": ["orig3"]}
+    entries.append(dict(deletion, time=104.0, uid="del", user="user00"))
+    stop = threading.Event()
+    worker = threading.Thread(target=fake_queue_manager, args=(spooldirs, stop))
+    worker.start()
+    try:
+        report = snijder.trace.replay(entries, str(tmp_path), speed=100, timeout=5)
+    finally:
+        stop.set()
+        worker.join()
+    assert report["submitted"] == 4
+    assert report["completed"] == 4
+    assert report["elapsed"] < 5
+    assert report["latency_max"] < 5
+    text = snijder.trace.format_replay_report(report)
+    assert "4 of 4 jobs completed" in text
+    # the deletion request refers to the UID of the replayed job:
+    for fname in os.listdir(spooldirs["done"]):
+        with open(os.path.join(spooldirs["done"], fname)) as jobfile:
+            content = jobfile.read()
+        if "deletejobs" in content:
+            assert "orig3" not in content.split("[deletejobs]")[1]
+
+
+def test_replay_synthetic(tmp_path):
+    """Test replaying a trace using synthetic jobs with the recorded runtimes."""
+    spooldirs = snijder.spooler.JobSpooler.setup_rundirs(str(tmp_path))
+    entries = [
+        {"event": "jobfile", "time": 1.0, "outcome": "queued", "uid": "orig"},
+        {"event": "terminated", "time": 61.0, "uid": "orig", "runtime": 60.0},
+    ]
+    entries[0]["user"] = "user01"
+    snijder.trace.replay(entries, str(tmp_path), speed=10, timeout=0, synthetic=True)
+    jobfiles = os.listdir(spooldirs["new"])
+    assert len(jobfiles) == 1
+    job = snijder.jobs.JobDescription(
+        os.path.join(spooldirs["new"], jobfiles[0]), "file"
+    )
+    assert job["type"] == "synthetic"
+    assert job["cpu"] == 6.0
@@ -0,0 +1,88 @@
+"""Benchmark the per-job logging overhead of the queue at different log levels.
+
+Every job is parsed, enqueued, retrieved via next_job() and terminated, which
+covers the debug calls in the hot paths of JobDescription and JobQueue. The
+messages are discarded by a NullHandler, so mostly the cost of assembling the log
+messages is measured. At WARN level the difference to a run with logging disabled
+entirely should be close to zero.
+
+NOTE: the runtime is dominated by the status JSON being regenerated on every
+status change, so the jobs are processed in small batches and the best of several
+repetitions is reported to keep the noise below the logging overhead.
+
+Usage:
+    python tests/sandbox/benchmark_logging.py [number_of_jobs]
+"""
+
+from __future__ import print_function
+
+import logging
+import sys
+import time
+
+import snijder.jobs
+import snijder.logger
+import snijder.queue
+
+JOBCFG = (
+    "[snijderjob]\n"
+    "version = 7\n"
+    "username = user%02i\n"
+    "useremail = user%02i@mail.xy\n"
+    "jobtype = hucore\n"
+    "timestamp = %i\n"
+    "\n"
+    "[hucore]\n"
+    "tasktype = decon\n"
+    "executable = /usr/local/bin/hucore\n"
+    "template = decon_it-3.hgsb\n"
+    "\n"
+    "[inputfiles]\n"
+    "file1 = data/sample.h5\n"
+)
+
+
+def run_jobs(count, batch=10, repeat=5):
+    """Parse, enqueue, dispatch and terminate `count` jobs, return the runtime."""
+    timings = list()
+    for _ in range(repeat):
+        queue = snijder.queue.JobQueue("benchmark")
+        started = time.time()
+        for i in range(count):
+            job = snijder.jobs.JobDescription(JOBCFG % (i % 10, i % 10, i), "string")
+            queue.append(job)
+            if queue.num_jobs_queued() < batch:
+                continue
+            while True:
+                job = queue.next_job()
+                if job is None:
+                    break
+                queue.set_jobstatus(job, "TERMINATED")
+        timings.append(time.time() - started)
+    return min(timings)
+
+
+def main():
+    """Run the benchmark for all log levels and print the per-job overhead."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    root = logging.getLogger()
+    root.removeHandler(snijder.logger.LOG_HANDLER)
+    root.addHandler(logging.NullHandler())
+    # the class variable is unset on purpose, avoid the corresponding message:
+    snijder.jobs.JobDescription.spooldirs = dict()
+
+    logging.disable(logging.CRITICAL)
+    baseline = run_jobs(count)
+    logging.disable(logging.NOTSET)
+    print("logging disabled: %8.1f us/job" % (baseline / count * 1e6))
+    for level in ["warn", "info", "debug"]:
+        snijder.logger.set_loglevel(level)
+        elapsed = run_jobs(count)
+        print(
+            "level %-8s   %8.1f us/job  (overhead: %8.1f us/job)"
+            % (level + ":", elapsed / count * 1e6, (elapsed - baseline) / count * 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main()